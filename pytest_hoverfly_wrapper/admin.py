@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+BASE_API_URL = "http://localhost:{}/api/v2"
+HOVERFLY_API_MODE = f"{BASE_API_URL}/hoverfly/mode"
+HOVERFLY_API_SIMULATION = f"{BASE_API_URL}/simulation"
+HOVERFLY_API_JOURNAL = f"{BASE_API_URL}/journal"
+HOVERFLY_API_STATE = f"{BASE_API_URL}/state"
+HOVERFLY_API_CACHE = f"{BASE_API_URL}/cache"
+
+ADMIN_TIMEOUT = 5
+JOURNAL_PAGE_SIZE = 500
+
+
+class HoverflyAdminClient:
+    """Python interface for Hoverfly's admin API.
+
+    All clients for the same admin port share one pooled, keep-alive session, so creating a client is cheap.
+
+    :int admin_port: the admin port of the Hoverfly instance
+    :float timeout: timeout, in seconds, for each request
+    """
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, admin_port, timeout=ADMIN_TIMEOUT):
+        self.admin_port = admin_port
+        self.timeout = timeout
+        self.session = self.session_for(admin_port)
+
+    @classmethod
+    def session_for(cls, admin_port):
+        # Imported here so that loading the plugin stays fast for sessions that never talk to Hoverfly
+        import requests  # pylint: disable=C0415
+        from requests.adapters import HTTPAdapter  # pylint: disable=C0415
+        from urllib3.util.retry import Retry  # pylint: disable=C0415
+
+        with cls._sessions_lock:
+            if admin_port not in cls._sessions:
+                session = requests.Session()
+                # Hoverfly runs locally, so there's no point routing admin calls through the environment's proxies
+                session.trust_env = False
+                # Refused connections mean Hoverfly isn't up (or has crashed), and callers decide what to do about
+                # that, so only retry requests that got through and then failed.
+                retry = Retry(total=2, connect=0, backoff_factor=0.1, status_forcelist=(502, 503, 504))
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8, max_retries=retry))
+                cls._sessions[admin_port] = session
+            return cls._sessions[admin_port]
+
+    @classmethod
+    def close_all(cls):
+        with cls._sessions_lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url.format(self.admin_port), **kwargs)
+
+    def responding(self):
+        return self.request("GET", HOVERFLY_API_MODE).status_code == 200
+
+    def set_mode(self, mode, arguments=None):
+        body = {"mode": mode}
+        if arguments is not None:
+            body["arguments"] = arguments
+        return self.request("PUT", HOVERFLY_API_MODE, json=body)
+
+    def get_simulation(self, **kwargs):
+        return self.request("GET", HOVERFLY_API_SIMULATION, **kwargs)
+
+    def put_simulation(self, data):
+        return self.request("PUT", HOVERFLY_API_SIMULATION, data=data)
+
+    def delete_simulation(self):
+        return self.request("DELETE", HOVERFLY_API_SIMULATION)
+
+    def get_journal(self, offset, limit):
+        response = self.request("GET", HOVERFLY_API_JOURNAL, params={"limit": limit, "offset": offset})
+        # e.g. when Hoverfly was started with the journal disabled
+        response.raise_for_status()
+        return response.json()
+
+    def search_journal(self, request_matcher):
+        """Journal entries whose requests match `request_matcher`, e.g. {"destination": [{"matcher": "glob", ...}]}."""
+        response = self.request("POST", HOVERFLY_API_JOURNAL, json={"request": request_matcher})
+        response.raise_for_status()
+        return response.json()
+
+    def delete_journal(self):
+        return self.request("DELETE", HOVERFLY_API_JOURNAL)
+
+    def delete_state(self):
+        return self.request("DELETE", HOVERFLY_API_STATE)
+
+    def delete_cache(self):
+        return self.request("DELETE", HOVERFLY_API_CACHE)
+
+
+class JournalAPI:
+    """Python interface for Hoverctl's REST API for accessing its journal.
+
+    :int admin_port: the admin port of the Hoverfly instance
+    :int page_size: the number of journal entries requested at a time
+    :int workers: the number of pages that get fetched concurrently once the size of the journal is known
+    """
+
+    def __init__(self, admin_port, page_size=JOURNAL_PAGE_SIZE, workers=4):
+        self.admin_port = admin_port
+        self.page_size = page_size
+        self.workers = workers
+        self.admin = HoverflyAdminClient(admin_port)
+
+    def delete(self):
+        self.admin.delete_journal()
+
+    def search(self, request_matcher):
+        """Journal entries whose requests match `request_matcher`, found by Hoverfly."""
+        return self.admin.search_journal(request_matcher)
+
+    def get_page(self, offset, limit=None):
+        return self.admin.get_journal(offset, limit or self.page_size)
+
+    def iter_entries(self):
+        """Yields journal entries in order, one at a time."""
+        first_page = self.get_page(0)
+        # Hoverfly may return fewer entries than asked for, so step by what it actually returned
+        step = len(first_page["journal"]) or self.page_size
+        offsets = iter(range(step, first_page["total"], step))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Only keep a bounded number of pages in flight, so memory use doesn't grow with the journal
+            pending = deque(executor.submit(self.get_page, offset, step) for offset in islice(offsets, self.workers))
+            yield from first_page["journal"]
+            while pending:
+                page = pending.popleft().result()
+                for offset in islice(offsets, 1):
+                    pending.append(executor.submit(self.get_page, offset, step))
+                yield from page["journal"]
+
+    def get(self):
+        journal = list(self.iter_entries())
+        return {"journal": journal, "offset": 0, "limit": len(journal), "total": len(journal)}
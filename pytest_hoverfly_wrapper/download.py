@@ -1,23 +1,56 @@
+import collections
 import contextlib
+import functools
+import hashlib
+import json
 import os
 import re
+import shutil
 import sys
+import tempfile
+import time
 import zipfile
 from subprocess import CalledProcessError, run
 
-import requests_cache
-
+from .locks import file_lock
 from .logger import logger
 
-session = requests_cache.CachedSession(".pytest_cache/hoverfly_cache")
-
-
-OUTPATH = "hoverfly_executables"  # configure via plugin options
 HOVERCTL = f"hoverctl{'.exe' if sys.platform.startswith('win') else ''}"
 HOVERFLY = f"hoverfly{'.exe' if sys.platform.startswith('win') else ''}"
+EXECUTABLES = (HOVERFLY, HOVERCTL)
+
+RELEASES_URL = "https://github.com/SpectoLabs/hoverfly/releases"
+# Describes an installed version, so that its executables can be checked without running them
+MANIFEST = "manifest.json"
+# Records the last check for the latest release, so that it doesn't have to be repeated by every pytest process
+LATEST_STAMP = "latest.json"
+# Records the version each bundle URL contained, so that a bundle URL's installation is found without downloading it
+SOURCES_STAMP = "sources.json"
+VALIDATION_TTL = 24 * 60 * 60
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+# Downloading a bundle can take a while on a slow connection, and the lock mustn't be mistaken for a stale one
+INSTALL_LOCK_TIMEOUT = 600
+
+
+class Installation(collections.namedtuple("Installation", ["version", "directory"])):
+    """Hoverfly executables of one version, installed in the cache."""
 
-HOVERCTL_PATH = os.path.join(OUTPATH, HOVERCTL)
-HOVERFLY_PATH = os.path.join(OUTPATH, HOVERFLY)
+    @property
+    def hoverfly(self):
+        return os.path.join(self.directory, HOVERFLY)
+
+    @property
+    def hoverctl(self):
+        return os.path.join(self.directory, HOVERCTL)
+
+
+def default_cache_dir():
+    """Where the executables are installed, shared by every checkout and virtualenv of the user."""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pytest-hoverfly")
 
 
 def get_platform_architecture():
@@ -37,68 +70,238 @@ def get_platform_architecture():
     return platform, architecture
 
 
-def binaries_valid():
-    """Binaries exist and are runnable"""
+def installed_version(directory):
+    """Version of the executables in `directory`, or None if they're missing or can't be run"""
     try:
-        output_1 = run([HOVERFLY_PATH, "-version"], capture_output=True, check=True)
-        run([HOVERCTL_PATH, "version"], capture_output=True, check=True)
-        version = output_1.stdout.decode("utf-8").split("\n")[0]
-        if version != get_latest_version():
-            logger.info("Version mismatch.")
-            return False
+        output_1 = run([os.path.join(directory, HOVERFLY), "-version"], capture_output=True, check=True)
+        run([os.path.join(directory, HOVERCTL), "version"], capture_output=True, check=True)
     except FileNotFoundError:
         logger.info("Files missing.")
-        return False
+        return None
     except CalledProcessError:
         logger.info("Error running files.")
-        return False
+        return None
     except PermissionError:
         logger.info("Files not executable.")
-        return False
-    logger.debug("Hoverfly executables are valid.")
-    return True
+        return None
+    return output_1.stdout.decode("utf-8").split("\n")[0]
+
+
+@functools.lru_cache(maxsize=None)
+def cached_session():
+    """Session that caches GitHub's responses. requests_cache is slow to import, so it's only imported once the
+    executables need checking against GitHub."""
+    import requests_cache  # pylint: disable=C0415
+
+    return requests_cache.CachedSession(".pytest_cache/hoverfly_cache")
 
 
 def get_latest_version():
-    resp = session.get("https://github.com/SpectoLabs/hoverfly/releases/latest", timeout=5, allow_redirects=False)
+    resp = cached_session().get(f"{RELEASES_URL}/latest", timeout=5, allow_redirects=False)
     resp.raise_for_status()
     latest_ver_url = resp.headers["Location"]
     return re.findall(r"[^/]+$", latest_ver_url)[0]
 
 
-@contextlib.contextmanager
-def download():
+def is_url(location):
+    return re.match(r"https?://", location) is not None
+
+
+def bundle_location(version, mirror=None):
+    """Where the bundle of `version` for this platform is downloaded from. A mirror, either a URL or a local directory,
+    is laid out like GitHub's release downloads: `<mirror>/<version>/<bundle>.zip`."""
     platform, architecture = get_platform_architecture()
-    # Define the remote file to retrieve
-    latest_version = get_latest_version()
-    remote_url = (
-        f"https://github.com/SpectoLabs/hoverfly/releases/download/"
-        f"{latest_version}/hoverfly_bundle_{platform}_{architecture}.zip"
-    )
-    # Define the local filename to save data
-    local_file = "hf.zip"
-    # Make http request for remote file data
-    data = session.get(remote_url, timeout=60)
-    data.raise_for_status()
-    # Save file data to local copy
-    with open(local_file, "wb") as file:
-        file.write(data.content)
+    bundle = f"hoverfly_bundle_{platform}_{architecture}.zip"
+    base = mirror or f"{RELEASES_URL}/download"
+    if is_url(base):
+        return f"{base.rstrip('/')}/{version}/{bundle}"
+    return os.path.join(base, version, bundle)
+
+
+@contextlib.contextmanager
+def open_bundle(location):
+    """Yields the chunks of the bundle at `location`, which is a URL or a local path."""
+    if is_url(location):
+        # The bundles are too big for the cached session
+        import requests  # pylint: disable=C0415
+
+        with requests.get(location, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            yield response.iter_content(DOWNLOAD_CHUNK_SIZE)
+    else:
+        with open(location, "rb") as file:
+            yield iter(functools.partial(file.read, DOWNLOAD_CHUNK_SIZE), b"")
+
+
+def fetch_bundle(location, path):
+    """Streams the bundle at `location` to `path`. Returns its SHA-256."""
+    sha = hashlib.sha256()
+    with open(path, "wb") as file, open_bundle(location) as chunks:
+        for chunk in chunks:
+            sha.update(chunk)
+            file.write(chunk)
+    return sha.hexdigest()
+
+
+def extract_executables(path_to_zip_file, directory):
+    """Extracts only the executables from a bundle, wherever they are in it."""
+    with zipfile.ZipFile(path_to_zip_file, "r") as zip_ref:
+        members = {os.path.basename(info.filename): info for info in zip_ref.infolist() if not info.is_dir()}
+        missing = [executable for executable in EXECUTABLES if executable not in members]
+        if missing:
+            raise RuntimeError(f"The Hoverfly bundle {path_to_zip_file} doesn't contain {', '.join(missing)}")
+        for executable in EXECUTABLES:
+            target = os.path.join(directory, executable)
+            with zip_ref.open(members[executable]) as source, open(target, "wb") as file:
+                shutil.copyfileobj(source, file, DOWNLOAD_CHUNK_SIZE)
+            os.chmod(target, 0o755)
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_manifest(directory):
+    """The manifest of the installation in `directory`, or None if it's missing, or its executables have changed"""
+    manifest = read_json(os.path.join(directory, MANIFEST))
+    if not manifest:
+        return None
     try:
-        yield local_file
+        hashes = {executable: file_hash(os.path.join(directory, executable)) for executable in EXECUTABLES}
+    except FileNotFoundError:
+        return None
+    return manifest if manifest["hashes"] == hashes else None
+
+
+def install(cache_dir, location, sha256=None, version=None):
+    """Installs the executables from the bundle at `location` into `<cache_dir>/<version>`. They're put together in a
+    staging directory and renamed into place, so other processes never see a partial installation.
+
+    :str sha256: the bundle's expected SHA-256
+    :str version: the version the bundle is expected to contain
+    """
+    staging = tempfile.mkdtemp(prefix=".install-", dir=cache_dir)
+    try:
+        logger.info("Installing Hoverfly from %s", location)
+        bundle = os.path.join(staging, "bundle.zip")
+        digest = fetch_bundle(location, bundle)
+        if sha256 and digest != sha256.lower():
+            raise RuntimeError(f"Checksum mismatch for {location}: expected {sha256}, got {digest}")
+        extract_executables(bundle, staging)
+        os.remove(bundle)
+        installed = installed_version(staging)
+        if installed is None:
+            raise RuntimeError(f"The Hoverfly executables from {location} can't be run")
+        if version and installed != version:
+            raise RuntimeError(f"{location} contains Hoverfly {installed}, not {version}")
+        hashes = {executable: file_hash(os.path.join(staging, executable)) for executable in EXECUTABLES}
+        write_json(
+            os.path.join(staging, MANIFEST),
+            {"version": installed, "source": location, "bundle_sha256": digest, "hashes": hashes},
+        )
+        # mkdtemp only gives the owner access
+        os.chmod(staging, 0o755)
+        directory = os.path.join(cache_dir, installed)
+        if read_manifest(directory):
+            # Already installed from another source. Other processes may be using it, so it's left alone.
+            return Installation(installed, directory)
+        if os.path.exists(directory):
+            # A broken installation of the same version. A directory can't be replaced in one go, so it's moved aside.
+            os.rename(directory, os.path.join(staging, "broken"))
+        os.rename(staging, directory)
+        shutil.rmtree(os.path.join(directory, "broken"), ignore_errors=True)
+        return Installation(installed, directory)
     finally:
-        os.remove(local_file)
+        shutil.rmtree(staging, ignore_errors=True)
 
 
-def unzip(path_to_zip_file):
-    with zipfile.ZipFile(path_to_zip_file, "r") as zip_ref:
-        zip_ref.extractall(OUTPATH)
-    for executable in (HOVERFLY_PATH, HOVERCTL_PATH):
-        if not os.access(executable, os.X_OK):
-            os.chmod(executable, 0o744)
+def find_installation(cache_dir, bundle_sha256):
+    """The valid installation made from the bundle with the SHA-256 `bundle_sha256`, if there is one"""
+    for name in os.listdir(cache_dir):
+        directory = os.path.join(cache_dir, name)
+        manifest = read_manifest(directory) if os.path.isdir(directory) else None
+        if manifest and manifest["bundle_sha256"] == bundle_sha256:
+            return Installation(manifest["version"], directory)
+    return None
+
+
+def latest_version(cache_dir, offline=False, ttl=VALIDATION_TTL):
+    """The latest Hoverfly release. GitHub is only asked every `ttl` seconds, and never when offline."""
+    stamp_path = os.path.join(cache_dir, LATEST_STAMP)
+    stamp = read_json(stamp_path)
+    if stamp and (offline or time.time() - stamp["checked"] < ttl):
+        return stamp["version"]
+    if offline:
+        raise RuntimeError("The latest Hoverfly version isn't known, and can't be looked up offline. Pin a version.")
+    version = get_latest_version()
+    write_json(stamp_path, {"version": version, "checked": time.time()})
+    return version
+
+
+def locate(cache_dir, version, mirror, offline, ttl, *, sha256=None):  # pylint: disable=R0913
+    """Where the bundle comes from, the version it should contain, and its valid installation, if there is one."""
+    bundle_zip = mirror if mirror and mirror.endswith(".zip") else None
+    if bundle_zip and not version:
+        # The version isn't known until the bundle is installed, so its installation is found by its checksum, or by
+        # the version the URL contained when it was installed
+        if sha256:
+            return bundle_zip, None, find_installation(cache_dir, sha256.lower())
+        if not is_url(bundle_zip):
+            return bundle_zip, None, find_installation(cache_dir, file_hash(bundle_zip))
+        version = (read_json(os.path.join(cache_dir, SOURCES_STAMP)) or {}).get(bundle_zip)
+        if version is None:
+            return bundle_zip, None, None
+    version = version or latest_version(cache_dir, offline, ttl)
+    directory = os.path.join(cache_dir, version)
+    installation = Installation(version, directory) if read_manifest(directory) else None
+    return bundle_zip or bundle_location(version, mirror), version, installation
+
 
+def manage_executables(  # pylint: disable=R0913
+    *, version=None, offline=False, ttl=VALIDATION_TTL, cache_dir=None, mirror=None, sha256=None
+):
+    """Makes sure valid Hoverfly executables are installed, and returns their `Installation`.
 
-def manage_executables():
-    if binaries_valid():
-        return
-    with download() as zip_file_name:
-        unzip(zip_file_name)
+    :str version: the Hoverfly version to use. Defaults to the latest release.
+    :bool offline: never contact GitHub, or any other URL
+    :int ttl: how long, in seconds, a check for the latest release is trusted for
+    :str cache_dir: where the executables are installed. Defaults to a cache shared by all the user's projects.
+    :str mirror: a URL or directory laid out like GitHub's release downloads, or the path of a bundle zip
+    :str sha256: the expected SHA-256 of the bundle
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    location, version, installation = locate(cache_dir, version, mirror, offline, ttl, sha256=sha256)
+    if installation is not None:
+        logger.debug("Hoverfly executables are valid.")
+        return installation
+    # Only one process installs; the others wait, and then find its installation
+    with file_lock(os.path.join(cache_dir, "install.lock"), timeout=INSTALL_LOCK_TIMEOUT):
+        location, version, installation = locate(cache_dir, version, mirror, offline, ttl, sha256=sha256)
+        if installation is not None:
+            return installation
+        if offline and is_url(location):
+            raise RuntimeError("Valid Hoverfly executables aren't installed, and can't be downloaded offline.")
+        installation = install(cache_dir, location, sha256, version)
+        if location == mirror and is_url(location):
+            sources_path = os.path.join(cache_dir, SOURCES_STAMP)
+            write_json(sources_path, {**(read_json(sources_path) or {}), location: installation.version})
+        return installation
@@ -0,0 +1,130 @@
+import functools
+import re
+from urllib.parse import urlsplit
+
+IGNORE = 1
+SENSITIVE = 2
+BLOCK = 4
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+# The scheme, and then a port or path, around a glob, e.g. `https://*.example.com:8080/path`
+GLOB_SURROUNDINGS = re.compile(r"^[a-z][a-z0-9+.-]*://|(?::\d*)?(?:/.*)?$")
+HOST_CACHE_SIZE = 4096
+
+
+def host_of(destination):
+    """The lower-case host name in a URL, or in a Hoverfly destination such as `example.com:8080`."""
+    if "://" not in destination:
+        destination = f"//{destination}"
+    try:
+        return urlsplit(destination).hostname or ""
+    except ValueError:
+        return destination.lower()
+
+
+def glob_to_regex(pattern):
+    """Translates a host glob into a regex that both Python and Hoverfly (RE2) understand.
+
+    `*` matches any run of characters, `?` matches one and `[...]` matches a set of characters, as in `fnmatch`.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == "*":
+            parts.append(".*")
+        elif char == "?":
+            parts.append(".")
+        elif char == "[" and "]" in pattern[i + 1 :]:
+            end = pattern.index("]", i + 1)
+            members = pattern[i:end].replace("\\", "\\\\")
+            parts.append(f"[^{members[1:]}]" if members.startswith("!") else f"[{members}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts)
+
+
+def _as_list(hosts):
+    return [hosts] if isinstance(hosts, str) else list(hosts or ())
+
+
+def normalise_entry(entry):
+    """The host of a list entry, which may be written as a URL or a destination, e.g. `https://bank.com/login`."""
+    entry = entry.strip().lower()
+    if GLOB_CHARACTERS.search(entry):
+        return GLOB_SURROUNDINGS.sub("", entry)
+    return host_of(entry)
+
+
+def is_single_label(host):
+    """Whether an entry is a bare label such as `google`, which matches any host containing it."""
+    return "." not in host and ":" not in host and host != "localhost"
+
+
+class HostPolicy:
+    """Decides which hosts are ignored when recording, sensitive, or blocked, compiled up front so that checking a URL
+    doesn't depend on how many hosts are listed.
+
+    A plain entry such as `example.com` matches that host and all of its subdomains, while a single label such as
+    `google` matches any host containing it. An entry containing glob characters, such as `*.example.*`, must match
+    the whole host. Ports are never part of the match, and entries
+    written as URLs or destinations, such as `https://bank.com` or `localhost:8080`, are reduced to their hosts.
+
+    :list ignore: hosts whose traffic isn't saved in recorded simulations
+    :list sensitive: hosts that must never be hit live in a simulated test
+    :list block: hosts that simulations block
+    """
+
+    def __init__(self, ignore=(), sensitive=(), block=()):
+        self.domains = {}
+        self.globs = {}
+        for flag, hosts in ((IGNORE, ignore), (SENSITIVE, sensitive), (BLOCK, block)):
+            for host in map(normalise_entry, _as_list(hosts)):
+                if host and not GLOB_CHARACTERS.search(host) and is_single_label(host):
+                    host = f"*{host}*"
+                if GLOB_CHARACTERS.search(host):
+                    self.globs.setdefault(flag, []).append(host)
+                elif host:
+                    self.domains[host] = self.domains.get(host, 0) | flag
+        self.patterns = [
+            (flag, re.compile("|".join(f"(?:{glob_to_regex(glob)})" for glob in globs) + "$"))
+            for flag, globs in self.globs.items()
+        ]
+        # Tests talk to a handful of hosts, so caching by host makes long journals and captures cheap
+        self.host_flags = functools.lru_cache(maxsize=HOST_CACHE_SIZE)(self._host_flags)
+
+    def destination_regex(self, flag):
+        """A regex matching the Hoverfly destinations (host and optional port) of one of the lists, in a form Hoverfly
+        understands, or None if the list is empty."""
+        alternatives = []
+        domains = sorted(domain for domain, flags in self.domains.items() if flags & flag)
+        if domains:
+            alternatives.append(r"(?:[^.:/]+\.)*(?:" + "|".join(re.escape(domain) for domain in domains) + ")")
+        alternatives.extend(glob_to_regex(glob) for glob in self.globs.get(flag, ()))
+        if not alternatives:
+            return None
+        return "^(?:" + "|".join(f"(?:{alternative})" for alternative in alternatives) + r")(?::\d+)?$"
+
+    def _host_flags(self, host):
+        flags = 0
+        labels = host.split(".")
+        for i in range(len(labels)):
+            flags |= self.domains.get(".".join(labels[i:]), 0)
+        for flag, pattern in self.patterns:
+            if not flags & flag and pattern.match(host):
+                flags |= flag
+        return flags
+
+    def flags(self, destination):
+        return self.host_flags(host_of(destination))
+
+    def ignored(self, destination):
+        return bool(self.flags(destination) & IGNORE)
+
+    def sensitive(self, destination):
+        return bool(self.flags(destination) & SENSITIVE)
+
+    def blocked(self, destination):
+        return bool(self.flags(destination) & BLOCK)
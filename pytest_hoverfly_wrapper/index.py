@@ -0,0 +1,84 @@
+import json
+import os
+
+from .locks import file_lock
+from .logger import logger
+from .storage import open_simulation
+
+INDEX_FILE = ".simulation_index.json"
+
+
+class SimulationIndex:
+    """Metadata about the simulations in a test data directory, so that they don't need parsing to find out how old
+    they are.
+
+    Each entry records a simulation's export time and number of pairs, along with the size and modification time of
+    its file. An entry is only trusted while the file still matches, so simulations edited or replaced outside the
+    plugin are picked up.
+
+    :str data_dir: the test data directory
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = os.path.abspath(data_dir)
+        self.path = os.path.join(self.data_dir, INDEX_FILE)
+        self._entries = None
+        self._entries_mtime = None
+
+    def key(self, sim_path):
+        """Path of the simulation relative to the data directory, or None if it's somewhere else."""
+        rel_path = os.path.relpath(os.path.abspath(sim_path), self.data_dir)
+        if rel_path.startswith(os.pardir):
+            return None
+        return rel_path.replace(os.sep, "/")
+
+    def entries(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._entries_mtime:
+            try:
+                with open(self.path) as file:
+                    self._entries = json.load(file)
+            except ValueError:
+                logger.warning("Ignoring corrupt simulation index %s", self.path)
+                self._entries = {}
+            self._entries_mtime = mtime
+        return self._entries
+
+    def lookup(self, sim_path):
+        """The index entry for a simulation, or None if there isn't an up-to-date one."""
+        key = self.key(sim_path)
+        entry = self.entries().get(key) if key else None
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(sim_path)
+        except FileNotFoundError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime"]):
+            return None
+        return entry
+
+    def time_exported(self, sim_path):
+        """When the simulation was exported. Raises `FileNotFoundError` if the simulation doesn't exist."""
+        entry = self.lookup(sim_path)
+        if entry is not None:
+            return entry["timeExported"]
+        with open_simulation(sim_path) as file:
+            sim = json.load(file)
+        if self.key(sim_path):
+            self.update(sim_path, sim["meta"].get("timeExported"), len(sim["data"]["pairs"]))
+        return sim["meta"].get("timeExported")
+
+    def update(self, sim_path, time_exported, pairs):
+        stat = os.stat(sim_path)
+        entry = {"timeExported": time_exported, "pairs": pairs, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        # Several workers may be recording at once, so read-modify-write the index under a lock
+        with file_lock(f"{self.path}.lock"):
+            self._entries_mtime = None
+            entries = {**self.entries(), self.key(sim_path): entry}
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(entries, file, indent=4, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
@@ -0,0 +1,34 @@
+import contextlib
+import os
+import time
+
+from .logger import logger
+
+
+@contextlib.contextmanager
+def file_lock(path, timeout=120, poll_interval=0.1):
+    """Cross-process lock, held for as long as `path` exists.
+
+    A lock file older than `timeout` is assumed to have been left behind by a process that died holding it.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            with contextlib.suppress(FileNotFoundError):
+                if time.time() - os.path.getmtime(path) > timeout:
+                    logger.warning("Removing stale lock %s", path)
+                    os.remove(path)
+                    continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for lock {path}") from None
+            time.sleep(poll_interval)
+    try:
+        os.write(fd, str(os.getpid()).encode("utf-8"))
+        os.close(fd)
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
@@ -0,0 +1,130 @@
+import contextlib
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .logger import logger
+
+LOG_SUBDIRECTORY = "tests"
+UNSAFE_CHARACTERS = re.compile(r"[^\w.-]+")
+MAX_NAME_LENGTH = 120
+# Logs waiting to be written are held in memory, so tests wait for the writer once this many are queued
+MAX_PENDING = 8
+
+
+def log_name(nodeid):
+    """A file name for the logs of the test `nodeid`, e.g. "tests_test_a.py_test_b_param-1" for
+    "tests/test_a.py::test_b[param-1]"."""
+    name = UNSAFE_CHARACTERS.sub("_", nodeid).strip("_")
+    if len(name) > MAX_NAME_LENGTH:
+        digest = hashlib.sha1(nodeid.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:MAX_NAME_LENGTH - len(digest) - 1]}_{digest}"
+    return name
+
+
+class LogWriter:
+    """Writes tests' logs to a directory on a background thread, so that tests don't wait for them.
+
+    Each log is written to a temporary file and renamed into place, so only complete logs are ever seen. After each
+    write, the oldest logs are removed until the directory is back within its limits.
+
+    :str directory: directory the logs get written to
+    :bool compress: gzip the logs
+    :int max_files: number of logs to keep. 0 means no limit.
+    :int max_bytes: total size of the logs to keep. 0 means no limit. The newest log is always kept.
+    :bool background: write logs on a background thread, rather than straight away
+    """
+
+    def __init__(self, directory, compress=False, max_files=0, max_bytes=0, background=True):  # pylint: disable=R0913
+        self.directory = directory
+        self.compress = compress
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hoverfly-logs") if background else None
+        self.pending = []
+
+    def path(self, name):
+        return os.path.join(self.directory, name + (".gz" if self.compress else ""))
+
+    def submit(self, name, write):
+        """Has `write` write the log `name` to a text file. Returns the path the log will be at."""
+        if self.executor is None:
+            self._write(name, write)
+            return self.path(name)
+        self.pending = [future for future in self.pending if not future.done()]
+        if len(self.pending) >= MAX_PENDING:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self._write, name, write))
+        return self.path(name)
+
+    def write_json(self, name, document):
+        return self.submit(name, functools.partial(json.dump, document, indent=4))
+
+    def write_spooled(self, name, spool):
+        """Copies the log `name` from `spool`, an open temporary text file, and closes it. Only the file handle waits
+        in the queue, so large logs aren't held in memory."""
+
+        def write(file):
+            with spool:
+                spool.seek(0)
+                shutil.copyfileobj(spool, file)
+
+        return self.submit(name, write)
+
+    def write_text(self, name, text):
+        return self.submit(name, lambda file: file.write(text))
+
+    def _write(self, name, write):
+        path = self.path(name)
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.compress:
+                file = gzip.open(temp_path, "wt", compresslevel=6, encoding="utf-8")
+            else:
+                file = open(temp_path, "w", encoding="utf-8")  # pylint: disable=R1732
+            with file:
+                write(file)
+            os.replace(temp_path, path)
+            self._enforce_limits()
+        except Exception:  # pylint: disable=W0703
+            logger.exception("Couldn't write log %s", path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+
+    def _enforce_limits(self):
+        if not self.max_files and not self.max_bytes:
+            return
+        logs = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".tmp") and entry.is_file():
+                    # Other workers may be removing logs at the same time
+                    with contextlib.suppress(FileNotFoundError):
+                        stat = entry.stat()
+                        logs.append((stat.st_mtime, stat.st_size, entry.path))
+        kept_files = kept_bytes = 0
+        for _, size, path in sorted(logs, reverse=True):
+            kept_files += 1
+            kept_bytes += size
+            over_limit = (self.max_files and kept_files > self.max_files) or (
+                self.max_bytes and kept_bytes > self.max_bytes
+            )
+            if over_limit and kept_files > 1:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def flush(self):
+        """Waits for the logs submitted so far to be written."""
+        wait(self.pending)
+        self.pending = []
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.pending = []
@@ -0,0 +1,117 @@
+import json
+import re
+from collections import OrderedDict
+
+DEDUPE_MODES = ("off", "collapse", "sequence")
+# Hoverfly starts every state key beginning with "sequence:" at "1" when a simulation is imported
+SEQUENCE_KEY = "sequence:normalised-{}"
+SEQUENCE_KEY_PATTERN = re.compile(r"sequence:normalised-(\d+)$")
+
+
+def last_sequence(pairs):
+    """The highest number of the sequences normalisation made in `pairs`, or 0 if there aren't any."""
+    numbers = [
+        int(match.group(1))
+        for pair in pairs
+        for match in map(SEQUENCE_KEY_PATTERN.match, pair["request"].get("requiresState") or {})
+        if match
+    ]
+    return max(numbers, default=0)
+
+
+def _serialise(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+class PairNormaliser:
+    """Shrinks captured pairs before they're saved.
+
+    Volatile headers are dropped from every pair, so that pairs differing only in them become identical. Then, in
+    "collapse" mode, repeats of an identical pair are dropped. In "sequence" mode, requests that always got the same
+    response are collapsed as well, while requests that got different responses are turned into a stateful sequence, so
+    that the simulation replays their responses in the order they were captured. "sequence" mode has to see all the
+    pairs before saving any of them, so holds them all in memory.
+
+    :str mode: one of `DEDUPE_MODES`
+    :list volatile_headers: names of headers to drop, in any case
+    :int sequences: how many sequences the simulation the pairs are added to already has, so that new sequences are
+        numbered after them
+    """
+
+    def __init__(self, mode="off", volatile_headers=(), *, sequences=0):
+        if mode not in DEDUPE_MODES:
+            raise ValueError(f"Unknown dedupe mode {mode!r}, expected one of {DEDUPE_MODES}")
+        self.mode = mode
+        self.volatile_headers = {header.lower() for header in volatile_headers}
+        self.sequences = sequences
+        self.removed_pairs = 0
+        self.removed_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off" or bool(self.volatile_headers)
+
+    def _drop_headers(self, headers):
+        for header in [header for header in headers if header.lower() in self.volatile_headers]:
+            del headers[header]
+
+    def _strip_volatile_headers(self, pair):
+        if not self.volatile_headers:
+            return pair
+        size = len(_serialise(pair))
+        self._drop_headers(pair["request"].get("headers") or {})
+        self._drop_headers(pair["response"].get("headers") or {})
+        self.removed_bytes += size - len(_serialise(pair))
+        return pair
+
+    def _remove(self, pair):
+        self.removed_pairs += 1
+        self.removed_bytes += len(_serialise(pair))
+
+    def normalise(self, pairs):
+        """Normalises an iterable of pairs, yielding the pairs to save."""
+        pairs = (self._strip_volatile_headers(pair) for pair in pairs)
+        if self.mode == "collapse":
+            yield from self._collapse(pairs)
+        elif self.mode == "sequence":
+            yield from self._sequence(pairs)
+        else:
+            yield from pairs
+
+    def _collapse(self, pairs):
+        seen = set()
+        for pair in pairs:
+            key = _serialise(pair)
+            if key in seen:
+                self._remove(pair)
+                continue
+            seen.add(key)
+            yield pair
+
+    def _sequence(self, pairs):
+        # Each request's responses, in the order they were captured, grouped in the order requests were first seen
+        by_request = OrderedDict()
+        for pair in pairs:
+            if pair["request"].get("requiresState"):
+                # Already part of a stateful capture, so order is taken care of
+                by_request.setdefault(_serialise(pair), []).append(pair)
+            else:
+                by_request.setdefault(_serialise(pair["request"]), []).append(pair)
+        for group in by_request.values():
+            responses = [_serialise(pair["response"]) for pair in group]
+            # Hoverfly keeps serving the last response of a sequence, so repeats of it at the end can go
+            end = len(group)
+            while end > 1 and responses[end - 1] == responses[end - 2]:
+                end -= 1
+            for pair in group[end:]:
+                self._remove(pair)
+            if end == 1:
+                yield group[0]
+                continue
+            self.sequences += 1
+            key = SEQUENCE_KEY.format(self.sequences)
+            for position, pair in enumerate(group[:end], start=1):
+                pair["request"]["requiresState"] = {key: str(position)}
+                if position < end:
+                    pair["response"]["transitionsState"] = {key: str(position + 1)}
+                yield pair
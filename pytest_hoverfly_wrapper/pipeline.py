@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import logger
+
+# Key of the teardown failures xdist workers send back to the controller
+WORKER_OUTPUT_KEY = "hoverfly_teardown_failures"
+
+
+class TeardownPipeline:
+    """Finishes the teardown work of tests that doesn't need their Hoverfly instance, such as filtering and saving a
+    captured simulation, on a background thread while the next test starts.
+
+    Work is done in the order it's submitted. Failures are logged and kept against the test they belong to, to be
+    reported at the end of the session.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hoverfly-teardown")
+        # Pending work that writes a file, keyed by the file's absolute path
+        self.writes = {}
+        self.failures = []
+
+    def submit(self, nodeid, func, *args, path=None):
+        """Runs `func(*args)` in the background on behalf of the test `nodeid`. `path` is the file it writes, if any."""
+        future = self.executor.submit(self._run, nodeid, func, args)
+        if path is not None:
+            self.writes[os.path.abspath(path)] = future
+        return future
+
+    def _run(self, nodeid, func, args):
+        try:
+            return func(*args)
+        except Exception as exc:  # pylint: disable=W0703
+            logger.exception("Teardown of %s failed", nodeid)
+            self.failures.append((nodeid, f"{type(exc).__name__}: {exc}"))
+            return None
+
+    def wait_for(self, paths):
+        """Waits for any pending writes to `paths`, so that they can be read."""
+        for path in paths:
+            future = self.writes.pop(os.path.abspath(path), None)
+            if future is not None:
+                if not future.done():
+                    logger.info("Waiting for %s to be saved", path)
+                future.result()
+
+    def drain(self):
+        """Waits for all the work submitted so far. Returns the failures so far."""
+        self.executor.submit(lambda: None).result()
+        self.writes = {}
+        return self.failures
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.writes = {}
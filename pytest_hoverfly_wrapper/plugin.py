@@ -1,31 +1,44 @@
 # -*- coding: utf-8 -*-
 
+import contextlib
+import functools
 import glob
 import json
 import os
 import re
 import subprocess
+import tempfile
 from datetime import datetime, timezone
 from pathlib import Path
+from urllib.parse import parse_qs
 
-import polling
 import pytest
-import requests
-from dateutil.parser import parse
 
-from .download import HOVERCTL_PATH, HOVERFLY_PATH, manage_executables
+from .admin import JOURNAL_PAGE_SIZE, HoverflyAdminClient, JournalAPI
+from .download import VALIDATION_TTL, manage_executables
+from .hosts import SENSITIVE, HostPolicy
+from .index import SimulationIndex
 from .logger import logger
-from .simulations import StaticSimulation
-
-BASE_API_URL = "http://localhost:{}/api/v2"
-HOVERFLY_API_MODE = f"{BASE_API_URL}/hoverfly/mode"
-HOVERFLY_API_SIMULATION = f"{BASE_API_URL}/simulation"
-HOVERFLY_API_JOURNAL = f"{BASE_API_URL}/journal"
+from .logs import LOG_SUBDIRECTORY, LogWriter, log_name
+from .normalisation import DEDUPE_MODES, PairNormaliser, last_sequence
+from .pipeline import WORKER_OUTPUT_KEY, TeardownPipeline
+from .ports import ENGINE_PORT_OFFSET, PORT_MODES, STANDBY_PORT_OFFSET, PortAllocator, fixed_ports, worker_id
+from .process import HoverflyCrashedException  # pylint: disable=W0611
+from .process import HoverflyLauncher, HoverflyProcess, HoverflyWatchdog
+from .replay import ENGINES, ReplayEngine, simulation_matcher, unsupported_reason
+from .resources import USER_PROPERTY as RESOURCES_PROPERTY
+from .resources import usage_report
+from .simulations import GeneratedSimulation, StaticSimulation, cached_simulation
+from .storage import FORMATS as SIMULATION_FORMATS
+from .storage import STREAM_CHUNK_SIZE as CAPTURE_CHUNK_SIZE
+from .storage import SimulationStorage, iter_text, load_simulation, open_simulation, read_simulation_bytes
+from .timings import USER_PROPERTY, PhaseTimer, TimingReport, timed_iter, timer_for
 
 JOURNAL_LIMIT = 2000
-
-HF_ADMIN_PORT = 8888
-PROXY_PORT = 8500
+MAX_RSS_MB = 1024
+# How much of each test's journal is fetched: none of it, all of it if the test failed, only the requests to sensitive
+# hosts, or all of it
+JOURNAL_LEVELS = ("none", "on-failure", "sensitive-only", "full")
 
 
 @pytest.fixture
@@ -70,6 +83,275 @@ def pytest_addoption(parser):
     parser.addoption(
         "--hoverfly-opts", action="store", default="", help="Additional arguments to pass to the Hoverfly executable"
     )
+    parser.addoption(
+        "--hoverfly-reuse",
+        action="store_true",
+        default=False,
+        help="Keep one Hoverfly instance running per worker and reset it between tests, instead of restarting it.",
+    )
+    parser.addoption(
+        "--hoverfly-offline",
+        action="store_true",
+        default=False,
+        help="Never check for or download new Hoverfly releases. The executables must already be installed, or come "
+        "from a local mirror.",
+    )
+    parser.addoption(
+        "--hoverfly-mirror",
+        action="store",
+        default=None,
+        help="URL or directory to download Hoverfly from, laid out like GitHub's release downloads "
+        "(<mirror>/<version>/<bundle>.zip), or the path of a Hoverfly bundle zip.",
+    )
+    parser.addini("hoverfly_offline", type="bool", default=False, help="Same as --hoverfly-offline.")
+    parser.addini(
+        "hoverfly_version", default="", help="Pins the Hoverfly version, e.g. v1.5.0. Defaults to the latest."
+    )
+    parser.addini(
+        "hoverfly_validation_ttl",
+        default=str(VALIDATION_TTL),
+        help="Seconds a check for the latest Hoverfly release is trusted for.",
+    )
+    parser.addini("hoverfly_mirror", default="", help="Same as --hoverfly-mirror.")
+    parser.addini(
+        "hoverfly_sha256", default="", help="The expected SHA-256 of the Hoverfly bundle. Installing fails otherwise."
+    )
+    parser.addini(
+        "hoverfly_cache_dir",
+        default="",
+        help="Where the Hoverfly executables are installed. Defaults to ~/.cache/pytest-hoverfly, which is shared by "
+        "all projects.",
+    )
+    parser.addini(
+        "hoverfly_simulation_format",
+        default="json",
+        help=f"Format recorded simulations are saved in: one of {', '.join(SIMULATION_FORMATS)}. Any format can be "
+        "read.",
+    )
+    parser.addini(
+        "hoverfly_blob_threshold",
+        default="0",
+        help="Response bodies longer than this are saved once, in a shared blob directory. 0 disables this.",
+    )
+    parser.addini(
+        "hoverfly_dedupe",
+        default="off",
+        help=f"How recorded simulations are deduplicated: one of {', '.join(DEDUPE_MODES)}.",
+    )
+    parser.addini(
+        "hoverfly_volatile_headers",
+        type="args",
+        default=[],
+        help="Request and response headers to leave out of recorded simulations, e.g. Date X-Request-Id.",
+    )
+    parser.addoption(
+        "--hoverfly-journal",
+        action="store",
+        default=None,
+        help=f"How much of each test's journal to fetch: one of {', '.join(JOURNAL_LEVELS)}. Only full and on-failure "
+        "write network logs, and none and on-failure skip the check for uncached requests to sensitive hosts.",
+    )
+    parser.addini("hoverfly_journal", default="full", help="Same as --hoverfly-journal.")
+    parser.addini(
+        "hoverfly_journal_size",
+        default=str(JOURNAL_LIMIT),
+        help="The most journal entries Hoverfly keeps. Older ones are dropped. 0 turns the journal off.",
+    )
+    parser.addini(
+        "hoverfly_max_rss",
+        default=str(MAX_RSS_MB),
+        help="Memory, in MB, above which a reused Hoverfly instance is restarted before the next test. 0 means never.",
+    )
+    parser.addini(
+        "hoverfly_journal_page_size",
+        default=str(JOURNAL_PAGE_SIZE),
+        help="Number of journal entries requested from Hoverfly at a time.",
+    )
+    parser.addini(
+        "hoverfly_log_compression",
+        type="bool",
+        default=False,
+        help="Gzip the network and Hoverfly logs kept for each test.",
+    )
+    parser.addini(
+        "hoverfly_log_max_files",
+        default="1000",
+        help="Number of per-test logs to keep. The oldest are removed first. 0 means no limit.",
+    )
+    parser.addini(
+        "hoverfly_log_max_bytes",
+        default="0",
+        help="Total size in bytes of the per-test logs to keep. The oldest are removed first. 0 means no limit.",
+    )
+    parser.addini(
+        "hoverfly_reuse", type="bool", default=False, help="Same as --hoverfly-reuse, but configured in the ini file."
+    )
+    parser.addoption(
+        "--hoverfly-prespawn",
+        action="store_true",
+        default=False,
+        help="Start the next test's Hoverfly instance in the background while the current test runs.",
+    )
+    parser.addini("hoverfly_prespawn", type="bool", default=False, help="Same as --hoverfly-prespawn.")
+    parser.addoption(
+        "--hoverfly-ports",
+        choices=PORT_MODES,
+        default=None,
+        help="dynamic: reserve free ports for each worker's Hoverfly. fixed: use 8500/8888 plus the worker number.",
+    )
+    parser.addini("hoverfly_ports", default="dynamic", help="Same as --hoverfly-ports.")
+    parser.addoption(
+        "--hoverfly-engine",
+        choices=ENGINES,
+        default=None,
+        help="python: replay simple simulations in-process, falling back to Hoverfly for anything else.",
+    )
+    parser.addini("hoverfly_engine", default="hoverfly", help="Same as --hoverfly-engine.")
+    parser.addoption(
+        "--hoverfly-fill-gaps",
+        action="store_true",
+        default=False,
+        help="Run tests whose simulations are up-to-date in spy mode, sending requests the simulation has no match for "
+        "to their real hosts, and add the responses to the simulation.",
+    )
+    parser.addini("hoverfly_fill_gaps", type="bool", default=False, help="Same as --hoverfly-fill-gaps.")
+    parser.addoption(
+        "--hoverfly-watchdog",
+        action="store_true",
+        default=False,
+        help="Fail a test as soon as its Hoverfly instance dies, rather than when it finishes. Uses SIGUSR1 on POSIX.",
+    )
+    parser.addini("hoverfly_watchdog", type="bool", default=False, help="Same as --hoverfly-watchdog.")
+    parser.addoption(
+        "--hoverfly-pipeline",
+        action="store_true",
+        default=False,
+        help="Save recorded simulations in the background while the next test starts. Failures are reported at the "
+        "end of the session.",
+    )
+    parser.addini("hoverfly_pipeline", type="bool", default=False, help="Same as --hoverfly-pipeline.")
+    parser.addoption(
+        "--hoverfly-timings",
+        action="store",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Time each phase of the plugin's work per test, and list the N slowest tests at the end of the session.",
+    )
+    parser.addoption(
+        "--hoverfly-timings-json",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Time each phase of the plugin's work per test, and save the timings to PATH as JSON.",
+    )
+
+
+def reuse_enabled(config):
+    return config.getoption("hoverfly_reuse") or config.getini("hoverfly_reuse")
+
+
+def simulation_storage(config):
+    threshold = non_negative_int(config, "hoverfly_blob_threshold")
+    return SimulationStorage(config.getini("hoverfly_simulation_format"), threshold)
+
+
+def pair_normaliser(config, existing_pairs=()):
+    """Normaliser for pairs that are added to `existing_pairs`, which have already been normalised."""
+    return PairNormaliser(
+        config.getini("hoverfly_dedupe"),
+        config.getini("hoverfly_volatile_headers"),
+        sequences=last_sequence(existing_pairs),
+    )
+
+
+def prespawn_enabled(config):
+    return config.getoption("hoverfly_prespawn") or config.getini("hoverfly_prespawn")
+
+
+def fill_gaps_enabled(config):
+    return config.getoption("hoverfly_fill_gaps") or config.getini("hoverfly_fill_gaps")
+
+
+def watchdog_enabled(config):
+    return config.getoption("hoverfly_watchdog") or config.getini("hoverfly_watchdog")
+
+
+def pipeline_enabled(config):
+    return config.getoption("hoverfly_pipeline") or config.getini("hoverfly_pipeline")
+
+
+def timings_enabled(config):
+    return bool(config.getoption("hoverfly_timings") or config.getoption("hoverfly_timings_json"))
+
+
+def replay_engine_enabled(config):
+    engine = config.getoption("hoverfly_engine") or config.getini("hoverfly_engine")
+    if engine not in ENGINES:
+        raise pytest.UsageError(f"hoverfly_engine must be one of {', '.join(ENGINES)}, not {engine!r}")
+    return engine == "python"
+
+
+def journal_level(config):
+    level = config.getoption("hoverfly_journal") or config.getini("hoverfly_journal")
+    if level not in JOURNAL_LEVELS:
+        raise pytest.UsageError(f"hoverfly_journal must be one of {', '.join(JOURNAL_LEVELS)}, not {level!r}")
+    return level
+
+
+def journal_size(config):
+    return non_negative_int(config, "hoverfly_journal_size")
+
+
+def max_rss(config):
+    """The memory, in bytes, above which a Hoverfly instance gets recycled. 0 means never."""
+    return non_negative_int(config, "hoverfly_max_rss") << 20
+
+
+def validation_ttl(config):
+    return non_negative_int(config, "hoverfly_validation_ttl")
+
+
+def journal_page_size(config):
+    size = non_negative_int(config, "hoverfly_journal_page_size")
+    if not size:
+        raise pytest.UsageError("hoverfly_journal_page_size must be at least 1")
+    return size
+
+
+def non_negative_int(config, name):
+    value = config.getini(name)
+    if not str(value).isdigit():
+        raise pytest.UsageError(f"{name} must be a whole number, not {value!r}")
+    return int(value)
+
+
+def validate_options(config):
+    """Checks the options that are otherwise only read once a test needs them, so that a bad value fails the session
+    straight away."""
+    for check in (
+        port_mode,
+        journal_page_size,
+        validation_ttl,
+        replay_engine_enabled,
+        log_limits,
+        journal_level,
+        journal_size,
+        max_rss,
+    ):
+        check(config)
+    try:
+        simulation_storage(config)
+        pair_normaliser(config)
+    except ValueError as exc:
+        raise pytest.UsageError(str(exc)) from exc
+
+
+def port_mode(config):
+    mode = config.getoption("hoverfly_ports") or config.getini("hoverfly_ports")
+    if mode not in PORT_MODES:
+        raise pytest.UsageError(f"hoverfly_ports must be one of {', '.join(PORT_MODES)}, not {mode!r}")
+    return mode
 
 
 @pytest.fixture
@@ -80,16 +362,52 @@ def test_log_directory():
     return directory
 
 
+def log_limits(config):
+    """The most per-test logs kept, as (number of files, total bytes). 0 means no limit."""
+    return non_negative_int(config, "hoverfly_log_max_files"), non_negative_int(config, "hoverfly_log_max_bytes")
+
+
+def log_writer(config, test_log_directory):
+    """The writer of the per-test logs, created the first time a test needs it."""
+    if config.hoverfly_log_writer is None:
+        max_files, max_bytes = log_limits(config)
+        config.hoverfly_log_writer = LogWriter(
+            os.path.join(test_log_directory, LOG_SUBDIRECTORY),
+            compress=config.getini("hoverfly_log_compression"),
+            max_files=max_files,
+            max_bytes=max_bytes,
+        )
+    return config.hoverfly_log_writer
+
+
+# Runs after the other plugins' deselection, e.g. by -k, so only the tests that will run are looked at
+@pytest.hookimpl(trylast=True)
 def pytest_collection_modifyitems(config, items):
     if config.getoption("refreshexpired"):
-        # Collect all tests that have expiring simulations
-        # (the up-to-date ones get skipped, which is simpler than parsing
-        # the simulation files to determine expired status during collection)
-        items[:] = [
-            item
-            for item in items
-            if item.get_closest_marker("simulated") and item.get_closest_marker("simulated").args[0].max_age
-        ]
+        # Collect all tests that have expiring simulations, except those the simulation index knows to be up-to-date.
+        # Any others that turn out to be up-to-date get skipped once they run.
+        index = SimulationIndex(TEST_DATA_DIR)
+        selected, deselected = [], []
+        for item in items:
+            marker = item.get_closest_marker("simulated")
+            if not marker or not marker.args[0].max_age:
+                continue
+            if simulation_up_to_date(index, marker.args[0]):
+                deselected.append(item)
+            else:
+                selected.append(item)
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+    # Checking the executables can mean a trip to GitHub, which runs that don't use Hoverfly shouldn't pay for
+    if not config.getoption("collectonly") and any(needs_hoverfly(item) for item in items):
+        ensure_executables(config)
+
+
+def simulation_up_to_date(index, sim_config):
+    """Whether the index knows the simulation to be up-to-date. Only works for the default test data directory."""
+    entry = index.lookup(os.path.join(TEST_DATA_DIR, sim_config.file))
+    return entry is not None and not simulation_expired(entry["timeExported"], sim_config.max_age)
 
 
 def pytest_configure(config):
@@ -98,47 +416,186 @@ def pytest_configure(config):
         "simulated(simulation_obj): Makes use of recorded responses which are sent in response to web requests "
         "made in tests, rather than receiving responses from their intended targets",
     )
-    manage_executables()
-
-
-def simulate(file, hf_port, admin_port):
+    validate_options(config)
+    # Hoverfly instances kept alive between tests, keyed by their (proxy port, admin port)
+    config.hoverfly_processes = {}
+    config.hoverfly_launcher = None
+    config.hoverfly_replay_engine = None
+    config.hoverfly_log_writer = None
+    # Where this process's Hoverfly instances write their own logs, once one has been started
+    config.hoverfly_log_directory = None
+    config.hoverfly_teardown_pipeline = TeardownPipeline() if pipeline_enabled(config) else None
+    # Failures of background teardown work, as (test node id, message), including those sent back by xdist workers
+    config.hoverfly_teardown_failures = []
+    # Workers attach timings to their reports, which the controller collects
+    if timings_enabled(config) and worker_id(config) is None:
+        config.pluginmanager.register(
+            TimingReport(config.getoption("hoverfly_timings"), config.getoption("hoverfly_timings_json")),
+            "hoverfly-timings",
+        )
+    config.hoverfly_port_allocator = PortAllocator()
+    # The (proxy port, admin port) pair reserved for this worker, once a test needs it
+    config.hoverfly_ports = None
+    # The executables are only checked once a collected test turns out to need Hoverfly
+    config.hoverfly_installation = None
+
+
+def needs_hoverfly(item):
+    """Whether a test uses Hoverfly, so needs the executables installed before it runs."""
+    return "setup_hoverfly" in getattr(item, "fixturenames", ()) or item.get_closest_marker("simulated") is not None
+
+
+def ensure_executables(config):
+    """The installation of the Hoverfly executables, which are checked once per session."""
+    if config.hoverfly_installation is None:
+        config.hoverfly_installation = manage_executables(
+            version=config.getini("hoverfly_version") or None,
+            offline=config.getoption("hoverfly_offline") or config.getini("hoverfly_offline"),
+            ttl=validation_ttl(config),
+            cache_dir=config.getini("hoverfly_cache_dir") or None,
+            mirror=config.getoption("hoverfly_mirror") or config.getini("hoverfly_mirror") or None,
+            sha256=config.getini("hoverfly_sha256") or None,
+        )
+    return config.hoverfly_installation
+
+
+def simulate(file, hf_port, admin_port, timer=None):
     logger.info("Simulation exists and is up-to-date. Importing.")
     if file:
-        with open(file) as file_:
-            data = file_.read().encode("utf-8")
-        requests.put(HOVERFLY_API_SIMULATION.format(admin_port), data, timeout=5)
+        with (timer or PhaseTimer()).phase("load_simulation"):
+            HoverflyAdminClient(admin_port).put_simulation(read_simulation_bytes(file))
     yield "simulate", hf_port, admin_port
 
 
-def record(file, node, proxy_port, admin_port, capture_arguments):
+def record(file, node, proxy_port, admin_port, capture_arguments, *, on_saved=None):  # pylint: disable=R0913
+    """Records a simulation while the test runs. Once the simulation is saved, `on_saved` is called with its export
+    time and number of pairs."""
     logger.info("Recording a simulation.")
     if not capture_arguments:
         capture_arguments = {"headersWhitelist": ["Cookie"]}
-    requests.put(
-        HOVERFLY_API_MODE.format(admin_port), json={"mode": "capture", "arguments": capture_arguments}, timeout=5
-    )
+    timer = timer_for(node)
+    with timer.phase("start_capture"):
+        HoverflyAdminClient(admin_port).set_mode("capture", capture_arguments)
     yield "record", proxy_port, admin_port
     if hasattr(node, "dont_save_sim"):
         logger.info("Test did not pass, not saving simulation")
         return
 
-    sim = requests.get(HOVERFLY_API_SIMULATION.format(admin_port), timeout=5).text
-
-    data = json.loads(sim)
-    new_pairs = []
-    hosts_to_ignore = [node.ignore] if isinstance(node.ignore, str) else node.ignore
-    for pair in data["data"]["pairs"]:
-        # Remove expiry from Set-Cookie headers in Hoverfly responses
-        set_cookie_header = pair["response"]["headers"].get("Set-Cookie", [])
-        set_cookie_header[:] = [re.sub(r"(E|e)xpires=[^;]+;*", "", c) for c in set_cookie_header]
-        # Allow us to differentiate cached responses from proxied ones.
-        pair["response"]["headers"]["Hoverfly-Cache-Served"] = ["True"]
-        # `value` is a URL
-        if not any(host in pair["request"]["destination"][0]["value"] for host in hosts_to_ignore):
-            new_pairs.append(pair)
-    data["data"]["pairs"] = new_pairs
-    with open(file, "w") as file_:
-        file_.write(json.dumps(data, indent=4, separators=(",", ": ")))
+    pipeline = getattr(node.config, "hoverfly_teardown_pipeline", None)
+    with timer.phase("save_capture"), HoverflyAdminClient(admin_port).get_simulation(stream=True) as response:
+        response.raise_for_status()
+        if pipeline is None:
+            # The capture is streamed straight to disk, so only one pair at a time is held in memory
+            save_capture(file, node, iter_text(response.iter_content(CAPTURE_CHUNK_SIZE)), on_saved)
+            return
+        # Only downloading the capture needs Hoverfly. It's spooled to disk, and saved in the background.
+        capture = tempfile.TemporaryFile()  # pylint: disable=R1732
+        for chunk in response.iter_content(CAPTURE_CHUNK_SIZE):
+            capture.write(chunk)
+    pipeline.submit(node.nodeid, save_spooled_capture, file, node, capture, on_saved, path=file)
+
+
+def save_spooled_capture(file, node, capture, on_saved):
+    with capture:
+        capture.seek(0)
+        save_capture(file, node, iter_text(iter(functools.partial(capture.read, CAPTURE_CHUNK_SIZE), b"")), on_saved)
+
+
+def save_capture(file, node, chunks, on_saved=None):
+    """Filters, normalises and saves a simulation captured by Hoverfly, read from an iterable of text chunks."""
+    host_policy = HostPolicy(ignore=node.ignore)
+    normaliser = pair_normaliser(node.config)
+
+    def transform(pairs):
+        pairs = (process_captured_pair(pair, host_policy) for pair in pairs)
+        return normaliser.normalise(pair for pair in pairs if pair is not None)
+
+    saved, skeleton = simulation_storage(node.config).save_stream(file, chunks, transform)
+    logger.info("Saved %s pairs to %s", saved, file)
+    if normaliser.enabled:
+        logger.info("Normalisation removed %s pairs and %s bytes", normaliser.removed_pairs, normaliser.removed_bytes)
+        node.user_properties.append(
+            ("hoverfly_normalisation", {"pairs": normaliser.removed_pairs, "bytes": normaliser.removed_bytes})
+        )
+    if on_saved is not None:
+        on_saved(skeleton["meta"].get("timeExported"), saved)
+
+
+def fill_gaps(file, node, proxy_port, admin_port, capture_arguments, *, on_saved=None):  # pylint: disable=R0913
+    """Replays a simulation while the test runs, sending the requests it has no match for to their real hosts. The
+    responses to those requests are then added to the simulation. Once the simulation is saved, `on_saved` is called
+    with its new export time and number of pairs."""
+    logger.info("Filling the gaps in a simulation.")
+    timer = timer_for(node)
+    # Hoverfly is already in spy mode, which serves matched requests from the simulation and forwards the rest
+    with timer.phase("load_simulation"):
+        HoverflyAdminClient(admin_port).put_simulation(read_simulation_bytes(file))
+    yield "fill", proxy_port, admin_port
+    if hasattr(node, "dont_save_sim"):
+        logger.info("Test did not pass, not saving simulation")
+        return
+
+    with timer.phase("save_capture"):
+        sim = load_simulation(file)
+        # The requests the simulation has a pair for were served from it, and the rest were sent to the real hosts
+        served = simulation_matcher(sim["data"]["pairs"])
+        live = [entry for entry in JournalAPI(admin_port).iter_entries() if not served(entry["request"])]
+        if not live:
+            logger.info("The simulation had no gaps")
+            return
+        headers_whitelist = (capture_arguments or {}).get("headersWhitelist", ["Cookie"])
+        host_policy = HostPolicy(ignore=node.ignore)
+        pairs = (process_captured_pair(journal_entry_to_pair(entry, headers_whitelist), host_policy) for entry in live)
+        new_pairs = [pair for pair in pairs if pair is not None]
+        # The simulation's pairs were normalised when they were saved, and their sequences mustn't be renumbered
+        normaliser = pair_normaliser(node.config, sim["data"]["pairs"])
+        sim["data"]["pairs"] += normaliser.normalise(new_pairs)
+        sim["meta"]["timeExported"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        simulation_storage(node.config).save(file, sim)
+    logger.info("Added %s pairs to %s", len(new_pairs), file)
+    if on_saved is not None:
+        on_saved(sim["meta"]["timeExported"], len(sim["data"]["pairs"]))
+
+
+def journal_entry_to_pair(entry, headers_whitelist=()):
+    """A simulation pair that replays a journal entry, matching its request exactly, as Hoverfly's capture mode
+    would. Only the headers in `headers_whitelist` are matched on."""
+    request = entry["request"]
+    matchers = {
+        field: [{"matcher": "exact", "value": request.get(field) or ""}]
+        for field in ("destination", "path", "method", "scheme", "body")
+    }
+    # Hoverfly matches repeated parameters against their values joined with semicolons
+    query = parse_qs(request.get("query") or "", keep_blank_values=True)
+    if query:
+        matchers["query"] = {
+            param: [{"matcher": "exact", "value": ";".join(values)}] for param, values in query.items()
+        }
+    whitelist = {header.lower() for header in headers_whitelist}
+    headers = {
+        header: [{"matcher": "exact", "value": ";".join(values)}]
+        for header, values in (request.get("headers") or {}).items()
+        if "*" in whitelist or header.lower() in whitelist
+    }
+    if headers:
+        matchers["headers"] = headers
+    response = {
+        key: entry["response"][key] for key in ("status", "body", "encodedBody", "headers") if key in entry["response"]
+    }
+    return {"request": matchers, "response": {**response, "templated": False}}
+
+
+def process_captured_pair(pair, host_policy):
+    """Prepares a pair captured by Hoverfly to be saved. Returns None if the pair shouldn't be saved."""
+    # `value` is a URL
+    if host_policy.ignored(pair["request"]["destination"][0]["value"]):
+        return None
+    # Remove expiry from Set-Cookie headers in Hoverfly responses
+    set_cookie_header = pair["response"]["headers"].get("Set-Cookie", [])
+    set_cookie_header[:] = [re.sub(r"(E|e)xpires=[^;]+;*", "", c) for c in set_cookie_header]
+    # Allow us to differentiate cached responses from proxied ones.
+    pair["response"]["headers"]["Hoverfly-Cache-Served"] = ["True"]
+    return pair
 
 
 @pytest.hookimpl(hookwrapper=True)
@@ -154,174 +611,384 @@ def setup_hoverfly(
 ):  # pylint: disable=W0613
     # Start Hoverfly
     logger.info("Setting up hoverfly")
-    port, admin_port = hf_ports
-    if not hasattr(request.config, "slaveinput"):
-        # Cleaning up any running hoverctl processes is nice, but too risky in distributed mode
-        with subprocess.Popen([HOVERCTL_PATH, "stop"], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
-            proc.wait()
-
-    logger.info("Starting hoverfly")
-    add_opts = request.config.getoption("hoverfly_opts")
-    hoverfly_cmd = [HOVERFLY_PATH, "-pp", str(port), "-ap", str(admin_port), *add_opts.split()]
-    exc = None
-    with open(os.path.join(test_log_directory, "hoverfly.log"), "w") as file:
-        for _ in range(3):
-            hf_proc = subprocess.Popen(hoverfly_cmd, stdout=file, stderr=file)  # pylint: disable=R1732
-            try:
-                polling.poll(
-                    target=lambda: requests.get(HOVERFLY_API_MODE.format(admin_port), timeout=5).status_code == 200,
-                    step=0.2,
-                    timeout=5,
-                    ignore_exceptions=requests.exceptions.ConnectionError,
-                )
-                break
-            except polling.TimeoutException as exc_:
-                exc = exc_
-                with subprocess.Popen(["ps", "-ef"], stdout=file, stderr=file) as proc:
-                    proc.wait()
-        else:
-            raise exc
-
-    requests.put(HOVERFLY_API_MODE.format(admin_port), json={"mode": "spy"}, timeout=5)
+    # In case collection didn't spot that the test uses Hoverfly, e.g. when the fixture is requested dynamically
+    ensure_executables(request.config)
+    reuse = reuse_enabled(request.config)
+    writer = log_writer(request.config, test_log_directory)
+    timer = request.node.hoverfly_timer = PhaseTimer()
+    with timer.phase("prepare_simulation"):
+        # The worker's admin port identifies its combined simulations
+        plan = plan_hoverfly_mode(request, _test_data_dir, hf_ports[1])
+    with timer.phase("start_hoverfly"):
+        hf_proc = acquire_replay_engine(request, plan) or acquire_hoverfly(request, hf_ports, test_log_directory)
+        # With a prespawned instance or the replay engine, the ports vary between tests
+        admin_port = hf_proc.admin_port
+        request.config.admin_port = admin_port
+
+        request.node.hoverfly_process = hf_proc
+        hf_proc.admin.set_mode("spy")
+    usage_before = hf_proc.resource_usage()
 
     try:
-        yield from setup_hoverfly_mode(request, port, admin_port, _test_data_dir)
-        generate_logs(request, JournalAPI(admin_port=hf_ports[1]), test_log_directory)
+        yield from setup_hoverfly_mode(request, hf_proc, _test_data_dir, plan)
+        journal_api = JournalAPI(admin_port, page_size=journal_page_size(request.config))
+        collect_journal(request, journal_api, writer, timer)
     finally:
+        with timer.phase("stop_hoverfly"):
+            usage = hf_proc.resource_usage()
+            release_hoverfly(request, hf_proc, hf_ports, reuse, usage)
+        report_resource_usage(request.node, usage_before, usage)
+        with timer.phase("write_logs"):
+            hoverfly_log = hf_proc.read_new_log()
+            if hoverfly_log:
+                writer.write_text(f"{log_name(request.node.nodeid)}.hoverfly.log", hoverfly_log)
+        if timings_enabled(request.config):
+            request.node.user_properties.append((USER_PROPERTY, timer.phases))
+
+
+def report_resource_usage(node, before, after):
+    """Attaches what the test's Hoverfly instance used while the test ran to the test's report."""
+    report = usage_report(before, after)
+    if report:
+        logger.info("Hoverfly used %s MB and %s seconds of CPU", report["rss_mb"], report["cpu_seconds"])
+        node.user_properties.append((RESOURCES_PROPERTY, report))
+
+
+def release_hoverfly(request, hf_proc, hf_ports, reuse, usage=None):  # pylint: disable=R0913
+    """Kills a test's Hoverfly instance, or keeps it for the next test. An instance whose `usage` shows it has grown
+    past the memory limit is killed, so that the next test gets a fresh one."""
+    crashed = getattr(request.node, "hoverfly_crashed", False)
+    limit = max_rss(request.config)
+    oversized = usage is not None and limit and usage.rss > limit
+    if hf_proc is request.config.hoverfly_replay_engine:
+        logger.debug("Keeping the replay engine for the next test")
+    elif reuse and hf_proc.alive() and not crashed and not oversized:
+        request.config.hoverfly_processes[hf_ports] = hf_proc
+    else:
+        if reuse and oversized:
+            logger.warning("Recycling hoverfly, which has grown to %s MB", usage.rss >> 20)
         logger.warning("Killing hoverfly")
         hf_proc.kill()
         logger.warning("Killed hoverfly")
+        if crashed and request.config.hoverfly_launcher:
+            # Whatever crashed this instance may well affect the standby too
+            request.config.hoverfly_launcher.discard_standby()
+
+
+def acquire_replay_engine(request, plan):
+    """The session's replay engine, ready for a test, if it's enabled and can replay the test's simulation."""
+    config = request.config
+    mode, file, _ = plan
+    if mode != "simulate" or not replay_engine_enabled(config):
+        return None
+    reason = unsupported_reason(cached_simulation(file))
+    if reason:
+        logger.info("Using Hoverfly, as the replay engine doesn't support %s", reason)
+        return None
+    engine = config.hoverfly_replay_engine
+    if engine is None or not engine.alive():
+        logger.info("Starting the replay engine")
+        engine = config.hoverfly_replay_engine = ReplayEngine(
+            *reserve_ports(config, ENGINE_PORT_OFFSET), journal_size(config)
+        ).start()
+    engine.reset()
+    return engine
+
+
+def acquire_hoverfly(request, hf_ports, test_log_directory):
+    """Returns a ready Hoverfly instance for a test: a reset reused one, a prespawned one, or a freshly started one."""
+    config = request.config
+    hf_proc = config.hoverfly_processes.pop(hf_ports, None)
+    if hf_proc and hf_proc.alive():
+        logger.info("Resetting running hoverfly")
+        reset_hoverfly(hf_proc.admin_port)
+        return hf_proc
+
+    config.hoverfly_log_directory = test_log_directory
+    # Anything in --hoverfly-opts comes later, so takes precedence
+    add_opts = ["-journal-size", str(journal_size(config)), *config.getoption("hoverfly_opts").split()]
+    installation = ensure_executables(config)
+    if not config.hoverfly_launcher and port_mode(config) == "fixed" and worker_id(config) is None:
+        # Cleaning up any running hoverctl processes is nice, but too risky in distributed mode, or when other sessions
+        # may be running
+        with subprocess.Popen([installation.hoverctl, "stop"], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            proc.wait()
+
+    if prespawn_enabled(config) and not reuse_enabled(config):
+        if not config.hoverfly_launcher:
+            standby_ports = reserve_ports(config, STANDBY_PORT_OFFSET)
+            config.hoverfly_launcher = HoverflyLauncher(
+                [hf_ports, standby_ports], test_log_directory, add_opts, executable=installation.hoverfly
+            )
+        logger.info("Taking prespawned hoverfly")
+        return config.hoverfly_launcher.acquire()
+
+    logger.info("Starting hoverfly")
+    log_file = os.path.join(test_log_directory, f"hoverfly_{hf_ports[1]}.log")
+    return HoverflyProcess(*hf_ports, log_file, add_opts, executable=installation.hoverfly).start()
+
+
+def reset_hoverfly(admin_port):
+    """Returns a running Hoverfly to the state of a freshly started one, so that another test can use it."""
+    admin = HoverflyAdminClient(admin_port)
+    admin.delete_simulation()
+    JournalAPI(admin_port).delete()
+    admin.delete_state()
+    admin.delete_cache()
+
 
+def plan_hoverfly_mode(request, data_dir, worker):
+    """Works out whether the test records or simulates, and which simulation file it uses.
 
-def setup_hoverfly_mode(request, port, admin_port, data_dir):
+    :return: the mode, the simulation file and the simulation's config
+    """
     sim_marker = request.node.get_closest_marker("simulated")
     sim_config = StaticSimulation() if not sim_marker else sim_marker.args[0]
-    file = sim_config.full_file_path(data_dir, admin_port)
-    if no_valid_simulation_exists(request, file, sim_config.max_age):
-        request.node.mode = "record"
-        yield from record(file, request.node, port, admin_port, sim_config.capture_config)
+    if request.config.hoverfly_teardown_pipeline:
+        # An earlier test may still be saving a simulation this test uses
+        request.config.hoverfly_teardown_pipeline.wait_for(sim_config.source_files(data_dir))
+    file = sim_config.full_file_path(data_dir, worker)
+    index = SimulationIndex(data_dir)
+    if no_valid_simulation_exists(request, file, sim_config.max_age, index):
+        return "record", file, sim_config
+    # Only simulations the plugin recorded are filled in, never hand-written or static ones
+    # The gaps are found in the journal, so can't be filled without it
+    if (
+        fill_gaps_enabled(request.config)
+        and journal_size(request.config)
+        and isinstance(sim_config, GeneratedSimulation)
+        and index.key(file)
+    ):
+        return "fill", file, sim_config
+    return "simulate", file, sim_config
+
+
+def setup_hoverfly_mode(request, hf_proc, data_dir, plan):
+    mode, file, sim_config = plan
+    port, admin_port = hf_proc.proxy_port, hf_proc.admin_port
+    request.node.mode = mode
+    if mode == "record":
+        on_saved = functools.partial(update_index, data_dir, file)
+        yield from record(file, request.node, port, admin_port, sim_config.capture_config, on_saved=on_saved)
+    elif mode == "fill":
+        on_saved = functools.partial(update_index, data_dir, file)
+        yield from fill_gaps(file, request.node, port, admin_port, sim_config.capture_config, on_saved=on_saved)
     else:
-        request.node.mode = "simulate"
         logger.info("Loading file: %s", file)
-        yield from simulate(file, port, admin_port)
+        yield from simulate(file, port, admin_port, timer_for(request.node))
 
 
-def no_valid_simulation_exists(request, sim_file, max_age_seconds):
+def update_index(data_dir, file, time_exported, saved):
+    index = SimulationIndex(data_dir)
+    if index.key(file):
+        index.update(file, time_exported, saved)
+
+
+def no_valid_simulation_exists(request, sim_file, max_age_seconds, index=None):
     if request.config.getoption("forcelive"):
         return True
     try:
-        with open(sim_file) as file:
-            sim_metadata = json.loads(file.read())["meta"]
-            date_sim_created = parse(sim_metadata.get("timeExported"))
-            age = (datetime.now(timezone.utc) - date_sim_created).total_seconds()
-            if request.config.getoption("refreshexpired"):
-                if max_age_seconds and age > max_age_seconds:
-                    logger.debug("Simulation is expired.")
-                    return True
-                skip_msg = "Simulation up-to-date. No need to run test."
-                logger.warning(skip_msg)
-                pytest.skip(skip_msg)
+        if index is not None:
+            time_exported = index.time_exported(sim_file)
+        else:
+            with open_simulation(sim_file) as file:
+                time_exported = json.load(file)["meta"].get("timeExported")
     except FileNotFoundError:
         logger.debug("No simulation file found.")
         return True
+    if request.config.getoption("refreshexpired"):
+        if simulation_expired(time_exported, max_age_seconds):
+            logger.debug("Simulation is expired.")
+            return True
+        skip_msg = "Simulation up-to-date. No need to run test."
+        logger.warning(skip_msg)
+        pytest.skip(skip_msg)
     return False
 
 
+def simulation_expired(time_exported, max_age_seconds):
+    if not max_age_seconds:
+        return False
+    from dateutil.parser import parse  # pylint: disable=C0415
+
+    age = (datetime.now(timezone.utc) - parse(time_exported)).total_seconds()
+    return age > max_age_seconds
+
+
 @pytest.fixture
 def hf_ports(request):
-    """Sets a unique port for each worker thread to talk to its instance of hoverfly."""
-    if hasattr(request.config, "slaveinput"):
-        increment = int(request.config.slaveinput["slaveid"][-1])
-    else:
-        increment = 0
-    admin_port = HF_ADMIN_PORT + increment
-    request.config.admin_port = admin_port
-    return PROXY_PORT + increment, admin_port
+    """Unique proxy and admin ports for each worker to talk to its instance of hoverfly. Reserved once per worker."""
+    config = request.config
+    if config.hoverfly_ports is None:
+        config.hoverfly_ports = reserve_ports(config)
+    config.admin_port = config.hoverfly_ports[1]
+    return config.hoverfly_ports
+
+
+def reserve_ports(config, fixed_offset=0):
+    """Reserves a port pair. `fixed_offset` is added to the worker's ports when ports are fixed."""
+    if port_mode(config) == "fixed":
+        return fixed_ports(config, fixed_offset)
+    return config.hoverfly_port_allocator.reserve_pair()
 
 
 @pytest.hookimpl(hookwrapper=True)
 def pytest_runtest_call(item):
+    hf_proc = getattr(item, "hoverfly_process", None)
+    watchdog = HoverflyWatchdog(hf_proc).start() if hf_proc and watchdog_enabled(item.config) else None
     outcome = yield
-    if "setup_hoverfly" not in item.fixturenames:
+    if watchdog:
+        watchdog.stop()
+    if hf_proc is None or hf_proc.alive():
+        return
+    logger.warning("Hoverfly crashed.")
+    # Make sure a reused instance gets restarted for the next test
+    item.hoverfly_crashed = True
+    exc = hf_proc.crashed_exception()
+    if hasattr(outcome, "force_exception"):
+        outcome.force_exception(exc)
+    else:
+
+        def raise_hoverfly_exception():
+            raise exc
+
+        outcome.get_result = raise_hoverfly_exception
+
+
+def collect_journal(request, journal_api, writer, timer):
+    """Fetches as much of the test's journal as the journal level asks for."""
+    if not journal_size(request.config):
+        logger.debug("The journal is disabled, so there are no network logs")
+        return
+    level = journal_level(request.config)
+    if level == "full" or (level == "on-failure" and hasattr(request.node, "dont_save_sim")):
+        generate_logs(request, journal_api, writer, timer)
+    elif level == "sensitive-only":
+        with timer.phase("journal"):
+            check_sensitive_hosts(request, journal_api)
+
+
+def check_sensitive_hosts(request, journal_api):
+    """Fails the test if a simulated test sent a request to a sensitive host that Hoverfly didn't serve. Hoverfly
+    searches its journal, so only the requests to sensitive hosts are fetched."""
+    import requests  # pylint: disable=C0415
+
+    regex = HostPolicy(sensitive=request.node.sensitive).destination_regex(SENSITIVE)
+    if request.node.mode != "simulate" or regex is None:
         return
     try:
-        requests.get(f"http://localhost:{item.config.admin_port}", timeout=5)
+        entries = journal_api.search({"destination": [{"matcher": "regex", "value": regex}]})
     except requests.exceptions.ConnectionError:
-        logger.warning("Hoverfly crashed.")
-        try:
-            requests.get(f"http://localhost:{item.config.admin_port}", timeout=5)
-        except requests.exceptions.ConnectionError:
-
-            def raise_hoverfly_exception():
-                raise HoverflyCrashedException("Hoverfly crashed")
+        logger.warning("Hoverfly fell over. Couldn't check for requests to sensitive hosts")
+        return
+    for pair in entries:
+        assert pair["response"]["headers"].get(
+            "Hoverfly-Cache-Served"
+        ), f"Warning: sensitive URL is being hit in a simulated test: {pair['request']}"
 
-            outcome.get_result = raise_hoverfly_exception
 
+def generate_logs(request, journal_api, writer, timer=None):
+    """Fetches the test's journal and hands it to `writer` to be saved as the test's network log. Fails the test if
+    a simulated test sent a request to a sensitive host that Hoverfly didn't serve."""
+    import requests  # pylint: disable=C0415
 
-def generate_logs(request, journal_api, test_log_directory):
-    network_log_file = os.path.join(test_log_directory, "network.json")
-    with open(network_log_file, "w") as file:
+    name = f"{log_name(request.node.nodeid)}.network.json"
+    timer = timer or PhaseTimer()
+    with timer.phase("write_logs", excluding=("journal",)):
         logger.warning("Getting journal")
+        # Entries are spooled to disk as they arrive, so the whole journal is never held in memory
+        spool = tempfile.TemporaryFile("w+", encoding="utf-8")  # pylint: disable=R1732
+        spool.write('{"journal": [')
+        total = 0
+        uncached = None
+        host_policy = HostPolicy(sensitive=request.node.sensitive)
         try:
-            loaded_journal = journal_api.get()
-        except requests.exceptions.ConnectionError:
-            logger.warning("Hoverfly fell over. No network log available")
-            file.write(json.dumps({"msg": "Hoverfly crashed while retrieving logs"}))
-            return
-        logger.warning("Got journal")
-        try:
-            for pair in loaded_journal["journal"]:
+            for pair in timed_iter(journal_api.iter_entries(), timer, "journal"):
                 # Truncate long responses, particularly PDF ones. We're not usually interested in the data itself.
                 if len(pair["response"]["body"]) > 1000:
                     pair["response"]["body"] = pair["response"]["body"][:1000] + "...<truncated>"
-                if request.node.mode == "simulate" and any(
-                    host in pair["request"]["destination"] for host in request.node.sensitive
+                spool.write(("," if total else "") + json.dumps(pair, indent=4))
+                total += 1
+                if (
+                    uncached is None
+                    and request.node.mode == "simulate"
+                    and host_policy.sensitive(pair["request"]["destination"])
+                    and not pair["response"]["headers"].get("Hoverfly-Cache-Served")
                 ):
-                    assert pair["response"]["headers"].get(
-                        "Hoverfly-Cache-Served"
-                    ), f"Warning: sensitive URL is being hit in a simulated test: {pair['request']}"
-        finally:
-            file.write(json.dumps(loaded_journal, indent=4, separators=(",", ": ")))
-
+                    uncached = pair
+        except requests.exceptions.ConnectionError:
+            spool.close()
+            logger.warning("Hoverfly fell over. No network log available")
+            writer.write_json(name, {"msg": "Hoverfly crashed while retrieving logs"})
+            return
+        except BaseException:
+            spool.close()
+            raise
+        spool.write(f'], "total": {total}}}')
+        # Copying the log into place, and compressing it, happens in the background
+        writer.write_spooled(name, spool)
+        logger.warning("Got journal")
+    assert uncached is None, f"Warning: sensitive URL is being hit in a simulated test: {uncached['request']}"
 
-class JournalAPI:
-    """Python interface for Hoverctl's REST API for accessing its journal."""
 
-    def __init__(self, admin_port):
-        self.admin_port = admin_port
+@pytest.fixture
+def hoverfly_admin(setup_hoverfly):
+    return HoverflyAdminClient(setup_hoverfly[2])
 
-    def delete(self):
-        requests.delete(HOVERFLY_API_JOURNAL.format(self.admin_port), timeout=5)
 
-    def get(self):
-        offset = 0
-        journals_per_request = 10
+@pytest.fixture
+def journal_api(request, setup_hoverfly):
+    return JournalAPI(setup_hoverfly[2], page_size=journal_page_size(request.config))
 
-        def get_running_journal():
-            return json.loads(
-                requests.get(
-                    HOVERFLY_API_JOURNAL.format(self.admin_port) + f"?limit={journals_per_request}&offset={offset}",
-                    timeout=5,
-                ).text
-            )
 
-        running_journal = get_running_journal()
-        while running_journal["total"] > len(running_journal["journal"]):
-            hf_journal = get_running_journal()
-            running_journal["journal"] += hf_journal["journal"]
-            offset += journals_per_request
-        return running_journal
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.hoverfly_teardown_pipeline:
+        config.hoverfly_teardown_failures += config.hoverfly_teardown_pipeline.drain()
+    if worker_id(config) is not None:
+        # The controller reports the failures
+        config.workeroutput[WORKER_OUTPUT_KEY] = config.hoverfly_teardown_failures
+    elif config.hoverfly_teardown_failures and session.exitstatus == 0:
+        # The exit status of failed tests
+        session.exitstatus = 1
 
 
-@pytest.fixture
-def journal_api(setup_hoverfly):
-    return JournalAPI(setup_hoverfly[2])
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):  # pylint: disable=W0613
+    node.config.hoverfly_teardown_failures += getattr(node, "workeroutput", {}).get(WORKER_OUTPUT_KEY, [])
 
 
-def pytest_unconfigure():
-    for file in glob.glob("combined_temp*.json"):
-        os.remove(file)
+def pytest_terminal_summary(terminalreporter, config):
+    if config.hoverfly_teardown_failures:
+        terminalreporter.section("hoverfly teardown failures", red=True)
+        for nodeid, message in config.hoverfly_teardown_failures:
+            terminalreporter.write_line(f"{nodeid}: {message}")
 
 
-class HoverflyCrashedException(Exception):
-    """Custom exception to signal to framework that Hoverfly has crashed."""
+def pytest_unconfigure(config):
+    if getattr(config, "hoverfly_teardown_pipeline", None):
+        config.hoverfly_teardown_pipeline.close()
+    for hf_proc in getattr(config, "hoverfly_processes", {}).values():
+        hf_proc.kill()
+    if getattr(config, "hoverfly_launcher", None):
+        config.hoverfly_launcher.close()
+    if getattr(config, "hoverfly_replay_engine", None):
+        config.hoverfly_replay_engine.kill()
+    HoverflyAdminClient.close_all()
+    if getattr(config, "hoverfly_log_writer", None):
+        config.hoverfly_log_writer.close()
+    # Only this process's combined simulations and Hoverfly logs: other workers and sessions may be using theirs
+    admin_ports = set()
+    if getattr(config, "hoverfly_ports", None):
+        admin_ports.add(config.hoverfly_ports[1])
+    if getattr(config, "hoverfly_launcher", None):
+        admin_ports.update(admin_port for _, admin_port in config.hoverfly_launcher.port_pairs)
+    for admin_port in admin_ports:
+        files = glob.glob(f"combined_temp_{admin_port}_*.json")
+        if getattr(config, "hoverfly_log_directory", None):
+            files.append(os.path.join(config.hoverfly_log_directory, f"hoverfly_{admin_port}.log"))
+        for file in files:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file)
+    if getattr(config, "hoverfly_port_allocator", None):
+        config.hoverfly_port_allocator.release_all()
@@ -0,0 +1,109 @@
+import contextlib
+import os
+import re
+import socket
+import tempfile
+
+from .logger import logger
+
+HF_ADMIN_PORT = 8888
+PROXY_PORT = 8500
+# When ports are fixed, prespawned standby instances and the replay engine run on the main ports plus these offsets
+STANDBY_PORT_OFFSET = 100
+ENGINE_PORT_OFFSET = 200
+
+PORT_MODES = ("dynamic", "fixed")
+LOCK_DIRECTORY = os.path.join(tempfile.gettempdir(), "pytest-hoverfly-ports")
+
+
+def worker_id(config):
+    """The xdist worker id, e.g. "gw11", or None if not running as an xdist worker."""
+    if hasattr(config, "workerinput"):
+        return config.workerinput["workerid"]
+    # Versions of xdist before 2.0
+    if hasattr(config, "slaveinput"):
+        return config.slaveinput["slaveid"]
+    return None
+
+
+def worker_number(config):
+    worker = worker_id(config)
+    return int(re.sub(r"\D", "", worker) or 0) if worker else 0
+
+
+def fixed_ports(config, offset=0):
+    """The legacy port pair: the default ports offset by the worker number. Clashes with other sessions on the host."""
+    increment = worker_number(config) + offset
+    return PROXY_PORT + increment, HF_ADMIN_PORT + increment
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # There's no side-effect free way to check on Windows without psutil, so never reclaim reservations there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PortAllocator:
+    """Reserves free ports for Hoverfly instances, so that any number of xdist workers and pytest sessions on the same
+    machine each get their own.
+
+    The OS picks each port, and a lock file named after the port, holding the owner's pid, reserves it against other
+    allocators. Reservations left behind by processes that have died are reclaimed.
+
+    :str lock_directory: directory shared by all allocators on the machine
+    """
+
+    def __init__(self, lock_directory=LOCK_DIRECTORY):
+        self.lock_directory = lock_directory
+        self.reserved = []
+
+    def _lock_path(self, port):
+        return os.path.join(self.lock_directory, f"{port}.lock")
+
+    def _claim(self, port):
+        """Atomically reserves `port`. Returns whether it was reserved."""
+        path = self._lock_path(port)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path) as file:
+                    owner = int(file.read() or 0)
+            except (FileNotFoundError, ValueError):
+                return False
+            if owner and not _pid_alive(owner):
+                logger.debug("Reclaiming port %s from dead process %s", port, owner)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            return False
+        with os.fdopen(fd, "w") as file:
+            file.write(str(os.getpid()))
+        self.reserved.append(port)
+        return True
+
+    def reserve_port(self, attempts=50):
+        os.makedirs(self.lock_directory, exist_ok=True)
+        for _ in range(attempts):
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind(("localhost", 0))
+                port = sock.getsockname()[1]
+            if self._claim(port):
+                return port
+        raise RuntimeError(f"Couldn't reserve a free port for Hoverfly after {attempts} attempts")
+
+    def reserve_pair(self):
+        """Reserves a (proxy port, admin port) pair."""
+        return self.reserve_port(), self.reserve_port()
+
+    def release_all(self):
+        for port in self.reserved:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._lock_path(port))
+        self.reserved = []
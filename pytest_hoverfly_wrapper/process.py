@@ -0,0 +1,270 @@
+import ctypes
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .admin import HoverflyAdminClient
+from .download import HOVERFLY
+from .logger import logger
+from .resources import process_usage
+
+
+class HoverflyProcess:  # pylint: disable=R0902
+    """Handle on a Hoverfly executable started by the plugin.
+
+    :int proxy_port: port Hoverfly proxies requests on
+    :int admin_port: port Hoverfly serves its admin API on
+    :str log_file: file Hoverfly's stdout and stderr get written to
+    :list extra_args: additional command line arguments for the Hoverfly executable
+    :str executable: the Hoverfly executable. Defaults to the one on the PATH.
+    """
+
+    def __init__(
+        self, proxy_port, admin_port, log_file, extra_args=(), *, executable=HOVERFLY
+    ):  # pylint: disable=R0913
+        self.proxy_port = proxy_port
+        self.admin_port = admin_port
+        self.log_file = log_file
+        self.extra_args = list(extra_args)
+        self.executable = executable
+        self.proc = None
+        self.admin = HoverflyAdminClient(admin_port)
+        # How much of the log has been handed out by `read_new_log`
+        self.log_offset = 0
+
+    @property
+    def command(self):
+        return [self.executable, "-pp", str(self.proxy_port), "-ap", str(self.admin_port), *self.extra_args]
+
+    def start(self, attempts=3):
+        import polling  # pylint: disable=C0415
+        import requests  # pylint: disable=C0415
+
+        exc = None
+        self.log_offset = 0
+        with open(self.log_file, "w") as file:
+            for _ in range(attempts):
+                self.proc = subprocess.Popen(self.command, stdout=file, stderr=file)  # pylint: disable=R1732
+                try:
+                    polling.poll(
+                        target=self.admin.responding,
+                        step=0.2,
+                        timeout=5,
+                        ignore_exceptions=requests.exceptions.ConnectionError,
+                    )
+                    return self
+                except polling.TimeoutException as exc_:
+                    exc = exc_
+                    self.proc.kill()
+                    with subprocess.Popen(["ps", "-ef"], stdout=file, stderr=file) as proc:
+                        proc.wait()
+        raise exc
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def resource_usage(self):
+        """Hoverfly's current `ResourceUsage`, or None if it isn't running or can't be measured."""
+        return process_usage(self.proc.pid) if self.alive() else None
+
+    def log_tail(self, size=4096):
+        """The last `size` bytes of Hoverfly's log, trimmed to whole lines."""
+        try:
+            with open(self.log_file, "rb") as file:
+                file.seek(max(os.path.getsize(self.log_file) - size, 0))
+                tail = file.read().decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            return ""
+        return tail if len(tail) < size else tail.split("\n", 1)[-1]
+
+    def read_new_log(self):
+        """Hoverfly's log since the last call, so that each test that uses the instance gets its own part of it."""
+        try:
+            with open(self.log_file, "rb") as file:
+                file.seek(self.log_offset)
+                data = file.read()
+        except FileNotFoundError:
+            return ""
+        self.log_offset += len(data)
+        return data.decode("utf-8", errors="replace")
+
+    def crashed_exception(self):
+        return HoverflyCrashedException(
+            f"Hoverfly crashed (exit code {self.proc.returncode}). End of its log:\n{self.log_tail()}"
+        )
+
+    def kill(self):
+        if self.proc is None:
+            return
+        self.proc.kill()
+        self.proc.wait()
+        logger.debug("Hoverfly on admin port %s exited with %s", self.admin_port, self.proc.returncode)
+
+
+class HoverflyLauncher:
+    """Double-buffered source of Hoverfly instances.
+
+    While one instance is being used by a test, the next one is started and health-checked in the background, so that
+    the next test doesn't have to wait for it. The two instances take turns on a pair of port pairs.
+
+    :list port_pairs: two (proxy port, admin port) pairs
+    :str log_directory: directory the instances' logs get written to
+    :list extra_args: additional command line arguments for the Hoverfly executable
+    :str executable: the Hoverfly executable. Defaults to the one on the PATH.
+    """
+
+    def __init__(self, port_pairs, log_directory, extra_args=(), *, executable=HOVERFLY):
+        self.port_pairs = list(port_pairs)
+        self.log_directory = log_directory
+        self.extra_args = list(extra_args)
+        self.executable = executable
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hoverfly-standby")
+        self.standby = None
+        self.next_pair = 0
+
+    def _spawn(self, ports):
+        proxy_port, admin_port = ports
+        log_file = os.path.join(self.log_directory, f"hoverfly_{admin_port}.log")
+        return HoverflyProcess(proxy_port, admin_port, log_file, self.extra_args, executable=self.executable).start()
+
+    def acquire(self):
+        """Returns a ready Hoverfly instance, and starts preparing the one after it."""
+        hf_proc = None
+        if self.standby is not None:
+            try:
+                hf_proc = self.standby.result()
+            except Exception:  # pylint: disable=W0703
+                logger.warning("Standby hoverfly failed to start, starting one now", exc_info=True)
+            self.standby = None
+        if hf_proc is None or not hf_proc.alive():
+            hf_proc = self._spawn(self.port_pairs[self.next_pair])
+        self.next_pair = (self.port_pairs.index((hf_proc.proxy_port, hf_proc.admin_port)) + 1) % 2
+        self.standby = self.executor.submit(self._spawn, self.port_pairs[self.next_pair])
+        return hf_proc
+
+    def discard_standby(self):
+        if self.standby is None:
+            return
+        standby, self.standby = self.standby, None
+        try:
+            standby.result().kill()
+        except Exception:  # pylint: disable=W0703
+            logger.debug("Standby hoverfly never started", exc_info=True)
+
+    def close(self):
+        self.discard_standby()
+        self.executor.shutdown(wait=True)
+
+
+class HoverflyWatchdog:  # pylint: disable=R0902
+    """Watches a Hoverfly process while a test runs, and raises `HoverflyCrashedException` in the test as soon as the
+    process dies, rather than letting the test run on into timeouts.
+
+    In the main thread on POSIX, the test is interrupted with a signal, which also breaks out of blocking calls such as
+    `time.sleep` or socket reads. Signals the watchdog didn't send are passed on to the handler it replaced, which is
+    restored once it stops. Otherwise, CPython's asynchronous exceptions are used, which take effect at the test's next
+    Python instruction. Where neither is available, crashes are only picked up once the test has finished.
+
+    Once `stop` returns, the watchdog can no longer raise anything, even if it interrupted the test just as it finished.
+
+    :HoverflyProcess hf_proc: the process to watch
+    """
+
+    interval = 0.1
+    interrupt_signal = getattr(signal, "SIGUSR1", None)
+    # How long `stop` waits for an interrupt that's already been sent to arrive
+    delivery_timeout = 1
+
+    def __init__(self, hf_proc):
+        self.hf_proc = hf_proc
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._watch, name="hoverfly-watchdog", daemon=True)
+        self.thread_id = None
+        self.previous_handler = None
+        self.interrupt = None
+        # Whether an exception may still be raised in the test, whether the test has been interrupted, and whether the
+        # interrupting signal has arrived. Only changed under the lock, bar `delivered`, which is set by the handler.
+        self.armed = False
+        self.fired = False
+        self.delivered = threading.Event()
+
+    def _can_signal(self):
+        return (
+            self.interrupt_signal
+            and hasattr(signal, "pthread_kill")
+            and threading.current_thread() is threading.main_thread()
+            # A handler installed outside Python couldn't be restored
+            and signal.getsignal(self.interrupt_signal) is not None
+        )
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        if self._can_signal():
+            self.previous_handler = signal.signal(self.interrupt_signal, self._raise_crashed)
+            self.interrupt = lambda: signal.pthread_kill(self.thread_id, self.interrupt_signal)
+        elif hasattr(ctypes, "pythonapi") and hasattr(ctypes.pythonapi, "PyThreadState_SetAsyncExc"):
+            self.interrupt = lambda: ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self.thread_id), ctypes.py_object(HoverflyCrashedException)
+            )
+        else:
+            return self
+        self.armed = True
+        self.thread.start()
+        return self
+
+    def _raise_crashed(self, signum, frame):
+        if not self.fired:
+            # Someone else's signal
+            if callable(self.previous_handler):
+                self.previous_handler(signum, frame)
+            return
+        self.delivered.set()
+        if self.armed:
+            raise self.hf_proc.crashed_exception()
+
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            if self.hf_proc.alive():
+                continue
+            with self.lock:
+                if self.armed:
+                    logger.warning("Hoverfly died mid-test, interrupting the test.")
+                    self.fired = True
+                    self.interrupt()
+            return
+
+    def _discard_interrupt(self):
+        """Makes sure an interrupt that was sent too late doesn't reach the test's teardown."""
+        if self.previous_handler is None:
+            # A NULL exception type clears a pending asynchronous exception
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread_id), None)
+        elif hasattr(signal, "sigtimedwait") and self.interrupt_signal in signal.sigpending():
+            # Blocked, so it would otherwise reach whichever handler is installed once it's unblocked
+            signal.sigtimedwait([self.interrupt_signal], 0)
+        else:
+            # On its way to this thread, where the disarmed handler ignores it
+            self.delivered.wait(self.delivery_timeout)
+
+    def stop(self):
+        if not self.armed:
+            return
+        while self.armed:
+            try:
+                with self.lock:
+                    self.stopped.set()
+                    self.armed = False
+            except HoverflyCrashedException:
+                # Interrupted just as the test finished. The crash is still reported once the test has finished.
+                pass
+        if self.fired:
+            self._discard_interrupt()
+        self.thread.join()
+        if self.previous_handler is not None:
+            signal.signal(self.interrupt_signal, self.previous_handler)
+
+
+class HoverflyCrashedException(Exception):
+    """Custom exception to signal to framework that Hoverfly has crashed."""
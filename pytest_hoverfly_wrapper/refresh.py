@@ -0,0 +1,185 @@
+import argparse
+import collections
+import contextlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from .hosts import host_of
+from .index import SimulationIndex
+from .plugin import TEST_DATA_DIR, simulation_expired
+from .simulations import cached_simulation
+
+# A test whose simulation needs re-recording, and the hosts its current simulation talks to
+RefreshTask = collections.namedtuple("RefreshTask", ["nodeid", "sim_file", "hosts"])
+RefreshResult = collections.namedtuple("RefreshResult", ["task", "returncode", "seconds", "output"])
+
+# pytest's exit code when none of the selected tests ran
+NO_TESTS_COLLECTED = 5
+
+
+def needs_refresh(index, sim_file, max_age):
+    try:
+        time_exported = index.time_exported(sim_file)
+    except FileNotFoundError:
+        return True
+    return simulation_expired(time_exported, max_age)
+
+
+def simulation_hosts(sim_file):
+    """The hosts the requests in a simulation were sent to."""
+    try:
+        sim = cached_simulation(sim_file)
+    except FileNotFoundError:
+        return ()
+    hosts = set()
+    for pair in sim["data"]["pairs"]:
+        destination = pair["request"].get("destination") or []
+        # The old single matcher format
+        for matcher in [destination] if isinstance(destination, dict) else destination:
+            if matcher.get("value"):
+                hosts.add(host_of(matcher["value"]))
+    return tuple(sorted(hosts))
+
+
+class ExpiredSimulationCollector:  # pylint: disable=R0903
+    """Plugin that finds the collected tests whose generated simulations have expired, or don't exist yet.
+
+    :str data_dir: the test data directory
+    """
+
+    def __init__(self, data_dir=TEST_DATA_DIR):
+        self.data_dir = data_dir
+        self.tasks = []
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, items):
+        index = SimulationIndex(self.data_dir)
+        for item in items:
+            marker = item.get_closest_marker("simulated")
+            sim_config = marker.args[0] if marker else None
+            if sim_config is None or not sim_config.max_age:
+                continue
+            sim_file = os.path.join(self.data_dir, sim_config.file)
+            if needs_refresh(index, sim_file, sim_config.max_age):
+                # Node ids are relative to the root directory, but the tests have to run from the current directory,
+                # where the test data directory is
+                path, _, name = item.nodeid.partition("::")
+                nodeid = f"{os.path.relpath(str(item.fspath))}::{name}" if name else path
+                self.tasks.append(RefreshTask(nodeid, sim_file, simulation_hosts(sim_file)))
+
+
+def find_expired(pytest_args):
+    """The tests selected by `pytest_args` whose simulations need re-recording."""
+    collector = ExpiredSimulationCollector()
+    returncode = pytest.main(["--collect-only", "-p", "no:terminal", "--refreshexpired", *pytest_args], [collector])
+    if returncode not in (0, NO_TESTS_COLLECTED):
+        raise RuntimeError(f"Collecting the tests failed with exit code {returncode}")
+    return collector.tasks
+
+
+class HostLimiter:  # pylint: disable=R0903
+    """Limits how many tests talk to each host at once, so that refreshing doesn't get throttled.
+
+    :int limit: tests allowed to talk to a host at once. 0 means no limit.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def _semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self.semaphores[host]
+
+    @contextlib.contextmanager
+    def hold(self, hosts):
+        """Waits until there's room on all of `hosts`, and holds it for the duration of the block."""
+        # Always acquiring in the same order means two tests can't each hold a host the other is waiting for
+        semaphores = [self._semaphore(host) for host in sorted(hosts)] if self.limit else []
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                semaphore.acquire()
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+
+def refresh_test(task, pytest_args):
+    """Re-records one test's simulation in its own pytest process. Simulations are written atomically, and only if
+    the test passes, so a failed refresh keeps the old simulation."""
+    # Fixed ports would clash between the processes
+    command = [sys.executable, "-m", "pytest", task.nodeid, "--refreshexpired", "--hoverfly-ports=dynamic"]
+    return subprocess.run(
+        [*command, "-p", "no:cacheprovider", "-q", *pytest_args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        check=False,
+    )
+
+
+def refresh_all(tasks, pytest_args, workers, host_limiter, report=print):
+    """Re-records the simulations of `tasks`, `workers` at a time. Returns a `RefreshResult` per task."""
+
+    def refresh(task):
+        with host_limiter.hold(task.hosts):
+            start = time.monotonic()
+            process = refresh_test(task, pytest_args)
+        result = RefreshResult(task, process.returncode, time.monotonic() - start, process.stdout)
+        status = "refreshed" if result.returncode == 0 else f"FAILED ({result.returncode})"
+        report(f"{status:<12} {task.nodeid} ({result.seconds:.1f}s)")
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hoverfly-refresh") as executor:
+        return list(executor.map(refresh, tasks))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    pytest_args = []
+    if "--" in argv:
+        argv, pytest_args = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+    parser = argparse.ArgumentParser(
+        description="Re-records expired generated simulations, running several tests at once. Options after -- are "
+        "passed on to pytest.",
+    )
+    parser.add_argument("paths", nargs="*", help="test files or directories to look for expired simulations in")
+    parser.add_argument("--workers", type=int, default=4, help="tests (and Hoverfly instances) to run at once")
+    parser.add_argument(
+        "--host-concurrency",
+        type=int,
+        default=2,
+        help="tests allowed to talk to the same host at once, judging by their old simulations. 0 means no limit.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only list the tests that would be refreshed")
+    args = parser.parse_args(argv)
+
+    tasks = find_expired([*args.paths, *pytest_args])
+    print(f"{len(tasks)} simulations to refresh")
+    if args.dry_run or not tasks:
+        for task in tasks:
+            print(task.nodeid)
+        return 0
+
+    results = refresh_all(tasks, pytest_args, args.workers, HostLimiter(args.host_concurrency))
+    failed = [result for result in results if result.returncode != 0]
+    for result in failed:
+        print(f"\n{result.task.nodeid} failed, so its old simulation was kept:\n{result.output}")
+    print(f"{len(results) - len(failed)} refreshed, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,528 @@
+import base64
+import functools
+import gzip
+import http.client
+import json
+import re
+import select
+import socket
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .admin import HoverflyAdminClient
+from .logger import logger
+from .process import HoverflyCrashedException
+
+ENGINES = ("hoverfly", "python")
+SUPPORTED_MATCHERS = ("exact", "glob", "regex", "json")
+SIMPLE_FIELDS = ("destination", "path", "method", "scheme", "body")
+# Headers that describe the connection rather than the response, so aren't replayed as recorded
+HOP_BY_HOP_HEADERS = {"connection", "content-length", "keep-alive", "proxy-connection", "transfer-encoding"}
+UPSTREAM_TIMEOUT = 30
+SHUTDOWN_POLL_INTERVAL = 0.05
+
+EMPTY_SIMULATION = {
+    "data": {"pairs": [], "globalActions": {"delays": [], "delaysLogNormal": []}},
+    "meta": {"schemaVersion": "v5"},
+}
+
+
+class UnsupportedSimulation(ValueError):
+    """The simulation uses Hoverfly features the replay engine doesn't have."""
+
+
+def _matchers(pair_field):
+    if not pair_field:
+        return []
+    if isinstance(pair_field, dict):
+        # The old single matcher format
+        return [pair_field]
+    return pair_field
+
+
+def _request_matchers(request):
+    """Every matcher in a pair's request."""
+    field_matchers = [matcher for field in SIMPLE_FIELDS for matcher in _matchers(request.get(field))]
+    for field in ("query", "headers"):
+        if isinstance(request.get(field), dict):
+            field_matchers += [matcher for matchers in request[field].values() for matcher in _matchers(matchers)]
+        else:
+            field_matchers += _matchers(request.get(field))
+    return field_matchers
+
+
+def unsupported_reason(sim):  # pylint: disable=R0911
+    """Why the replay engine can't replay a simulation, or None if it can."""
+    data = sim.get("data", {})
+    global_actions = data.get("globalActions") or {}
+    if any(global_actions.get(key) for key in ("delays", "delaysLogNormal")):
+        return "global delays"
+    for pair in data.get("pairs", []):
+        request, response = pair.get("request", {}), pair.get("response", {})
+        if request.get("requiresState") or response.get("transitionsState") or response.get("removesState"):
+            return "state"
+        if response.get("templated"):
+            return "templated responses"
+        if response.get("fixedDelay") or response.get("logNormalDelay") or response.get("bodyFile"):
+            return "response delays or body files"
+        field_matchers = _request_matchers(request)
+        unknown_fields = set(request) - {*SIMPLE_FIELDS, "query", "headers"}
+        if unknown_fields:
+            return f"request fields {sorted(unknown_fields)}"
+        for matcher in field_matchers:
+            if matcher.get("matcher") not in SUPPORTED_MATCHERS or matcher.get("doMatch") or matcher.get("config"):
+                return f"{matcher.get('matcher')} matchers"
+        # Serving HTTPS needs Hoverfly's man-in-the-middle proxy
+        schemes = _matchers(request.get("scheme"))
+        if not schemes or all(_compile_matcher(matcher)("https") for matcher in schemes):
+            return "pairs that match HTTPS"
+    return None
+
+
+def _compile_matcher(matcher):
+    kind, value = matcher.get("matcher"), matcher.get("value")
+    if kind == "exact":
+        return lambda actual: actual == value
+    if kind == "glob":
+        # Hoverfly's globs only have the `*` wildcard
+        pattern = re.compile("^" + ".*".join(re.escape(part) for part in value.split("*")) + "$", re.DOTALL)
+        return lambda actual: pattern.match(actual) is not None
+    if kind == "regex":
+        pattern = re.compile(value)
+        return lambda actual: pattern.search(actual) is not None
+    expected = json.loads(value)
+
+    def matches_json(actual):
+        try:
+            return json.loads(actual) == expected
+        except ValueError:
+            return False
+
+    return matches_json
+
+
+def _read_field(field, request):
+    return request[field]
+
+
+def _read_query_param(param, request):
+    # Hoverfly matches repeated parameters against their values joined with semicolons
+    values = request["query_params"].get(param)
+    return ";".join(values) if values is not None else None
+
+
+def _read_header(header, request):
+    return request["headers"].get(header)
+
+
+class CompiledPair:  # pylint: disable=R0903
+    """A pair from a simulation, with its matchers compiled.
+
+    :dict pair: the pair
+    """
+
+    def __init__(self, pair):
+        self.response = pair["response"]
+        request = pair["request"]
+        # (function that reads a value from the request, matcher) for every matcher in the pair
+        self.checks = []
+        for field in SIMPLE_FIELDS:
+            for matcher in _matchers(request.get(field)):
+                self.checks.append((functools.partial(_read_field, field), _compile_matcher(matcher)))
+        query = request.get("query")
+        if isinstance(query, dict):
+            for param, matchers in query.items():
+                for matcher in _matchers(matchers):
+                    self.checks.append((functools.partial(_read_query_param, param), _compile_matcher(matcher)))
+        else:
+            for matcher in _matchers(query):
+                self.checks.append((functools.partial(_read_field, "query"), _compile_matcher(matcher)))
+        for header, matchers in (request.get("headers") or {}).items():
+            for matcher in _matchers(matchers):
+                self.checks.append((functools.partial(_read_header, header.lower()), _compile_matcher(matcher)))
+
+    def score(self, request):
+        """How many of the pair's matchers the request satisfies, or None if it doesn't satisfy all of them."""
+        for read, matches in self.checks:
+            actual = read(request)
+            if actual is None or not matches(actual):
+                return None
+        return len(self.checks)
+
+
+def journal_request(request):
+    """A request from Hoverfly's journal, in the form that `CompiledPair` matches."""
+    query = request.get("query") or ""
+    return {
+        **{field: request.get(field) or "" for field in SIMPLE_FIELDS},
+        "query": query,
+        "query_params": parse_qs(query, keep_blank_values=True),
+        "headers": {name.lower(): ";".join(values) for name, values in (request.get("headers") or {}).items()},
+    }
+
+
+def simulation_matcher(pairs):
+    """A function that tells whether any of `pairs` matches a request from Hoverfly's journal. Pairs with matchers
+    the replay engine doesn't have never match."""
+    compiled = [
+        CompiledPair(pair)
+        for pair in pairs
+        if all(matcher.get("matcher") in SUPPORTED_MATCHERS for matcher in _request_matchers(pair["request"]))
+    ]
+
+    def matches(request):
+        request = journal_request(request)
+        return any(pair.score(request) is not None for pair in compiled)
+
+    return matches
+
+
+class ReplayEngine:  # pylint: disable=R0902
+    """A lightweight, in-process stand-in for Hoverfly, for tests that only replay simple simulations.
+
+    It serves a proxy and the parts of Hoverfly's admin API the plugin uses (mode, simulation, journal, state and
+    cache), so that the rest of the plugin treats it just like a `HoverflyProcess`. It supports spy and simulate modes,
+    and exact, glob, regex and json matchers over plain HTTP. Simulations that need anything else raise
+    `UnsupportedSimulation` when they're loaded. In spy mode, unmatched requests are sent on to their destination, and
+    HTTPS is tunnelled through untouched.
+
+    :int proxy_port: port the proxy is served on
+    :int admin_port: port the admin API is served on
+    :int journal_size: the most journal entries kept, like Hoverfly's -journal-size. None means no limit.
+    """
+
+    modes = ("spy", "simulate")
+
+    def __init__(self, proxy_port, admin_port, journal_size=None):
+        self.proxy_port = proxy_port
+        self.admin_port = admin_port
+        self.journal_size = journal_size
+        self.admin = HoverflyAdminClient(admin_port)
+        self.lock = threading.Lock()
+        self.mode = "simulate"
+        self.simulation = EMPTY_SIMULATION
+        self.pairs = []
+        self.journal = []
+        self.servers = []
+        self.threads = []
+
+    def start(self):
+        self.serve(self.proxy_port, ProxyHandler)
+        self.serve(self.admin_port, AdminHandler)
+        return self
+
+    def serve(self, port, handler):
+        """Serves `handler` for the engine on `port` from a background thread. Returns the server."""
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        server.daemon_threads = True
+        server.engine = self
+        # A short poll interval keeps shutting the engine down quick
+        serve = functools.partial(server.serve_forever, poll_interval=SHUTDOWN_POLL_INTERVAL)
+        thread = threading.Thread(target=serve, name=f"replay-engine-{port}", daemon=True)
+        thread.start()
+        self.servers.append(server)
+        self.threads.append(thread)
+        return server
+
+    def alive(self):
+        return bool(self.threads) and all(thread.is_alive() for thread in self.threads)
+
+    def kill(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers, self.threads = [], []
+
+    def log_tail(self, size=4096):  # pylint: disable=W0613
+        return ""
+
+    def read_new_log(self):
+        return ""
+
+    def crashed_exception(self):
+        return HoverflyCrashedException(f"The replay engine stopped. End of its log:\n{self.log_tail()}")
+
+    def resource_usage(self):
+        # The engine runs in pytest's own process, so there's nothing to measure separately
+        return None
+
+    def load(self, sim):
+        reason = unsupported_reason(sim)
+        if reason:
+            raise UnsupportedSimulation(f"The replay engine doesn't support {reason}")
+        pairs = [CompiledPair(pair) for pair in sim["data"]["pairs"]]
+        with self.lock:
+            self.simulation, self.pairs = sim, pairs
+
+    def reset(self):
+        with self.lock:
+            self.mode = "simulate"
+            self.simulation, self.pairs = EMPTY_SIMULATION, []
+            self.journal = []
+
+    def match(self, request):
+        """The response of the strongest matching pair (the first, if several match equally well), or None."""
+        best, best_score = None, -1
+        for pair in self.pairs:
+            score = pair.score(request)
+            if score is not None and score > best_score:
+                best, best_score = pair, score
+        return best.response if best else None
+
+    def log_request(self, request, response, started, mode):
+        entry = {
+            "request": {key: request[key] for key in ("path", "method", "destination", "scheme", "query", "body")},
+            "response": response,
+            "mode": mode,
+            "timeStarted": started.isoformat(),
+            "latency": (datetime.now(timezone.utc) - started).total_seconds() * 1000,
+        }
+        entry["request"]["headers"] = request["raw_headers"]
+        with self.lock:
+            self.journal.append(entry)
+            if self.journal_size is not None and len(self.journal) > self.journal_size:
+                # Like Hoverfly, the oldest entries make way for new ones
+                del self.journal[: len(self.journal) - self.journal_size]
+
+    def search_journal(self, request_matcher):
+        """Journal entries whose requests satisfy every matcher in `request_matcher`, like Hoverfly's journal search.
+        Only the plain request fields can be matched on."""
+        checks = [
+            (field, _compile_matcher(matcher))
+            for field, matchers in request_matcher.items()
+            for matcher in _matchers(matchers)
+        ]
+        with self.lock:
+            journal = list(self.journal)
+        return [
+            entry
+            for entry in journal
+            if all(
+                isinstance(entry["request"].get(field), str) and matches(entry["request"][field])
+                for field, matches in checks
+            )
+        ]
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """Proxies requests through the `ReplayEngine` the server belongs to."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        logger.debug("Replay engine: " + format, *args)
+
+    @property
+    def engine(self):
+        return self.server.engine
+
+    def _read_request(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        raw_headers = {}
+        for name, value in self.headers.items():
+            raw_headers.setdefault(name, []).append(value)
+        return {
+            "destination": url.netloc or self.headers.get("Host", ""),
+            "path": url.path or "/",
+            "method": self.command,
+            "scheme": url.scheme or "http",
+            "query": url.query,
+            "query_params": parse_qs(url.query, keep_blank_values=True),
+            "body": body.decode("utf-8", errors="replace"),
+            "raw_body": body,
+            "headers": {name.lower(): ";".join(values) for name, values in raw_headers.items()},
+            "raw_headers": raw_headers,
+        }
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, values in headers.items():
+            if name.lower() in HOP_BY_HOP_HEADERS:
+                continue
+            for value in values:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self):
+        started = datetime.now(timezone.utc)
+        request = self._read_request()
+        mode = self.engine.mode
+        response = self.engine.match(request)
+        if response is not None:
+            body = response.get("body") or ""
+            body = base64.b64decode(body) if response.get("encodedBody") else body.encode("utf-8")
+            headers = response.get("headers") or {}
+            # Hoverfly re-compresses bodies it stored decompressed
+            if any(value == "gzip" for value in _header(headers, "Content-Encoding")):
+                body = gzip.compress(body)
+            self._send(response.get("status", 200), headers, body)
+        elif mode == "spy":
+            response = self._forward(request)
+        else:
+            message = f"Hoverfly error: no match for {request['method']} {request['destination']}{request['path']}"
+            response = {"status": 502, "body": message, "encodedBody": False, "headers": {}}
+            self._send(502, {}, message.encode("utf-8"))
+        self.engine.log_request(request, response, started, mode)
+
+    def _forward(self, request):
+        connection = http.client.HTTPConnection(request["destination"], timeout=UPSTREAM_TIMEOUT)
+        path = request["path"] + (f"?{request['query']}" if request["query"] else "")
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        try:
+            connection.request(request["method"], path, body=request["raw_body"] or None, headers=headers)
+            upstream = connection.getresponse()
+            body = upstream.read()
+            headers = {}
+            for name, value in upstream.getheaders():
+                headers.setdefault(name, []).append(value)
+            status = upstream.status
+        except OSError as exc:
+            status, headers, body = 502, {}, f"Hoverfly error: {exc}".encode("utf-8")
+        finally:
+            connection.close()
+        self._send(status, headers, body)
+        encoded = not _is_text(body)
+        return {
+            "status": status,
+            "body": base64.b64encode(body).decode("ascii") if encoded else body.decode("utf-8"),
+            "encodedBody": encoded,
+            "headers": headers,
+        }
+
+    def do_CONNECT(self):  # pylint: disable=C0103
+        started = datetime.now(timezone.utc)
+        request = {
+            "destination": self.path,
+            "path": "",
+            "method": "CONNECT",
+            "scheme": "https",
+            "query": "",
+            "body": "",
+            "raw_headers": {},
+        }
+        if self.engine.mode != "spy":
+            self._send(502, {}, b"Hoverfly error: the replay engine can't simulate HTTPS")
+            self.engine.log_request(
+                request, {"status": 502, "body": "", "encodedBody": False, "headers": {}}, started, "simulate"
+            )
+            return
+        try:
+            host, _, port = self.path.rpartition(":")
+            upstream = socket.create_connection((host, int(port)), timeout=UPSTREAM_TIMEOUT)
+        except (OSError, ValueError):
+            self._send(502, {}, b"Hoverfly error: couldn't connect")
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        self.engine.log_request(
+            request, {"status": 200, "body": "", "encodedBody": False, "headers": {}}, started, "spy"
+        )
+        _tunnel(self.connection, upstream)
+        self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _serve
+
+
+def _header(headers, name):
+    return [value for key, values in headers.items() if key.lower() == name.lower() for value in values]
+
+
+def _is_text(body):
+    try:
+        body.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _tunnel(client, upstream):
+    sockets = [client, upstream]
+    try:
+        while True:
+            readable, _, errored = select.select(sockets, [], sockets, UPSTREAM_TIMEOUT)
+            if errored or not readable:
+                return
+            for sock in readable:
+                data = sock.recv(1 << 16)
+                if not data:
+                    return
+                (upstream if sock is client else client).sendall(data)
+    finally:
+        upstream.close()
+
+
+class AdminHandler(BaseHTTPRequestHandler):
+    """Serves the admin API of the `ReplayEngine` the server belongs to."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        logger.debug("Replay engine admin: " + format, *args)
+
+    @property
+    def engine(self):
+        return self.server.engine
+
+    def _send(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):  # pylint: disable=C0103
+        url = urlsplit(self.path)
+        if url.path == "/api/v2/hoverfly/mode":
+            return self._send({"mode": self.engine.mode, "arguments": {}})
+        if url.path == "/api/v2/simulation":
+            return self._send(self.engine.simulation)
+        if url.path == "/api/v2/journal":
+            query = parse_qs(url.query)
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["25"])[0])
+            journal = self.engine.journal
+            return self._send(
+                {"journal": journal[offset : offset + limit], "offset": offset, "limit": limit, "total": len(journal)}
+            )
+        return self._send({"error": f"{url.path} isn't supported by the replay engine"}, status=404)
+
+    def do_PUT(self):  # pylint: disable=C0103
+        body = self._body()
+        if self.path.startswith("/api/v2/hoverfly/mode"):
+            mode = json.loads(body)["mode"]
+            if mode not in self.engine.modes:
+                return self._send({"error": f"The replay engine doesn't support {mode} mode"}, status=422)
+            self.engine.mode = mode
+            return self._send({"mode": mode})
+        if self.path.startswith("/api/v2/simulation"):
+            try:
+                self.engine.load(json.loads(body))
+            except UnsupportedSimulation as exc:
+                return self._send({"error": str(exc)}, status=422)
+            return self._send(self.engine.simulation)
+        return self._send({"error": f"{self.path} isn't supported by the replay engine"}, status=404)
+
+    def do_POST(self):  # pylint: disable=C0103
+        body = self._body()
+        if self.path.startswith("/api/v2/journal"):
+            return self._send(self.engine.search_journal(json.loads(body).get("request") or {}))
+        return self._send({"error": f"{self.path} isn't supported by the replay engine"}, status=404)
+
+    def do_DELETE(self):  # pylint: disable=C0103
+        if self.path.startswith("/api/v2/journal"):
+            with self.engine.lock:
+                self.engine.journal = []
+        elif self.path.startswith("/api/v2/simulation"):
+            self.engine.load(EMPTY_SIMULATION)
+        return self._send({})
@@ -0,0 +1,44 @@
+import collections
+import os
+
+USER_PROPERTY = "hoverfly_resources"
+
+# A process's resident memory, in bytes, and the CPU time it has used so far, in seconds
+ResourceUsage = collections.namedtuple("ResourceUsage", ["rss", "cpu_seconds"])
+
+
+def _proc_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # The fields after the process name, which is in brackets and may contain spaces. See proc(5).
+    fields = stat[stat.rindex(")") + 2 :].split()
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    return ResourceUsage(int(fields[21]) * os.sysconf("SC_PAGE_SIZE"), cpu_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def process_usage(pid):
+    """The resource usage of the process `pid`, or None if it can't be measured. Uses psutil if it's installed, or
+    /proc on Linux."""
+    try:
+        import psutil  # pylint: disable=C0415
+    except ImportError:
+        return _proc_usage(pid) if os.path.isdir("/proc") else None
+    try:
+        process = psutil.Process(pid)
+        cpu_times = process.cpu_times()
+        return ResourceUsage(process.memory_info().rss, cpu_times.user + cpu_times.system)
+    except psutil.Error:
+        return None
+
+
+def usage_report(before, after):
+    """What a test's Hoverfly instance used while the test ran: its memory at the end, and the CPU time it spent."""
+    if after is None:
+        return None
+    return {
+        "rss_mb": round(after.rss / (1 << 20), 1),
+        "cpu_seconds": round(after.cpu_seconds - (before.cpu_seconds if before else 0), 3),
+    }
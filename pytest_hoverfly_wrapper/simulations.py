@@ -1,8 +1,16 @@
+import copy
+import functools
+import hashlib
 import json
 import os
 import time
 
+from .hosts import BLOCK, HostPolicy
 from .logger import logger
+from .storage import load_simulation
+
+# Maximum number of parsed simulation files kept in memory by each worker
+SIMULATION_CACHE_SIZE = 64
 
 
 class StaticSimulation:  # pylint: disable=R0903
@@ -22,22 +30,30 @@ class StaticSimulation:  # pylint: disable=R0903
         self.capture_config = capture_config
         self.file_paths = [os.path.join(self.file_type, file) for file in self.files]
 
+    def source_files(self, data_dir):
+        """The simulation files the test reads."""
+        return [os.path.join(data_dir, path) for path in self.file_paths]
+
     def full_file_path(self, data_dir, admin_port):
         # Specifying one static simulation that doesn't exist implies we want to record it once, then use it.
         if len(self.file_paths) == 1:
-            return os.path.join(data_dir, "static", self.files[0])
+            path = os.path.join(data_dir, self.file_paths[0])
+            # Once it's recorded, blocking domains still means combining it with the block pair
+            if not self.block_domains or not os.path.exists(path):
+                return path
 
         # pre-loaded simulations are modularised into multiple simulations, so need to be glommed into one for hoverfly
         # We just need a thread-specific identifier for each combined simulation - the admin port will do nicely
         if self.file_paths:
             return _combine_simulations(
-                [os.path.join(data_dir, p) for p in self.file_paths], domains_to_block=(), worker=admin_port
+                [os.path.join(data_dir, p) for p in self.file_paths],
+                domains_to_block=self.block_domains,
+                worker=admin_port,
             )
-        return _combine_simulations(simulations=[BLOCK_DOMAIN_TEMPLATE], domains_to_block=(), worker=admin_port)
+        return _combine_simulations(simulations=[], domains_to_block=self.block_domains, worker=admin_port)
 
 
 class GeneratedSimulation:  # pylint: disable=R0903
-
     """Data class for static Hoverfly simulation files
 
     :str file: the file simulations are recorded to or read from
@@ -57,6 +73,10 @@ class GeneratedSimulation:  # pylint: disable=R0903
         self.static_files = list(static_files) + self.default_static_files
         self.static_files = [os.path.join("static", file) for file in self.static_files]
 
+    def source_files(self, data_dir):
+        """The simulation files the test reads, or records to."""
+        return [os.path.join(data_dir, path) for path in (*self.static_files, self.file)]
+
     def full_file_path(self, data_dir, admin_port):
         for sim in self.static_files:
             logger.info("Static simulations used in test: %s", sim)
@@ -70,28 +90,79 @@ class GeneratedSimulation:  # pylint: disable=R0903
 
 
 def _combine_simulations(simulations, domains_to_block, worker):
-    with open(simulations[0]) as file:
-        combined_sim = json.load(file)
-
-    for sim in simulations[1:]:
-        with open(sim) as file:
-            pairs = json.load(file)["data"]["pairs"]
-            combined_sim["data"]["pairs"] += pairs
-    for domain in domains_to_block:
-        pairs = template_block_domain_json(domain)["data"]["pairs"]
-        combined_sim["data"]["pairs"] += pairs
-    file_name = f"combined_temp_{worker}.json"
-    with open(file_name, "w") as file:
-        file.write(json.dumps(combined_sim, indent=4, separators=(",", ": ")))
+    # The combined file is named after its inputs, so an identical combination from an earlier test can be reused
+    keys = [_file_key(sim) for sim in simulations]
+    domains_to_block = tuple(sorted(set(domains_to_block)))
+    digest = hashlib.sha1(repr((keys, domains_to_block)).encode("utf-8")).hexdigest()[:16]
+    file_name = f"combined_temp_{worker}_{digest}.json"
+    if os.path.exists(file_name):
+        logger.debug("Reusing combined simulation %s", file_name)
+        return file_name
+
+    # Without any simulations, the block template provides the rest of the simulation
+    first_sim = _load_simulation(*keys[0]) if keys else _block_template()
+    pairs = list(first_sim["data"]["pairs"]) if keys else []
+    for key in keys[1:]:
+        pairs += _load_simulation(*key)["data"]["pairs"]
+    pairs += block_domain_pairs(domains_to_block)
+    # Cached simulations are shared between tests, so build a new top level rather than mutating them
+    combined_sim = {**first_sim, "data": {**first_sim["data"], "pairs": pairs}}
+    # Only Hoverfly reads this file, so there's no point making it readable
+    with open(f"{file_name}.tmp", "w") as file:
+        file.write(json.dumps(combined_sim, separators=(",", ":")))
+    os.replace(f"{file_name}.tmp", file_name)
     return file_name
 
 
-def template_block_domain_json(domain):
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+@functools.lru_cache(maxsize=SIMULATION_CACHE_SIZE)
+def _load_simulation(path, mtime_ns, size):  # pylint: disable=W0613
+    """Parses a simulation file. The modification time and size are part of the cache key, so edits are picked up.
+
+    The returned simulation is shared between callers and must not be modified.
+    """
+    return load_simulation(path)
+
+
+@functools.lru_cache(maxsize=1)
+def _block_template_text():
     with open(BLOCK_DOMAIN_TEMPLATE) as file:
-        sim = file.read()
-        sim = sim.replace("<DOMAIN>", domain)
+        return file.read()
+
+
+@functools.lru_cache(maxsize=1)
+def _block_template():
+    """The parsed block template. Shared between callers, so must not be modified."""
+    return json.loads(_block_template_text())
+
+
+def cached_simulation(path):
+    """Parses a simulation file, reusing the result until the file changes. Must not be modified."""
+    return _load_simulation(*_file_key(path))
+
+
+def template_block_domain_json(domain):
+    return json.loads(_block_template_text().replace("<DOMAIN>", domain))
+
+
+@functools.lru_cache(maxsize=SIMULATION_CACHE_SIZE)
+def _block_domain_pairs(domains):
+    regex = HostPolicy(block=domains).destination_regex(BLOCK)
+    if regex is None:
+        return ()
+    # One pair with a regex matching every domain, rather than a pair per domain for Hoverfly to try in turn
+    (pair,) = _block_template()["data"]["pairs"]
+    request = {**pair["request"], "destination": [{"matcher": "regex", "value": regex}]}
+    return ({**pair, "request": request},)
+
 
-    return json.loads(sim)
+def block_domain_pairs(domains):
+    """Pairs that block requests to `domains` (and their subdomains), which may include globs."""
+    return list(copy.deepcopy(_block_domain_pairs(tuple(sorted(set(domains))))))
 
 
 BLOCK_DOMAIN_TEMPLATE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "block_domain_template.json")
@@ -0,0 +1,266 @@
+import argparse
+import codecs
+import contextlib
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+FORMATS = ("json", "compact", "gzip", "lzma")
+BLOB_DIRECTORY = "blobs"
+# Key that replaces the body of a response whose body has been moved into the blob directory
+BLOB_KEY = "bodyBlob"
+
+# Unescaped quotes can't appear inside JSON strings, so this can only ever match the key itself
+PAIRS_KEY = re.compile(r'"pairs"\s*:\s*\[')
+SEPARATORS = re.compile(r"[\s,]*")
+PLACEHOLDER = "__pairs__"
+STREAM_CHUNK_SIZE = 1 << 16
+
+GZIP_MAGIC = b"\x1f\x8b"
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+
+
+def _detect_compression(path):
+    with open(path, "rb") as file:
+        magic = file.read(len(LZMA_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(LZMA_MAGIC):
+        return "lzma"
+    return None
+
+
+def open_simulation(path, mode="rt"):
+    """Opens a simulation file, transparently decompressing it."""
+    compression = _detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, mode, encoding="utf-8")
+    if compression == "lzma":
+        return lzma.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")  # pylint: disable=R1732
+
+
+def _blob_path(sim_path, reference):
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(sim_path)), reference))
+
+
+def inline_body(pair, sim_path):
+    """Puts a response body that was moved into the blob directory back into its pair."""
+    response = pair["response"]
+    reference = response.pop(BLOB_KEY, None)
+    if reference is not None:
+        with open(_blob_path(sim_path, reference), encoding="utf-8", newline="") as file:
+            response["body"] = file.read()
+    return pair
+
+
+def load_simulation(path):
+    with open_simulation(path) as file:
+        sim = json.load(file)
+    for pair in sim["data"]["pairs"]:
+        inline_body(pair, path)
+    return sim
+
+
+def read_simulation_bytes(path):
+    """The simulation as plain JSON, ready to be sent to Hoverfly."""
+    if _detect_compression(path) is None:
+        with open(path, "rb") as file:
+            data = file.read()
+        # Most simulations are plain JSON, which can be sent as-is
+        if f'"{BLOB_KEY}"'.encode("utf-8") not in data:
+            return data
+    return json.dumps(load_simulation(path)).encode("utf-8")
+
+
+class PairStream:
+    """Parses a simulation from an iterable of text chunks, one pair at a time, so that only the pair being parsed is
+    held in memory.
+
+    Iterate over the instance to get the pairs. Once they've all been read, `skeleton()` returns the rest of the
+    simulation with an empty list of pairs.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+        self.head = None
+        self.tail = None
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self, minimum=1):
+        """Reads at least `minimum` more characters, unless the stream runs out. Returns whether anything was read."""
+        new_chunks = []
+        read = 0
+        for chunk in self.chunks:
+            new_chunks.append(chunk)
+            read += len(chunk)
+            if read >= minimum:
+                break
+        self.buffer = self.buffer[self.pos :] + "".join(new_chunks)
+        self.pos = 0
+        return bool(new_chunks)
+
+    def _next_token(self):
+        while True:
+            match = SEPARATORS.match(self.buffer, self.pos)
+            self.pos = match.end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                raise ValueError("Simulation ended in the middle of its pairs")
+
+    def __iter__(self):
+        match = PAIRS_KEY.search(self.buffer)
+        while not match:
+            if not self._read_more():
+                raise ValueError("Simulation has no pairs")
+            match = PAIRS_KEY.search(self.buffer)
+        self.head = self.buffer[: match.end()]
+        self.pos = match.end()
+        while self._next_token() != "]":
+            try:
+                pair, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The pair doesn't fit in the buffer yet. Doubling it each time keeps large pairs from being re-parsed
+                # over and over.
+                if not self._read_more(minimum=len(self.buffer) - self.pos):
+                    raise
+                continue
+            yield pair
+        self.tail = self.buffer[self.pos + 1 :] + "".join(self.chunks)
+
+    def skeleton(self):
+        return json.loads(f"{self.head}]{self.tail}")
+
+
+def iter_text(byte_chunks):
+    return codecs.iterdecode(byte_chunks, "utf-8")
+
+
+class SimulationStorage:
+    """How simulations get written to disk.
+
+    :str fmt: one of `FORMATS`
+    :int blob_threshold: response bodies longer than this get moved into the blob directory. 0 disables this.
+    """
+
+    def __init__(self, fmt="json", blob_threshold=0):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown simulation format {fmt!r}, expected one of {FORMATS}")
+        self.fmt = fmt
+        self.blob_threshold = blob_threshold
+
+    def dumps(self, obj):
+        if self.fmt == "json":
+            return json.dumps(obj, indent=4, separators=(",", ": "))
+        return json.dumps(obj, separators=(",", ":"))
+
+    @contextlib.contextmanager
+    def open_for_write(self, path):
+        """Opens a temporary file in the right format, which replaces `path` if the block completes."""
+        tmp_path = f"{path}.tmp"
+        if self.fmt == "gzip":
+            file = gzip.open(tmp_path, "wt", encoding="utf-8")
+        elif self.fmt == "lzma":
+            file = lzma.open(tmp_path, "wt", encoding="utf-8")
+        else:
+            file = open(tmp_path, "w", encoding="utf-8")  # pylint: disable=R1732
+        try:
+            with file:
+                yield file
+            os.replace(tmp_path, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+
+    def externalise_body(self, pair, sim_path):
+        """Moves a large response body out into the blob directory, leaving a reference to it in the pair."""
+        response = pair["response"]
+        body = response.get("body") or ""
+        if not self.blob_threshold or len(body) <= self.blob_threshold:
+            return pair
+        encoded = body.encode("utf-8")
+        digest = hashlib.sha256(encoded).hexdigest()
+        reference = posixpath.join(os.pardir, BLOB_DIRECTORY, digest[:2], digest)
+        blob_path = _blob_path(sim_path, reference)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            with open(f"{blob_path}.tmp", "wb") as file:
+                file.write(encoded)
+            os.replace(f"{blob_path}.tmp", blob_path)
+        response["body"] = ""
+        response[BLOB_KEY] = reference
+        return pair
+
+    def save(self, path, sim):
+        for pair in sim["data"]["pairs"]:
+            self.externalise_body(pair, path)
+        with self.open_for_write(path) as file:
+            file.write(self.dumps(sim))
+
+    def _split_around_pairs(self, skeleton):
+        """The serialised simulation before and after its pairs, and what goes between consecutive pairs."""
+        head, tail = self.dumps({**skeleton, "data": {**skeleton["data"], "pairs": [PLACEHOLDER]}}).split(
+            json.dumps(PLACEHOLDER)
+        )
+        indent = head[head.rfind("\n") :] if "\n" in head else ""
+        return head, tail, indent
+
+    def save_stream(self, path, chunks, transform=None):
+        """Saves a simulation read from an iterable of text chunks, holding at most one pair in memory at a time.
+
+        :callable transform: applied to the iterator of pairs. Returns an iterable of the pairs to save.
+        :return: the number of pairs saved, and the rest of the simulation
+        """
+        stream = PairStream(chunks)
+        # The pairs come before the rest of the simulation, so they're spooled to disk until the rest is known
+        _, _, indent = self._split_around_pairs({"data": {}})
+        saved = 0
+        with tempfile.TemporaryFile("w+", encoding="utf-8", dir=os.path.dirname(os.path.abspath(path))) as spool:
+            for pair in stream if transform is None else transform(iter(stream)):
+                self.externalise_body(pair, path)
+                if saved:
+                    spool.write("," + indent)
+                spool.write(self.dumps(pair).replace("\n", indent))
+                saved += 1
+            skeleton = stream.skeleton()
+            head, tail, _ = self._split_around_pairs(skeleton)
+            spool.seek(0)
+            with self.open_for_write(path) as file:
+                file.write(head if saved else head.rstrip())
+                shutil.copyfileobj(spool, file)
+                file.write(tail if saved else tail.lstrip())
+        return saved, skeleton
+
+
+def convert(path, storage):
+    storage.save(path, load_simulation(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts simulation files between storage formats.")
+    parser.add_argument("files", nargs="+", help="simulation files to convert in place")
+    parser.add_argument("--format", choices=FORMATS, default="json", help="format to convert to")
+    parser.add_argument(
+        "--blob-threshold",
+        type=int,
+        default=0,
+        help="move response bodies longer than this into the shared blob directory (0 keeps all bodies inline)",
+    )
+    args = parser.parse_args(argv)
+    storage = SimulationStorage(args.format, args.blob_threshold)
+    for path in args.files:
+        convert(path, storage)
+        print(f"Converted {path}")
+
+
+if __name__ == "__main__":
+    main()
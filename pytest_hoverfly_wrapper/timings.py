@@ -0,0 +1,112 @@
+import contextlib
+import json
+import time
+
+USER_PROPERTY = "hoverfly_timings"
+
+
+class PhaseTimer:
+    """Times the phases of the plugin's work for a test. Phases that happen more than once are added up."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def _total(self, names):
+        return sum(self.phases.get(name, 0) for name in names)
+
+    @contextlib.contextmanager
+    def phase(self, name, excluding=()):
+        """Times a block as the phase `name`, less any time the block spends in the phases `excluding`."""
+        start = time.perf_counter()
+        excluded = self._total(excluding)
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start - (self._total(excluding) - excluded))
+
+
+def timed_iter(iterable, timer, name):
+    """Yields from `iterable`, adding the time spent waiting for each item to the phase `name`."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timer.add(name, time.perf_counter() - start)
+        yield item
+
+
+def timer_for(node):
+    """The timer of the test, or one that nobody reads if the test isn't being timed."""
+    return getattr(node, "hoverfly_timer", None) or PhaseTimer()
+
+
+class TimingReport:
+    """Plugin that collects the timings attached to test reports, so works the same whether or not tests run in xdist
+    workers. Prints a summary at the end of the session, and optionally saves the timings as JSON.
+
+    :int count: number of the slowest tests to list in the summary. 0 disables the summary.
+    :str json_path: file to save the timings in
+    """
+
+    def __init__(self, count=0, json_path=None):
+        self.count = count
+        self.json_path = json_path
+        self.tests = {}
+
+    def pytest_runtest_logreport(self, report):
+        if report.when != "teardown":
+            return
+        for name, phases in report.user_properties:
+            if name == USER_PROPERTY:
+                self.tests[report.nodeid] = phases
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.count and self.tests:
+            self.write_summary(terminalreporter)
+
+    def pytest_sessionfinish(self):
+        if self.json_path:
+            self.write_json(self.json_path)
+
+    def phase_totals(self):
+        totals = {}
+        for phases in self.tests.values():
+            for phase, seconds in phases.items():
+                totals[phase] = totals.get(phase, 0) + seconds
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def slowest_tests(self):
+        return sorted(self.tests.items(), key=lambda item: sum(item[1].values()), reverse=True)[: self.count]
+
+    def write_summary(self, terminalreporter):
+        terminalreporter.section("hoverfly timings")
+        terminalreporter.write_line("Time spent in each phase, over all tests:")
+        for phase, seconds in self.phase_totals().items():
+            terminalreporter.write_line(f"{seconds:10.3f}s  {phase}")
+        terminalreporter.write_line(f"Slowest {self.count} tests:")
+        for nodeid, phases in self.slowest_tests():
+            slowest_phase = max(phases, key=phases.get)
+            terminalreporter.write_line(
+                f"{sum(phases.values()):10.3f}s  {nodeid} (mostly {slowest_phase}: {phases[slowest_phase]:.3f}s)"
+            )
+
+    def write_json(self, path):
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "phases": self.phase_totals(),
+                    "tests": [
+                        {"nodeid": nodeid, "total": sum(phases.values()), "phases": phases}
+                        for nodeid, phases in self.tests.items()
+                    ],
+                },
+                file,
+                indent=4,
+            )
@@ -51,5 +51,8 @@ setup(
         "pytest11": [
             "hoverfly-wrapper = pytest_hoverfly_wrapper.plugin",
         ],
+        "console_scripts": [
+            "pytest-hoverfly-refresh = pytest_hoverfly_wrapper.refresh:main",
+        ],
     },
 )
@@ -0,0 +1,107 @@
+import json
+import platform
+import statistics
+import time
+
+import pytest
+from fake_hoverfly import FakeHoverfly
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--hoverfly-benchmark-json",
+        action="store",
+        default=None,
+        help="Write the benchmark results to this file as JSON, so they can be compared between runs.",
+    )
+    parser.addoption(
+        "--hoverfly-benchmark-scale",
+        action="store",
+        type=int,
+        default=1,
+        help="Multiplies the size of each benchmark's input. The default keeps the suite quick enough for CI.",
+    )
+
+
+class Benchmark:  # pylint: disable=R0903
+    """Times a function over a number of rounds, and records the result against the current test.
+
+    :list results: where results get recorded
+    :str name: name of the benchmark
+    """
+
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __call__(self, func, rounds=5, setup=None, **params):
+        """Runs `setup` (untimed) and then `func` `rounds` times. Returns the last result of `func`."""
+        timings = []
+        result = None
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        self.results.append(
+            {
+                "name": self.name,
+                "params": params,
+                "rounds": rounds,
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "mean": statistics.mean(timings),
+                "max": max(timings),
+            }
+        )
+        return result
+
+
+@pytest.fixture(scope="session")
+def hoverfly_benchmark_results(request):
+    results = []
+    yield results
+    path = request.config.getoption("hoverfly_benchmark_json")
+    if path:
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "implementation": platform.python_implementation(),
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "benchmarks": results,
+                },
+                file,
+                indent=4,
+            )
+    request.config.hoverfly_benchmark_results = results
+
+
+@pytest.fixture
+def hoverfly_benchmark(request, hoverfly_benchmark_results):
+    return Benchmark(hoverfly_benchmark_results, request.node.name)
+
+
+@pytest.fixture
+def scale(request):
+    return request.config.getoption("hoverfly_benchmark_scale")
+
+
+@pytest.fixture
+def fake_hoverfly():
+    fake = FakeHoverfly().start()
+    yield fake
+    fake.stop()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = getattr(config, "hoverfly_benchmark_results", None)
+    if not results:
+        return
+    terminalreporter.section("benchmarks")
+    for result in results:
+        terminalreporter.write_line(
+            f"{result['name']:<60} median {result['median'] * 1000:9.2f}ms  min {result['min'] * 1000:9.2f}ms"
+        )
@@ -0,0 +1,43 @@
+"""A stand-in for Hoverfly's admin API, so that the plugin can be benchmarked without the network or a real binary.
+
+It's the replay engine's admin API, without its proxy, so implements the mode, simulation, journal, state and cache
+endpoints. Run it directly to use it in place of the Hoverfly executable: `python fake_hoverfly.py -pp <proxy port>
+-ap <admin port>`. The proxy port is accepted but not served.
+"""
+
+import argparse
+import threading
+
+from pytest_hoverfly_wrapper.replay import AdminHandler, ReplayEngine
+
+
+class FakeHoverfly(ReplayEngine):
+    """The fake admin API, served from a background thread. Unlike the replay engine, it accepts any mode.
+
+    :int admin_port: port to serve on. 0 picks a free one.
+    """
+
+    modes = ("capture", "diff", "modify", "simulate", "spy", "synthesize")
+
+    def __init__(self, admin_port=0):
+        super().__init__(None, admin_port)
+
+    def start(self):
+        self.admin_port = self.serve(self.admin_port, AdminHandler).server_address[1]
+        return self
+
+    def stop(self):
+        self.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-pp", type=int, default=8500, help="proxy port (not served)")
+    parser.add_argument("-ap", type=int, default=8888, help="admin port")
+    args, _ = parser.parse_known_args(argv)
+    FakeHoverfly(args.ap).start()
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Benchmarks of the plugin's own overhead per test, run against the fake Hoverfly in `fake_hoverfly.py`.
+
+Run with `pytest tests/benchmarks -p no:hoverfly-wrapper --hoverfly-benchmark-json=results.json`, and
+`--hoverfly-benchmark-scale=10` for more representative input sizes.
+"""
+
+import glob
+import json
+import os
+import sys
+import types
+
+import pytest
+from helpers import IniConfig
+
+from pytest_hoverfly_wrapper import simulations
+from pytest_hoverfly_wrapper.admin import JournalAPI
+from pytest_hoverfly_wrapper.logs import LogWriter
+from pytest_hoverfly_wrapper.plugin import generate_logs, record, reset_hoverfly
+from pytest_hoverfly_wrapper.ports import PortAllocator
+from pytest_hoverfly_wrapper.process import HoverflyProcess
+
+
+def captured_pair(i, host="example.com"):
+    return {
+        "request": {
+            "destination": [{"matcher": "exact", "value": host}],
+            "path": [{"matcher": "exact", "value": f"/resource/{i}"}],
+            "method": [{"matcher": "exact", "value": "GET"}],
+        },
+        "response": {
+            "status": 200,
+            "body": json.dumps({"id": i, "items": list(range(20))}),
+            "encodedBody": False,
+            "headers": {"Content-Type": ["application/json"], "Set-Cookie": [f"id={i}; Expires=Wed, 21 Oct 2015"]},
+        },
+    }
+
+
+def journal_entry(i, host="example.com"):
+    return {
+        "request": {"destination": host, "path": f"/resource/{i}", "method": "GET", "scheme": "https", "headers": {}},
+        "response": {
+            "status": 200,
+            "body": "x" * 2000,
+            "encodedBody": False,
+            "headers": {"Hoverfly-Cache-Served": ["True"]},
+        },
+        "mode": "simulate",
+        "timeStarted": "2024-01-01T00:00:00Z",
+        "latency": 0.1,
+    }
+
+
+@pytest.fixture
+def fake_executable(tmpdir):
+    """The fake Hoverfly, to start instead of the real one."""
+    if os.name == "nt":
+        pytest.skip("The fake executable is a script with a shebang")
+    script = tmpdir.join("hoverfly")
+    here = os.path.dirname(os.path.abspath(__file__))
+    script.write(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        # The fake is built on the plugin's replay engine
+        f"sys.path[:0] = [{here!r}, {os.path.dirname(os.path.dirname(here))!r}]\n"
+        "from fake_hoverfly import main\n"
+        "main()\n"
+    )
+    script.chmod(0o755)
+    return script.strpath
+
+
+def test_startup(hoverfly_benchmark, fake_executable, tmpdir):
+    allocator = PortAllocator(tmpdir.join("locks").strpath)
+    ports = allocator.reserve_pair()
+    log_file = tmpdir.join("hoverfly.log").strpath
+    try:
+        hoverfly_benchmark(
+            lambda: HoverflyProcess(*ports, log_file, executable=fake_executable).start().kill(), rounds=3
+        )
+    finally:
+        allocator.release_all()
+
+
+def test_reset_for_reuse(hoverfly_benchmark, fake_hoverfly):
+    fake_hoverfly.journal = [journal_entry(i) for i in range(100)]
+    hoverfly_benchmark(lambda: reset_hoverfly(fake_hoverfly.admin_port), rounds=20)
+
+
+@pytest.mark.parametrize("warm", [False, True], ids=["cold", "warm"])
+def test_combine_simulations(hoverfly_benchmark, scale, tmpdir, monkeypatch, warm):
+    monkeypatch.chdir(tmpdir)
+    files = 10 * scale
+    sims = []
+    for i in range(files):
+        sim = tmpdir.join(f"static_{i}.json")
+        sim.write(json.dumps({"data": {"pairs": [captured_pair(i * 50 + j) for j in range(50)]}, "meta": {}}))
+        sims.append(sim.strpath)
+
+    def setup():
+        if not warm:
+            simulations._load_simulation.cache_clear()  # pylint: disable=W0212
+        for file in glob.glob("combined_temp*.json"):
+            os.remove(file)
+
+    hoverfly_benchmark(
+        lambda: simulations._combine_simulations(sims, (), 8888),  # pylint: disable=W0212
+        setup=setup,
+        files=files,
+        pairs_per_file=50,
+    )
+
+
+@pytest.mark.parametrize("dedupe", ["off", "sequence"])
+def test_record(hoverfly_benchmark, scale, fake_hoverfly, tmpdir, dedupe):
+    pairs = 500 * scale
+    fake_hoverfly.simulation = {
+        "data": {"pairs": [captured_pair(i % 100) for i in range(pairs)], "globalActions": {"delays": []}},
+        "meta": {"schemaVersion": "v5", "timeExported": "2024-01-01T00:00:00Z"},
+    }
+    node = types.SimpleNamespace(config=IniConfig(hoverfly_dedupe=dedupe), ignore="localhost", user_properties=[])
+    sim_file = tmpdir.join("recorded.json").strpath
+
+    def run_record():
+        steps = record(sim_file, node, 0, fake_hoverfly.admin_port, None)
+        next(steps)
+        for _ in steps:
+            pass
+
+    hoverfly_benchmark(run_record, pairs=pairs)
+    assert os.path.getsize(sim_file)
+
+
+def test_journal_get(hoverfly_benchmark, scale, fake_hoverfly):
+    entries = 2000 * scale
+    fake_hoverfly.journal = [journal_entry(i) for i in range(entries)]
+    journal = hoverfly_benchmark(lambda: JournalAPI(fake_hoverfly.admin_port).get(), entries=entries)
+    assert journal["total"] == entries
+
+
+def test_generate_logs(hoverfly_benchmark, scale, fake_hoverfly, tmpdir):
+    entries = 2000 * scale
+    fake_hoverfly.journal = [journal_entry(i, host=f"host{i % 10}.com") for i in range(entries)]
+    node = types.SimpleNamespace(nodeid="test_generate_logs", sensitive=("host1.com", "*.bank.*"), mode="simulate")
+    request = types.SimpleNamespace(node=node)
+    journal_api = JournalAPI(fake_hoverfly.admin_port)
+    # Only the time the test waits for is measured. The log is written in the background.
+    writer = LogWriter(tmpdir.strpath)
+    try:
+        hoverfly_benchmark(lambda: generate_logs(request, journal_api, writer), entries=entries)
+    finally:
+        writer.close()
@@ -1,8 +1,13 @@
 import pathlib
 import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
+from pytest_hoverfly_wrapper.ports import PortAllocator
+from pytest_hoverfly_wrapper.replay import ReplayEngine
+
 pytest_plugins = "pytester"  # pylint: disable=C0103
 TEST_DIR = pathlib.Path(__file__).parent.resolve()
 
@@ -14,3 +19,36 @@ def pyfile_source(request):
     pyfile_full_path = TEST_DIR / "end_to_end" / "makepyfile_inputs" / pyfile_name
     with open(pyfile_full_path) as file:
         yield file.read()
+
+
+@pytest.fixture
+def engine(tmpdir):
+    """A running replay engine, on ports reserved for the test."""
+    allocator = PortAllocator(tmpdir.join("locks").strpath)
+    engine = ReplayEngine(*allocator.reserve_pair()).start()
+    yield engine
+    engine.kill()
+    allocator.release_all()
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """A real host, which answers every request with "live"."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.write(b"live")
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+@pytest.fixture
+def upstream():
+    """The destination of an `Upstream` server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
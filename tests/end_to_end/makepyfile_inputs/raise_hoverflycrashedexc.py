@@ -1,10 +1,9 @@
 import pytest
-import requests
 
 from pytest_hoverfly_wrapper.simulations import GeneratedSimulation
 
 
 @pytest.mark.simulated(GeneratedSimulation())
-def test_sth(setup_hoverfly, mocker):
-    mock_obj = mocker.patch("requests.get")
-    mock_obj.side_effect = requests.exceptions.ConnectionError
+def test_sth(request, setup_hoverfly):
+    request.node.hoverfly_process.kill()
+    request.node.hoverfly_process.wait()
@@ -0,0 +1,13 @@
+import time
+
+import pytest
+
+from pytest_hoverfly_wrapper.simulations import GeneratedSimulation
+
+
+@pytest.mark.simulated(GeneratedSimulation())
+def test_sth(request, setup_hoverfly):
+    request.node.hoverfly_process.kill()
+    # The watchdog should interrupt the test well before this finishes
+    for _ in range(600):
+        time.sleep(0.1)
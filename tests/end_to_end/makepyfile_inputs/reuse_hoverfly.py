@@ -0,0 +1,16 @@
+import requests
+
+
+def test_first(setup_hoverfly, journal_api):
+    proxy_port = setup_hoverfly[1]
+    proxies = {
+        "http": "http://localhost:{}".format(proxy_port),
+        "https": "http://localhost:{}".format(proxy_port),
+    }
+    requests.get("http://google.com", proxies=proxies)
+    assert journal_api.get()["total"]
+
+
+def test_second(setup_hoverfly, journal_api):
+    # The instance is shared with the previous test, so its journal must have been cleared
+    assert journal_api.get()["total"] == 0
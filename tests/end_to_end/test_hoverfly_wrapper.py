@@ -4,8 +4,7 @@ from pytest_hoverfly_wrapper.plugin import TEST_DATA_DIR
 
 
 def test_raise_hoverflycrashedexc(testdir, pyfile_source):
-    """The plugin should raise HoverflyCrashedException when ConnectionError is raised
-    while accessing hoverfly."""
+    """The plugin should raise HoverflyCrashedException when Hoverfly is found dead after a test."""
 
     testdir.makepyfile(pyfile_source)
     result = testdir.runpytest()
@@ -14,7 +13,24 @@ def test_raise_hoverflycrashedexc(testdir, pyfile_source):
 
     result.stdout.fnmatch_lines(
         [
-            "*raise HoverflyCrashedException*",
+            "*HoverflyCrashedException: Hoverfly crashed*",
+        ]
+    )
+
+
+def test_raise_hoverflycrashedexc_watchdog(testdir, pyfile_source):
+    """With the watchdog on, the plugin should raise HoverflyCrashedException as soon as Hoverfly dies mid-test."""
+
+    testdir.makepyfile(pyfile_source)
+    result = testdir.runpytest("--hoverfly-watchdog")
+
+    assert result.ret == 1
+    # The test sleeps for a minute after killing Hoverfly, so it must have been interrupted
+    assert result.duration < 30
+
+    result.stdout.fnmatch_lines(
+        [
+            "*HoverflyCrashedException: Hoverfly crashed*",
         ]
     )
 
@@ -98,6 +114,13 @@ def test_marker_registered(testdir, pyfile_source):
     assert result.ret == 0
 
 
+def test_reuse_hoverfly(testdir, pyfile_source):
+    """A reused Hoverfly instance should be reset between tests."""
+    testdir.makepyfile(pyfile_source)
+    result = testdir.runpytest("--hoverfly-reuse")
+    assert result.ret == 0
+
+
 # TODO: end-to-end tests covering:
 #  using static sims,
 #  recording and using sims,
@@ -0,0 +1,22 @@
+"""Helpers shared by the unit tests and the benchmarks."""
+
+INI_DEFAULTS = {
+    "hoverfly_simulation_format": "json",
+    "hoverfly_blob_threshold": "0",
+    "hoverfly_dedupe": "off",
+    "hoverfly_volatile_headers": [],
+    "hoverfly_max_rss": "1024",
+}
+
+
+class IniConfig:  # pylint: disable=R0903
+    """Just enough of pytest's config for the plugin's functions: ini values, and the session's Hoverfly instances."""
+
+    def __init__(self, **ini):
+        self.ini = {**INI_DEFAULTS, **ini}
+        self.hoverfly_replay_engine = None
+        self.hoverfly_launcher = None
+        self.hoverfly_processes = {}
+
+    def getini(self, name):
+        return self.ini[name]
@@ -0,0 +1,89 @@
+import subprocess
+import sys
+
+import pytest
+
+# The plugin isn't installed, so the test runs load it explicitly
+PLUGIN = ("-p", "pytest_hoverfly_wrapper.plugin")
+
+
+@pytest.fixture
+def mock_manage_executables(mocker):
+    return mocker.patch("pytest_hoverfly_wrapper.plugin.manage_executables", autospec=True)
+
+
+def test_plugin_import_is_light():
+    heavy = ("requests", "requests_cache", "polling", "dateutil")
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, pytest_hoverfly_wrapper.plugin; print(' '.join(sys.modules))"],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.split()
+    assert [module for module in heavy if module in output] == []
+
+
+def test_executables_not_checked_without_hoverfly_tests(testdir, mock_manage_executables):
+    testdir.makepyfile("""
+        def test_plain():
+            pass
+        """)
+    testdir.runpytest(*PLUGIN).assert_outcomes(passed=1)
+    mock_manage_executables.assert_not_called()
+
+
+def test_executables_not_checked_for_deselected_tests(testdir, mock_manage_executables):
+    testdir.makepyfile("""
+        def test_plain():
+            pass
+
+        def test_hoverfly(setup_hoverfly):
+            pass
+        """)
+    testdir.runpytest(*PLUGIN, "-k", "plain").assert_outcomes(passed=1)
+    mock_manage_executables.assert_not_called()
+
+
+def test_executables_checked_once_for_simulated_tests(testdir, mock_manage_executables):
+    testdir.makepyfile("""
+        import pytest
+        from pytest_hoverfly_wrapper import StaticSimulation
+
+        @pytest.mark.simulated(StaticSimulation(files=[]))
+        def test_one():
+            pass
+
+        @pytest.mark.simulated(StaticSimulation(files=[]))
+        def test_two():
+            pass
+        """)
+    testdir.runpytest(*PLUGIN).assert_outcomes(passed=2)
+    mock_manage_executables.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "args, error",
+    [
+        (["-o", "hoverfly_ports=random"], "hoverfly_ports must be one of"),
+        (["-o", "hoverfly_journal_page_size=0"], "hoverfly_journal_page_size must be at least 1"),
+        (["-o", "hoverfly_journal_page_size=lots"], "hoverfly_journal_page_size must be a whole number"),
+        (["-o", "hoverfly_validation_ttl=1h"], "hoverfly_validation_ttl must be a whole number"),
+        (["-o", "hoverfly_simulation_format=xml"], "Unknown simulation format"),
+        (["-o", "hoverfly_blob_threshold=1KB"], "hoverfly_blob_threshold must be a whole number"),
+        (["-o", "hoverfly_dedupe=sometimes"], "Unknown dedupe mode"),
+        (["-o", "hoverfly_engine=rust"], "hoverfly_engine must be one of"),
+        (["-o", "hoverfly_log_max_files=all"], "hoverfly_log_max_files must be a whole number"),
+        (["-o", "hoverfly_log_max_bytes=10MB"], "hoverfly_log_max_bytes must be a whole number"),
+        (["--hoverfly-journal=everything"], "hoverfly_journal must be one of"),
+        (["-o", "hoverfly_journal_size=-1"], "hoverfly_journal_size must be a whole number"),
+        (["-o", "hoverfly_max_rss=1GB"], "hoverfly_max_rss must be a whole number"),
+    ],
+)
+def test_bad_options_rejected_at_startup(testdir, mock_manage_executables, args, error):
+    testdir.makepyfile("""
+        def test_plain():
+            pass
+        """)
+    result = testdir.runpytest(*PLUGIN, *args)
+    assert result.ret == 4
+    result.stderr.fnmatch_lines([f"*{error}*"])
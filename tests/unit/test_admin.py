@@ -0,0 +1,35 @@
+import pytest
+import requests
+
+from pytest_hoverfly_wrapper.admin import HOVERFLY_API_MODE, HoverflyAdminClient
+
+
+def test_session_shared_per_port():
+    assert HoverflyAdminClient(8888).session is HoverflyAdminClient(8888).session
+    assert HoverflyAdminClient(8888).session is not HoverflyAdminClient(8889).session
+    HoverflyAdminClient.close_all()
+
+
+def test_set_mode(mocker):
+    mock_request = mocker.patch("requests.Session.request", autospec=True)
+    client = HoverflyAdminClient(8888)
+    client.set_mode("capture", {"headersWhitelist": ["Cookie"]})
+    mock_request.assert_called_once_with(
+        client.session,
+        "PUT",
+        HOVERFLY_API_MODE.format(8888),
+        json={"mode": "capture", "arguments": {"headersWhitelist": ["Cookie"]}},
+        timeout=5,
+    )
+
+
+def test_disabled_journal(mocker):
+    response = requests.Response()
+    response.status_code = 500
+    response._content = b'{"error": "Journal disabled"}'  # pylint: disable=W0212
+    mocker.patch("requests.Session.request", autospec=True, return_value=response)
+    client = HoverflyAdminClient(8888)
+    with pytest.raises(requests.HTTPError):
+        client.get_journal(0, 100)
+    with pytest.raises(requests.HTTPError):
+        client.search_journal({})
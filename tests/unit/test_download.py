@@ -1,13 +1,22 @@
+import functools
+import hashlib
+import os
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from subprocess import CalledProcessError
 
 import pytest
 
-from pytest_hoverfly_wrapper.download import binaries_valid
+from pytest_hoverfly_wrapper import download
+from pytest_hoverfly_wrapper.download import bundle_location, installed_version, manage_executables
 
 
 @pytest.fixture
 def mock_run(mocker):
-    return mocker.patch("pytest_hoverfly_wrapper.download.run", autospec=True)
+    mock_obj = mocker.patch("pytest_hoverfly_wrapper.download.run", autospec=True)
+    mock_obj.return_value.stdout = b"v1.5.0\n"
+    return mock_obj
 
 
 @pytest.fixture
@@ -17,31 +26,146 @@ def mock_get_latest_version(mocker):
     return mock_obj
 
 
-@pytest.mark.parametrize("exception", [FileNotFoundError, PermissionError, CalledProcessError(1, "python")])
-def test_binaries_valid_fail(mock_run, exception):
-    def raise_exc(exc):
-        raise exc
+@pytest.fixture
+def cache_dir(tmpdir):
+    return tmpdir.join("cache").strpath
 
-    mock_run.side_effect = lambda _, **kw: raise_exc(exception)
-    assert not binaries_valid()
 
+@pytest.fixture
+def mirror(tmpdir):
+    """A directory laid out like GitHub's release downloads, with a v1.5.0 bundle."""
+    path = bundle_location("v1.5.0", tmpdir.join("mirror").strpath)
+    os.makedirs(os.path.dirname(path))
+    with zipfile.ZipFile(path, "w") as bundle:
+        bundle.writestr(f"bundle/{download.HOVERFLY}", "hoverfly binary")
+        bundle.writestr(f"bundle/{download.HOVERCTL}", "hoverctl binary")
+        bundle.writestr("LICENSE", "licence")
+    return tmpdir.join("mirror").strpath
 
-def test_binaries_valid_general_exception(mock_run):
-    def raise_exc():
-        raise Exception
 
-    mock_run.side_effect = lambda _, **kw: raise_exc()
-    with pytest.raises(Exception):
-        binaries_valid()
+def sha256(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
 
 
-def test_binaries_valid_wrong_ver(mock_run, mock_get_latest_version):
-    mock_run.return_value.stdout = b"v1.0.0\n"
-    mock_run.return_value.returncode = 0
-    assert not binaries_valid()
+@pytest.mark.parametrize("exception", [FileNotFoundError, PermissionError, CalledProcessError(1, "python")])
+def test_installed_version_fail(mock_run, exception):
+    mock_run.side_effect = exception
+    assert installed_version("somewhere") is None
+
 
+def test_installed_version_general_exception(mock_run):
+    mock_run.side_effect = Exception
+    with pytest.raises(Exception):
+        installed_version("somewhere")
+
+
+def test_install_from_mirror(mirror, cache_dir, mock_run, mock_get_latest_version):
+    installation = manage_executables(cache_dir=cache_dir, mirror=mirror)
+    assert installation.version == "v1.5.0"
+    assert installation.hoverfly == os.path.join(cache_dir, "v1.5.0", download.HOVERFLY)
+    # Only the executables are extracted, and nothing is left behind
+    assert sorted(os.listdir(installation.directory)) == sorted(
+        [download.HOVERFLY, download.HOVERCTL, download.MANIFEST]
+    )
+    assert sorted(os.listdir(cache_dir)) == ["latest.json", "v1.5.0"]
+    with open(installation.hoverctl) as file:
+        assert file.read() == "hoverctl binary"
+    assert os.access(installation.hoverfly, os.X_OK)
+
+
+def test_installation_reused(mirror, cache_dir, mock_run, mock_get_latest_version):
+    manage_executables(cache_dir=cache_dir, mirror=mirror)
+    assert mock_run.call_count == 2
+    # Later sessions, in any checkout, trust the manifest without running or checking anything
+    manage_executables(cache_dir=cache_dir, mirror=mirror)
+    manage_executables(cache_dir=cache_dir, mirror=mirror, offline=True)
+    assert mock_run.call_count == 2
+    assert mock_get_latest_version.call_count == 1
+
+
+def test_changed_executable_reinstalled(mirror, cache_dir, mock_run, mock_get_latest_version):
+    installation = manage_executables(cache_dir=cache_dir, mirror=mirror)
+    with open(installation.hoverfly, "w") as file:
+        file.write("changed binary")
+    manage_executables(cache_dir=cache_dir, mirror=mirror)
+    assert mock_run.call_count == 4
+    with open(installation.hoverfly) as file:
+        assert file.read() == "hoverfly binary"
+
+
+def test_checksum_verified(mirror, cache_dir, mock_run):
+    bundle = bundle_location("v1.5.0", mirror)
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        manage_executables(version="v1.5.0", cache_dir=cache_dir, mirror=mirror, sha256="0" * 64)
+    # A failed installation leaves nothing behind
+    assert os.listdir(cache_dir) == []
+    installation = manage_executables(version="v1.5.0", cache_dir=cache_dir, mirror=mirror, sha256=sha256(bundle))
+    assert installation.version == "v1.5.0"
+
+
+def test_version_mismatch(mirror, cache_dir, mock_run):
+    mock_run.return_value.stdout = b"v1.4.0\n"
+    with pytest.raises(RuntimeError, match="not v1.5.0"):
+        manage_executables(version="v1.5.0", cache_dir=cache_dir, mirror=mirror)
+
+
+def test_install_from_bundle_zip(mirror, cache_dir, mock_run, mock_get_latest_version):
+    bundle = bundle_location("v1.5.0", mirror)
+    installation = manage_executables(cache_dir=cache_dir, mirror=bundle, offline=True)
+    assert installation.version == "v1.5.0"
+    # The installation is found again by the bundle's checksum
+    assert manage_executables(cache_dir=cache_dir, mirror=bundle, offline=True) == installation
+    assert mock_run.call_count == 2
+    mock_get_latest_version.assert_not_called()
+
+
+def test_offline_without_installation(cache_dir, mock_run, mock_get_latest_version):
+    with pytest.raises(RuntimeError):
+        manage_executables(offline=True, cache_dir=cache_dir)
+    with pytest.raises(RuntimeError):
+        manage_executables(version="v1.5.0", offline=True, cache_dir=cache_dir)
+    mock_get_latest_version.assert_not_called()
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
 
-def test_binaries_valid_pass(mock_run, mock_get_latest_version):
-    mock_run.return_value.stdout = b"v1.5.0\n"
-    mock_run.return_value.returncode = 0
-    assert binaries_valid()
+
+@pytest.fixture
+def mirror_url(mirror):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=mirror))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_from_mirror_url(mirror_url, cache_dir, mock_run):
+    installation = manage_executables(version="v1.5.0", cache_dir=cache_dir, mirror=mirror_url)
+    with open(installation.hoverfly) as file:
+        assert file.read() == "hoverfly binary"
+    with pytest.raises(RuntimeError, match="offline"):
+        manage_executables(version="v1.6.0", cache_dir=cache_dir, mirror=mirror_url, offline=True)
+
+
+def test_bundle_url_installed_once(mirror, mirror_url, cache_dir, mock_run, mock_get_latest_version):
+    # Installed from the mirror directory first, so the bundle URL's installation of the same version is left alone
+    installation = manage_executables(version="v1.5.0", cache_dir=cache_dir, mirror=mirror)
+    inode = os.stat(installation.hoverfly).st_ino
+    bundle_url = bundle_location("v1.5.0", mirror_url)
+    for _ in range(3):
+        assert manage_executables(cache_dir=cache_dir, mirror=bundle_url) == installation
+    assert os.stat(installation.hoverfly).st_ino == inode
+    # The bundle URL is only downloaded and checked once
+    assert mock_run.call_count == 4
+    mock_get_latest_version.assert_not_called()
+
+
+def test_bundle_url_found_by_checksum(mirror, mirror_url, cache_dir, mock_run):
+    digest = sha256(bundle_location("v1.5.0", mirror))
+    bundle_url = bundle_location("v1.5.0", mirror_url)
+    installation = manage_executables(cache_dir=cache_dir, mirror=bundle_url, sha256=digest)
+    assert manage_executables(cache_dir=cache_dir, mirror=bundle_url, sha256=digest, offline=True) == installation
+    assert mock_run.call_count == 2
@@ -0,0 +1,110 @@
+import json
+import types
+
+import pytest
+import requests
+from helpers import IniConfig
+
+from pytest_hoverfly_wrapper.plugin import fill_gaps, journal_entry_to_pair, plan_hoverfly_mode
+from pytest_hoverfly_wrapper.simulations import GeneratedSimulation, StaticSimulation
+
+
+def test_journal_entry_to_pair():
+    entry = {
+        "request": {
+            "destination": "example.com",
+            "path": "/search",
+            "method": "GET",
+            "scheme": "https",
+            "query": "q=a&q=b&page=",
+            "body": "",
+            "headers": {"Cookie": ["id=1"], "User-Agent": ["python"]},
+        },
+        "response": {"status": 200, "body": "found", "encodedBody": False, "headers": {"Server": ["x"]}},
+        "mode": "spy",
+    }
+    pair = journal_entry_to_pair(entry, ["cookie"])
+    assert pair["request"]["destination"] == [{"matcher": "exact", "value": "example.com"}]
+    assert pair["request"]["query"] == {
+        "q": [{"matcher": "exact", "value": "a;b"}],
+        "page": [{"matcher": "exact", "value": ""}],
+    }
+    assert pair["request"]["headers"] == {"Cookie": [{"matcher": "exact", "value": "id=1"}]}
+    assert pair["response"] == {**entry["response"], "templated": False}
+
+
+def test_fill_gaps(engine, upstream, tmpdir):
+    cached = {
+        "request": {
+            "destination": [{"matcher": "exact", "value": upstream}],
+            "path": [{"matcher": "exact", "value": "/cached"}],
+            "scheme": [{"matcher": "exact", "value": "http"}],
+        },
+        # Hand-edited pairs may not have the header Hoverfly adds to the responses it records
+        "response": {"status": 200, "body": "cached", "headers": {}},
+    }
+    sim_file = tmpdir.join("sim.json")
+    sim_file.write(json.dumps({"data": {"pairs": [cached]}, "meta": {"timeExported": "2020-01-01T00:00:00+00:00"}}))
+    node = types.SimpleNamespace(config=IniConfig(), ignore=(), user_properties=[])
+    saved = []
+
+    engine.admin.set_mode("spy")
+    steps = fill_gaps(
+        sim_file.strpath, node, engine.proxy_port, engine.admin_port, None, on_saved=lambda *args: saved.append(args)
+    )
+    mode, proxy_port, _ = next(steps)
+    assert mode == "fill"
+    proxies = {"http": f"http://localhost:{proxy_port}"}
+    assert requests.get(f"http://{upstream}/cached", proxies=proxies, timeout=5).text == "cached"
+    assert requests.get(f"http://{upstream}/new", proxies=proxies, timeout=5).text == "live"
+    for _ in steps:
+        pass
+
+    sim = json.loads(sim_file.read())
+    assert [pair["request"]["path"][0]["value"] for pair in sim["data"]["pairs"]] == ["/cached", "/new"]
+    assert sim["data"]["pairs"][1]["response"]["headers"]["Hoverfly-Cache-Served"] == ["True"]
+    assert sim["meta"]["timeExported"] > "2020-01-01"
+    assert saved == [(sim["meta"]["timeExported"], 2)]
+
+
+def live_entry(path, body):
+    return {
+        "request": {"destination": "example.com", "path": path, "method": "GET", "scheme": "http", "query": ""},
+        "response": {"status": 200, "body": body, "encodedBody": False, "headers": {}},
+    }
+
+
+def test_fill_gaps_twice_in_sequence_mode(mocker, tmpdir):
+    mocker.patch("pytest_hoverfly_wrapper.plugin.HoverflyAdminClient", autospec=True)
+    journal_api = mocker.patch("pytest_hoverfly_wrapper.plugin.JournalAPI", autospec=True)
+    sim_file = tmpdir.join("sim.json")
+    sim_file.write(json.dumps({"data": {"pairs": []}, "meta": {"timeExported": "2020-01-01T00:00:00+00:00"}}))
+    node = types.SimpleNamespace(config=IniConfig(hoverfly_dedupe="sequence"), ignore=(), user_properties=[])
+
+    for path in ("/first", "/second"):
+        journal_api.return_value.iter_entries.return_value = [live_entry(path, "1"), live_entry(path, "2")]
+        for _ in fill_gaps(sim_file.strpath, node, 8500, 8888, None):
+            pass
+
+    pairs = json.loads(sim_file.read())["data"]["pairs"]
+    assert [(pair["request"]["path"][0]["value"], pair["request"]["requiresState"]) for pair in pairs] == [
+        ("/first", {"sequence:normalised-1": "1"}),
+        ("/first", {"sequence:normalised-1": "2"}),
+        ("/second", {"sequence:normalised-2": "1"}),
+        ("/second", {"sequence:normalised-2": "2"}),
+    ]
+
+
+@pytest.mark.parametrize(
+    "sim_config,mode", [(GeneratedSimulation("sim.json"), "fill"), (StaticSimulation(["sim.json"]), "simulate")]
+)
+def test_only_generated_simulations_filled(mocker, tmpdir, sim_config, mode):
+    mocker.patch("pytest_hoverfly_wrapper.plugin.fill_gaps_enabled", return_value=True)
+    mocker.patch("pytest_hoverfly_wrapper.plugin.journal_size", return_value=1000)
+    mocker.patch("pytest_hoverfly_wrapper.plugin.no_valid_simulation_exists", return_value=False)
+    mocker.patch("pytest_hoverfly_wrapper.plugin.SimulationIndex", autospec=True)
+    request = mocker.Mock()
+    request.node.get_closest_marker.return_value.args = [sim_config]
+    request.config.hoverfly_teardown_pipeline = None
+
+    assert plan_hoverfly_mode(request, tmpdir.strpath, None)[0] == mode
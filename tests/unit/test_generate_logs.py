@@ -1,30 +1,90 @@
 import json
-import os
+import re
 
 import pytest
 import requests
 
-from pytest_hoverfly_wrapper.plugin import generate_logs
+from pytest_hoverfly_wrapper.logs import LogWriter
+from pytest_hoverfly_wrapper.plugin import check_sensitive_hosts, collect_journal, generate_logs
+from pytest_hoverfly_wrapper.timings import PhaseTimer
 
 
 def test_generate_logs(mocker, tmpdir):
     mock_request = mocker.MagicMock()
+    mock_request.node.nodeid = "tests/test_sth.py::test_sth[param]"
     mock_request.node.sensitive = ["sensitive.host"]
     mock_request.node.mode = "simulate"
     mock_journal_api = mocker.MagicMock()
     with open("tests/input.json") as f:
-        mock_journal_api.get.return_value = json.load(f)
-    log_file = os.path.join(tmpdir.strpath, "network.json")
+        journal = json.load(f)["journal"]
+    mock_journal_api.iter_entries.side_effect = lambda: iter(journal)
+    writer = LogWriter(tmpdir.strpath, background=False)
+    log_file = tmpdir.join("tests_test_sth.py_test_sth_param.network.json").strpath
     # golden path
-    generate_logs(request=mock_request, journal_api=mock_journal_api, test_log_directory=tmpdir.strpath)
-    assert os.path.isfile(log_file)
-    # exception raised if sensitive host isn't cached
-    del mock_journal_api.get.return_value["journal"][0]["response"]["headers"]["Hoverfly-Cache-Served"]
+    generate_logs(request=mock_request, journal_api=mock_journal_api, writer=writer)
+    with open(log_file) as f:
+        assert json.load(f) == {"journal": journal, "total": len(journal)}
+    # exception raised if sensitive host isn't cached, but the log is still written
+    del journal[0]["response"]["headers"]["Hoverfly-Cache-Served"]
     with pytest.raises(AssertionError):
-        generate_logs(request=mock_request, journal_api=mock_journal_api, test_log_directory=tmpdir.strpath)
+        generate_logs(request=mock_request, journal_api=mock_journal_api, writer=writer)
+    with open(log_file) as f:
+        assert json.load(f)["journal"] == journal
 
     # useful message dumped if hoverfly crashes during log retrieval
-    mock_journal_api.get.side_effect = requests.exceptions.ConnectionError
-    generate_logs(request=mock_request, journal_api=mock_journal_api, test_log_directory=tmpdir.strpath)
+    mock_journal_api.iter_entries.side_effect = requests.exceptions.ConnectionError
+    generate_logs(request=mock_request, journal_api=mock_journal_api, writer=writer)
     with open(log_file) as f:
         assert json.load(f) == {"msg": "Hoverfly crashed while retrieving logs"}
+
+
+def test_check_sensitive_hosts(mocker):
+    mock_request = mocker.MagicMock()
+    mock_request.node.sensitive = ["sensitive.host"]
+    mock_request.node.mode = "simulate"
+    mock_journal_api = mocker.MagicMock()
+    with open("tests/input.json") as f:
+        journal = json.load(f)["journal"]
+    mock_journal_api.search.return_value = journal
+    check_sensitive_hosts(mock_request, mock_journal_api)
+    (matcher,) = mock_journal_api.search.call_args[0][0]["destination"]
+    assert matcher["matcher"] == "regex"
+    assert re.match(matcher["value"], "api.sensitive.host:443")
+
+    del journal[0]["response"]["headers"]["Hoverfly-Cache-Served"]
+    with pytest.raises(AssertionError):
+        check_sensitive_hosts(mock_request, mock_journal_api)
+
+    # Nothing to check when recording, or without sensitive hosts
+    mock_journal_api.search.reset_mock()
+    mock_request.node.mode = "record"
+    check_sensitive_hosts(mock_request, mock_journal_api)
+    mock_request.node.mode = "simulate"
+    mock_request.node.sensitive = []
+    check_sensitive_hosts(mock_request, mock_journal_api)
+    mock_journal_api.search.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "level, failed, fetched, size",
+    [
+        ("full", False, "full", "2000"),
+        ("on-failure", False, None, "2000"),
+        ("on-failure", True, "full", "2000"),
+        ("sensitive-only", True, "sensitive", "2000"),
+        ("none", True, None, "2000"),
+        # The journal is disabled
+        ("full", True, None, "0"),
+    ],
+)
+def test_journal_levels(mocker, level, failed, fetched, size):
+    mock_request = mocker.MagicMock()
+    mock_request.config.getoption.return_value = level
+    mock_request.config.getini.return_value = size
+    if not failed:
+        del mock_request.node.dont_save_sim
+    generate_logs_ = mocker.patch("pytest_hoverfly_wrapper.plugin.generate_logs")
+    check_sensitive_hosts_ = mocker.patch("pytest_hoverfly_wrapper.plugin.check_sensitive_hosts")
+    collect_journal(mock_request, mocker.MagicMock(), mocker.MagicMock(), PhaseTimer())
+    assert generate_logs_.called == (fetched == "full")
+    assert check_sensitive_hosts_.called == (fetched == "sensitive")
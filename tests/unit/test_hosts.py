@@ -0,0 +1,80 @@
+import re
+
+import pytest
+
+from pytest_hoverfly_wrapper.hosts import SENSITIVE, HostPolicy, glob_to_regex, host_of
+
+
+@pytest.mark.parametrize(
+    "destination,host",
+    [
+        ("example.com", "example.com"),
+        ("Example.com:8080", "example.com"),
+        ("https://api.example.com/path?q=1", "api.example.com"),
+        ("localhost:8500", "localhost"),
+    ],
+)
+def test_host_of(destination, host):
+    assert host_of(destination) == host
+
+
+@pytest.mark.parametrize(
+    "glob,matches,non_matches",
+    [
+        ("*.example.com", ["a.example.com", "a.b.example.com"], ["example.com", "a.example.co"]),
+        ("ads?.net", ["ads1.net"], ["ads.net", "ads12.net"]),
+        ("cdn[0-9].net", ["cdn1.net"], ["cdnx.net"]),
+        ("cdn[!0-9].net", ["cdnx.net"], ["cdn1.net"]),
+    ],
+)
+def test_glob_to_regex(glob, matches, non_matches):
+    pattern = re.compile(f"^(?:{glob_to_regex(glob)})$")
+    assert all(pattern.match(host) for host in matches)
+    assert not any(pattern.match(host) for host in non_matches)
+
+
+def test_host_policy():
+    policy = HostPolicy(ignore="localhost", sensitive=["bank.com", "*.secret.*"], block=["ads.net", "bank.com"])
+    assert policy.ignored("localhost:8500")
+    assert not policy.ignored("notlocalhost:8500")
+    assert policy.sensitive("https://www.bank.com/login")
+    assert policy.sensitive("api.secret.io")
+    assert not policy.sensitive("secret.io")
+    assert not policy.sensitive("bank.com.evil.org")
+    assert policy.blocked("tracker.ads.net") and policy.blocked("bank.com")
+    assert not policy.blocked("api.secret.io")
+
+
+def test_host_policy_caches_hosts():
+    policy = HostPolicy(sensitive=["*.bank.com"])
+    for _ in range(100):
+        assert policy.sensitive("https://www.bank.com/login")
+    assert policy.host_flags.cache_info().misses == 1
+
+
+@pytest.mark.parametrize(
+    "entry,matches,non_matches",
+    [
+        ("localhost:8080", ["localhost:8500", "http://localhost/"], ["notlocalhost"]),
+        ("https://bank.com", ["https://www.bank.com/login", "bank.com:443"], ["bank.co"]),
+        ("https://BANK.com/login", ["bank.com"], ["login"]),
+        ("https://*.bank.com:443/login", ["www.bank.com:8443"], ["bank.com"]),
+    ],
+)
+def test_host_policy_entries_normalised(entry, matches, non_matches):
+    policy = HostPolicy(sensitive=[entry])
+    assert all(policy.sensitive(destination) for destination in matches)
+    assert not any(policy.sensitive(destination) for destination in non_matches)
+    regex = re.compile(policy.destination_regex(SENSITIVE))
+    assert all(regex.match(host_of(destination)) for destination in matches)
+
+
+def test_single_label_entry_matches_substring():
+    policy = HostPolicy(sensitive=["google", "localhost", "bank.com"])
+    assert policy.sensitive("www.google.com")
+    assert policy.sensitive("googleapis.com:443")
+    assert not policy.sensitive("localhost.example.com")
+    assert not policy.sensitive("mybank.com")
+    regex = re.compile(policy.destination_regex(SENSITIVE))
+    assert regex.match("www.google.com:443")
+    assert not regex.match("mybank.com")
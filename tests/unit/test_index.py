@@ -0,0 +1,49 @@
+import json
+
+from pytest_hoverfly_wrapper.index import INDEX_FILE, SimulationIndex
+
+
+def write_sim(path, time_exported, pairs=1):
+    path.write(json.dumps({"data": {"pairs": [{}] * pairs}, "meta": {"timeExported": time_exported}}), ensure=True)
+
+
+def test_index_update_and_lookup(tmpdir):
+    sim = tmpdir.join("generated", "sim.json")
+    write_sim(sim, "2021-01-01T00:00:00Z", pairs=3)
+    index = SimulationIndex(tmpdir.strpath)
+
+    assert index.lookup(sim.strpath) is None
+    index.update(sim.strpath, "2021-01-01T00:00:00Z", 3)
+    entry = SimulationIndex(tmpdir.strpath).lookup(sim.strpath)
+    assert entry["timeExported"] == "2021-01-01T00:00:00Z"
+    assert entry["pairs"] == 3
+    assert "generated/sim.json" in json.loads(tmpdir.join(INDEX_FILE).read())
+
+    # a simulation changed outside the plugin invalidates its entry
+    write_sim(sim, "2022-01-01T00:00:00Z", pairs=30)
+    assert index.lookup(sim.strpath) is None
+
+
+def test_index_time_exported_falls_back_to_file(tmpdir, mocker):
+    sim = tmpdir.join("sim.json")
+    write_sim(sim, "2021-01-01T00:00:00Z")
+    index = SimulationIndex(tmpdir.strpath)
+
+    assert index.time_exported(sim.strpath) == "2021-01-01T00:00:00Z"
+    # the file was parsed once and indexed, so isn't parsed again
+    spy = mocker.spy(json, "load")
+    assert SimulationIndex(tmpdir.strpath).time_exported(sim.strpath) == "2021-01-01T00:00:00Z"
+    assert all(call.args[0].name.endswith(INDEX_FILE) for call in spy.call_args_list)
+
+
+def test_index_ignores_simulations_outside_data_dir(tmpdir):
+    sim = tmpdir.join("sim.json")
+    write_sim(sim, "2021-01-01T00:00:00Z")
+    index = SimulationIndex(tmpdir.join("test_data").strpath)
+    assert index.time_exported(sim.strpath) == "2021-01-01T00:00:00Z"
+    assert not tmpdir.join("test_data", INDEX_FILE).exists()
+
+
+def test_index_corrupt(tmpdir):
+    tmpdir.join(INDEX_FILE).write("{")
+    assert SimulationIndex(tmpdir.strpath).entries() == {}
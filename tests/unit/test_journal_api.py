@@ -0,0 +1,29 @@
+import pytest
+
+from pytest_hoverfly_wrapper.admin import JournalAPI
+
+
+@pytest.fixture
+def mock_get(mocker):
+    entries = [{"id": i} for i in range(23)]
+
+    def get_journal(_, offset, limit):
+        return {"journal": entries[offset : offset + limit], "offset": offset, "total": len(entries)}
+
+    return mocker.patch(
+        "pytest_hoverfly_wrapper.admin.HoverflyAdminClient.get_journal", autospec=True, side_effect=get_journal
+    )
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 10, 23, 100])
+def test_iter_entries(mock_get, page_size):
+    entries = list(JournalAPI(admin_port=8888, page_size=page_size).iter_entries())
+    assert entries == [{"id": i} for i in range(23)]
+    # every page is requested exactly once
+    assert mock_get.call_count == -(-23 // page_size)
+
+
+def test_get(mock_get):
+    journal = JournalAPI(admin_port=8888, page_size=10).get()
+    assert journal["total"] == 23
+    assert journal["journal"] == [{"id": i} for i in range(23)]
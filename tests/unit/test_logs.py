@@ -0,0 +1,92 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import types
+
+from pytest_hoverfly_wrapper.logs import MAX_NAME_LENGTH, LogWriter, log_name
+from pytest_hoverfly_wrapper.plugin import pytest_unconfigure
+from pytest_hoverfly_wrapper.process import HoverflyProcess
+
+
+def test_log_name():
+    assert log_name("tests/test_a.py::TestA::test_b[param-1]") == "tests_test_a.py_TestA_test_b_param-1"
+    long_names = [log_name(f"tests/test_a.py::test_b[{'x' * 200}{i}]") for i in range(2)]
+    assert all(len(name) == MAX_NAME_LENGTH for name in long_names)
+    assert long_names[0] != long_names[1]
+
+
+def test_writes_in_background(tmpdir):
+    writer = LogWriter(tmpdir.strpath)
+    release = threading.Event()
+    path = writer.submit("slow.log", lambda file: release.wait() and file.write("done"))
+    assert not os.path.exists(path)
+    release.set()
+    writer.flush()
+    with open(path) as file:
+        assert file.read() == "done"
+    writer.close()
+
+
+def test_compression(tmpdir):
+    writer = LogWriter(tmpdir.strpath, compress=True, background=False)
+    path = writer.write_json("test.network.json", {"journal": [], "total": 0})
+    assert path.endswith(".network.json.gz")
+    with gzip.open(path, "rt") as file:
+        assert json.load(file) == {"journal": [], "total": 0}
+
+
+def test_spooled_log(tmpdir):
+    writer = LogWriter(tmpdir.strpath, compress=True)
+    spool = tempfile.TemporaryFile("w+", encoding="utf-8")  # pylint: disable=R1732
+    spool.write('{"journal": [], "total": 0}')
+    path = writer.write_spooled("test.network.json", spool)
+    writer.flush()
+    assert spool.closed
+    with gzip.open(path, "rt") as file:
+        assert json.load(file) == {"journal": [], "total": 0}
+    writer.close()
+
+
+def test_oldest_logs_removed(tmpdir):
+    writer = LogWriter(tmpdir.strpath, max_files=3, background=False)
+    for i in range(5):
+        writer.write_text(f"{i}.log", "x" * 10)
+        os.utime(writer.path(f"{i}.log"), (i, i))
+    assert sorted(os.listdir(tmpdir.strpath)) == ["2.log", "3.log", "4.log"]
+
+    writer.max_files, writer.max_bytes = 0, 25
+    writer.write_text("5.log", "x" * 100)
+    # The newest log is kept, even if it's over the limit by itself
+    assert os.listdir(tmpdir.strpath) == ["5.log"]
+
+
+def test_failed_write_leaves_nothing_behind(tmpdir):
+    def write(file):
+        file.write("partial")
+        raise ValueError
+
+    writer = LogWriter(tmpdir.strpath, background=False)
+    writer.submit("broken.log", write)
+    assert not tmpdir.listdir()
+
+
+def test_process_log_split_between_tests(tmpdir):
+    log_file = tmpdir.join("hoverfly.log")
+    hf_proc = HoverflyProcess(8500, 8888, log_file.strpath)
+    assert hf_proc.read_new_log() == ""
+    log_file.write("first test\n")
+    assert hf_proc.read_new_log() == "first test\n"
+    log_file.write("second test\n", mode="a")
+    assert hf_proc.read_new_log() == "second test\n"
+
+
+def test_hoverfly_logs_removed_at_exit(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    log_directory = tmpdir.mkdir("hoverfly_logs")
+    for admin_port in (8888, 9999):
+        log_directory.join(f"hoverfly_{admin_port}.log").write("log")
+    pytest_unconfigure(types.SimpleNamespace(hoverfly_ports=(8500, 8888), hoverfly_log_directory=log_directory.strpath))
+    # Another session's log stays
+    assert log_directory.listdir() == [log_directory.join("hoverfly_9999.log")]
@@ -0,0 +1,60 @@
+import pytest
+
+from pytest_hoverfly_wrapper.normalisation import PairNormaliser
+
+
+def pair(path, body, date="Mon, 01 Jan 2024 00:00:00 GMT"):
+    return {
+        "request": {"path": [{"matcher": "exact", "value": path}]},
+        "response": {"status": 200, "body": body, "headers": {"Date": [date]}},
+    }
+
+
+def test_off():
+    pairs = [pair("/a", "x"), pair("/a", "x")]
+    normaliser = PairNormaliser()
+    assert list(normaliser.normalise(pairs)) == pairs
+    assert not normaliser.enabled
+
+
+def test_volatile_headers():
+    normaliser = PairNormaliser(volatile_headers=["date"])
+    (normalised,) = normaliser.normalise([pair("/a", "x")])
+    assert normalised["response"]["headers"] == {}
+    assert normaliser.removed_pairs == 0
+    assert normaliser.removed_bytes > 0
+
+
+def test_collapse():
+    normaliser = PairNormaliser("collapse", volatile_headers=["Date"])
+    pairs = [pair("/a", "x"), pair("/b", "y"), pair("/a", "x", date="later"), pair("/a", "z")]
+    normalised = list(normaliser.normalise(pairs))
+    assert [p["response"]["body"] for p in normalised] == ["x", "y", "z"]
+    assert normaliser.removed_pairs == 1
+
+
+def test_sequence():
+    normaliser = PairNormaliser("sequence")
+    pairs = [pair("/a", "1"), pair("/b", "y"), pair("/a", "2"), pair("/b", "y"), pair("/a", "3"), pair("/a", "3")]
+    normalised = list(normaliser.normalise(pairs))
+
+    assert [p["response"]["body"] for p in normalised] == ["1", "2", "3", "y"]
+    assert [p["request"].get("requiresState") for p in normalised] == [
+        {"sequence:normalised-1": "1"},
+        {"sequence:normalised-1": "2"},
+        {"sequence:normalised-1": "3"},
+        None,
+    ]
+    assert [p["response"].get("transitionsState") for p in normalised] == [
+        {"sequence:normalised-1": "2"},
+        {"sequence:normalised-1": "3"},
+        None,
+        None,
+    ]
+    # the repeated last response and the repeated /b pair
+    assert normaliser.removed_pairs == 2
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        PairNormaliser("sometimes")
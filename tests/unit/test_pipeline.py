@@ -0,0 +1,56 @@
+import threading
+
+from pytest_hoverfly_wrapper.pipeline import TeardownPipeline
+from pytest_hoverfly_wrapper.simulations import GeneratedSimulation, StaticSimulation
+
+
+def test_work_done_in_order():
+    pipeline = TeardownPipeline()
+    done = []
+    for i in range(5):
+        pipeline.submit(f"test_{i}", done.append, i)
+    assert pipeline.drain() == []
+    assert done == list(range(5))
+    pipeline.close()
+
+
+def test_wait_for_pending_write(tmpdir):
+    pipeline = TeardownPipeline()
+    release = threading.Event()
+    sim = tmpdir.join("generated", "sim.json")
+
+    def save():
+        release.wait()
+        sim.write("{}", ensure=True)
+
+    pipeline.submit("test_record", save, path=sim.strpath)
+    # Waiting for other files doesn't wait for the save
+    pipeline.wait_for([tmpdir.join("static", "other.json").strpath])
+    assert not sim.exists()
+    release.set()
+    pipeline.wait_for([sim.strpath])
+    assert sim.exists()
+    pipeline.close()
+
+
+def test_failures_kept_against_their_test():
+    def fail():
+        raise OSError("disk full")
+
+    pipeline = TeardownPipeline()
+    pipeline.submit("test_a", fail)
+    pipeline.submit("test_b", lambda: None)
+    assert pipeline.drain() == [("test_a", "OSError: disk full")]
+    pipeline.close()
+
+
+def test_source_files(tmpdir):
+    data_dir = tmpdir.strpath
+    assert StaticSimulation(files=["a.json", "b.json"]).source_files(data_dir) == [
+        tmpdir.join("static", "a.json").strpath,
+        tmpdir.join("static", "b.json").strpath,
+    ]
+    assert GeneratedSimulation(file="c.json", static_files=["a.json"]).source_files(data_dir) == [
+        tmpdir.join("static", "a.json").strpath,
+        tmpdir.join("generated", "c.json").strpath,
+    ]
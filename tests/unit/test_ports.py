@@ -0,0 +1,40 @@
+import os
+import types
+
+from pytest_hoverfly_wrapper.ports import STANDBY_PORT_OFFSET, PortAllocator, fixed_ports, worker_id
+
+
+def test_allocators_never_share_ports(tmpdir):
+    allocators = [PortAllocator(tmpdir.strpath) for _ in range(3)]
+    ports = [port for allocator in allocators for _ in range(4) for port in allocator.reserve_pair()]
+    assert len(set(ports)) == len(ports)
+    assert len(tmpdir.listdir()) == len(ports)
+
+    for allocator in allocators:
+        allocator.release_all()
+    assert not tmpdir.listdir()
+
+
+def test_allocator_skips_reserved_ports(tmpdir, mocker):
+    tmpdir.join("9000.lock").write(str(os.getpid()))
+    sockets = mocker.patch("socket.socket").return_value.__enter__.return_value
+    sockets.getsockname.side_effect = [("127.0.0.1", 9000), ("127.0.0.1", 9001)]
+    assert PortAllocator(tmpdir.strpath).reserve_port() == 9001
+
+
+def test_allocator_reclaims_ports_of_dead_processes(tmpdir, mocker):
+    tmpdir.join("9000.lock").write("12345")
+    mocker.patch("pytest_hoverfly_wrapper.ports._pid_alive", return_value=False)
+    sockets = mocker.patch("socket.socket").return_value.__enter__.return_value
+    sockets.getsockname.side_effect = [("127.0.0.1", 9000), ("127.0.0.1", 9000)]
+    assert PortAllocator(tmpdir.strpath).reserve_port() == 9000
+    assert tmpdir.join("9000.lock").read() == str(os.getpid())
+
+
+def test_fixed_ports():
+    assert fixed_ports(types.SimpleNamespace()) == (8500, 8888)
+    config = types.SimpleNamespace(workerinput={"workerid": "gw11"})
+    assert worker_id(config) == "gw11"
+    assert fixed_ports(config) == (8511, 8899)
+    assert fixed_ports(config, STANDBY_PORT_OFFSET) == (8611, 8999)
+    assert fixed_ports(types.SimpleNamespace(slaveinput={"slaveid": "gw1"})) == (8501, 8889)
@@ -0,0 +1,107 @@
+import signal
+import time
+
+import pytest
+
+from pytest_hoverfly_wrapper.process import HoverflyCrashedException, HoverflyLauncher, HoverflyWatchdog
+
+
+@pytest.fixture
+def mock_process(mocker):
+    def make_process(proxy_port, admin_port, *_, **__):
+        hf_proc = mocker.MagicMock(proxy_port=proxy_port, admin_port=admin_port)
+        hf_proc.start.return_value = hf_proc
+        return hf_proc
+
+    return mocker.patch("pytest_hoverfly_wrapper.process.HoverflyProcess", autospec=True, side_effect=make_process)
+
+
+def test_launcher_alternates_ports(mock_process, tmpdir):
+    launcher = HoverflyLauncher([(8500, 8888), (8600, 8988)], tmpdir.strpath)
+    try:
+        assert launcher.acquire().admin_port == 8888
+        assert launcher.acquire().admin_port == 8988
+        assert launcher.acquire().admin_port == 8888
+    finally:
+        launcher.close()
+    # One instance per test, plus the standby for the next one
+    assert mock_process.call_count == 4
+    assert launcher.standby is None
+
+
+def test_launcher_discard_standby(mock_process, tmpdir):
+    launcher = HoverflyLauncher([(8500, 8888), (8600, 8988)], tmpdir.strpath)
+    try:
+        launcher.acquire()
+        standby = launcher.standby.result()
+        launcher.discard_standby()
+        standby.kill.assert_called_once()
+        # With no standby, the next instance gets started on demand
+        assert launcher.acquire().admin_port == 8988
+    finally:
+        launcher.close()
+
+
+def test_watchdog_interrupts_test(mocker):
+    hf_proc = mocker.MagicMock()
+    hf_proc.alive.side_effect = [True, True, False]
+    hf_proc.crashed_exception.return_value = HoverflyCrashedException("Hoverfly crashed")
+    watchdog = HoverflyWatchdog(hf_proc).start()
+    try:
+        with pytest.raises(HoverflyCrashedException):
+            time.sleep(30)
+    finally:
+        watchdog.stop()
+
+
+def test_watchdog_stopped(mocker):
+    hf_proc = mocker.MagicMock()
+    hf_proc.alive.return_value = True
+    watchdog = HoverflyWatchdog(hf_proc).start()
+    watchdog.stop()
+    assert not watchdog.thread.is_alive()
+
+
+@pytest.fixture
+def sigusr1_handler():
+    """A handler of the watchdog's signal, installed as a test suite might have, which records what it's sent."""
+    received = []
+    previous = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+    yield received
+    signal.signal(signal.SIGUSR1, previous)
+
+
+posix_only = pytest.mark.skipif(not hasattr(signal, "pthread_sigmask"), reason="The watchdog uses signals on POSIX")
+
+
+@posix_only
+def test_watchdog_keeps_existing_handler(mocker, sigusr1_handler):
+    hf_proc = mocker.MagicMock()
+    hf_proc.alive.return_value = True
+    handler = signal.getsignal(signal.SIGUSR1)
+    watchdog = HoverflyWatchdog(hf_proc).start()
+    try:
+        signal.pthread_kill(watchdog.thread_id, signal.SIGUSR1)
+        time.sleep(0.1)
+    finally:
+        watchdog.stop()
+    # Signals the watchdog didn't send are passed on
+    assert sigusr1_handler == [signal.SIGUSR1]
+    assert signal.getsignal(signal.SIGUSR1) is handler
+
+
+@posix_only
+def test_watchdog_late_interrupt_discarded(mocker, sigusr1_handler):
+    hf_proc = mocker.MagicMock()
+    hf_proc.alive.return_value = False
+    # Holds the interrupt back, as if the test finished just as Hoverfly died
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGUSR1])
+    try:
+        watchdog = HoverflyWatchdog(hf_proc).start()
+        watchdog.thread.join()
+        assert watchdog.fired
+        watchdog.stop()
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGUSR1])
+    time.sleep(0.1)
+    assert sigusr1_handler == []
@@ -0,0 +1,64 @@
+import json
+import threading
+import time
+import types
+
+from pytest_hoverfly_wrapper.index import SimulationIndex
+from pytest_hoverfly_wrapper.refresh import HostLimiter, RefreshTask, needs_refresh, refresh_all, simulation_hosts
+
+
+def write_simulation(path, time_exported, destinations=()):
+    pairs = [
+        {"request": {"destination": [{"matcher": "exact", "value": value}]}, "response": {"status": 200}}
+        for value in destinations
+    ]
+    path.write(json.dumps({"data": {"pairs": pairs}, "meta": {"timeExported": time_exported}}), ensure=True)
+
+
+def test_needs_refresh(tmpdir):
+    index = SimulationIndex(tmpdir.strpath)
+    write_simulation(tmpdir.join("generated", "old.json"), "2020-01-01T00:00:00Z")
+    assert needs_refresh(index, tmpdir.join("generated", "old.json").strpath, 60)
+    assert not needs_refresh(index, tmpdir.join("generated", "old.json").strpath, 10**10)
+    assert needs_refresh(index, tmpdir.join("generated", "missing.json").strpath, 60)
+
+
+def test_simulation_hosts(tmpdir):
+    sim = tmpdir.join("sim.json")
+    write_simulation(sim, "2020-01-01T00:00:00Z", ["api.example.com:443", "cdn.example.com", "api.example.com"])
+    assert simulation_hosts(sim.strpath) == ("api.example.com", "cdn.example.com")
+    assert simulation_hosts(tmpdir.join("missing.json").strpath) == ()
+
+
+def test_refresh_all_limits_concurrency_per_host(mocker):
+    lock = threading.Lock()
+    running = {}
+    most_running = {}
+
+    def refresh_test(task, pytest_args):  # pylint: disable=W0613
+        with lock:
+            for host in task.hosts:
+                running[host] = running.get(host, 0) + 1
+                most_running[host] = max(most_running.get(host, 0), running[host])
+        time.sleep(0.02)
+        with lock:
+            for host in task.hosts:
+                running[host] -= 1
+        return types.SimpleNamespace(returncode=1 if task.nodeid == "test_3" else 0, stdout="")
+
+    mocker.patch("pytest_hoverfly_wrapper.refresh.refresh_test", side_effect=refresh_test)
+    tasks = [
+        RefreshTask(f"test_{i}", f"sim_{i}.json", ("a.com", f"{i}.com") if i % 2 else ("a.com",)) for i in range(8)
+    ]
+    results = refresh_all(tasks, [], workers=6, host_limiter=HostLimiter(2), report=lambda line: None)
+
+    assert [result.task for result in results] == tasks
+    assert [result.task.nodeid for result in results if result.returncode] == ["test_3"]
+    assert most_running["a.com"] == 2
+    assert all(most_running[f"{i}.com"] == 1 for i in range(1, 8, 2))
+
+
+def test_no_host_limit():
+    limiter = HostLimiter(0)
+    with limiter.hold(["a.com"]), limiter.hold(["a.com"]):
+        assert not limiter.semaphores
@@ -0,0 +1,127 @@
+import json
+
+import requests
+
+from pytest_hoverfly_wrapper.admin import JournalAPI
+from pytest_hoverfly_wrapper.hosts import SENSITIVE, HostPolicy
+from pytest_hoverfly_wrapper.replay import unsupported_reason
+
+
+def pair(path, body, destination="example.com", matcher="exact", **response):
+    return {
+        "request": {
+            "destination": [{"matcher": matcher, "value": destination}],
+            "path": [{"matcher": "exact", "value": path}],
+            "scheme": [{"matcher": "exact", "value": "http"}],
+        },
+        "response": {"status": 200, "body": body, "encodedBody": False, "headers": {}, **response},
+    }
+
+
+def simulation(*pairs):
+    return {"data": {"pairs": list(pairs), "globalActions": {"delays": []}}, "meta": {"schemaVersion": "v5"}}
+
+
+def get(engine, url):
+    proxies = {"http": f"http://localhost:{engine.proxy_port}"}
+    return requests.get(url, proxies=proxies, timeout=5)
+
+
+def test_replay(engine):
+    gzipped = pair("/gzipped", "squashed", headers={"Content-Encoding": ["gzip"]})
+    fallback = pair("*", "fallback", destination="*.com", matcher="glob")
+    fallback["request"]["path"] = []
+    engine.admin.put_simulation(json.dumps(simulation(fallback, pair("/a", "exact"), gzipped)))
+    engine.admin.set_mode("simulate")
+
+    # the strongest match wins, whatever the order of the pairs
+    assert get(engine, "http://example.com/a").text == "exact"
+    assert get(engine, "http://other.com/a").text == "fallback"
+    assert get(engine, "http://example.com/gzipped").text == "squashed"
+    assert get(engine, "http://example.org/a").status_code == 502
+
+    journal = JournalAPI(engine.admin_port, page_size=2).get()
+    assert journal["total"] == 4
+    assert [entry["request"]["destination"] for entry in journal["journal"]] == [
+        "example.com",
+        "other.com",
+        "example.com",
+        "example.org",
+    ]
+    assert journal["journal"][0]["response"]["body"] == "exact"
+
+
+def test_journal_search(engine):
+    engine.admin.put_simulation(json.dumps(simulation(pair("*", "any", destination="*", matcher="glob"))))
+    engine.admin.set_mode("simulate")
+    for host in ("example.com", "api.bank.com", "bank.com.evil.org"):
+        get(engine, f"http://{host}/a")
+
+    regex = HostPolicy(sensitive=["bank.com"]).destination_regex(SENSITIVE)
+    entries = JournalAPI(engine.admin_port).search({"destination": [{"matcher": "regex", "value": regex}]})
+    assert [entry["request"]["destination"] for entry in entries] == ["api.bank.com"]
+
+
+def test_journal_size(engine):
+    engine.journal_size = 2
+    engine.admin.put_simulation(json.dumps(simulation(pair("*", "any", destination="*", matcher="glob"))))
+    engine.admin.set_mode("simulate")
+    for host in ("a.com", "b.com", "c.com"):
+        get(engine, f"http://{host}/a")
+
+    # The oldest entries make way for new ones
+    journal = JournalAPI(engine.admin_port).get()
+    assert [entry["request"]["destination"] for entry in journal["journal"]] == ["b.com", "c.com"]
+
+
+def test_spy_forwards_unmatched_requests(engine, upstream):
+    engine.admin.set_mode("spy")
+    response = get(engine, f"http://{upstream}/live")
+    assert response.text == "live"
+    (entry,) = engine.admin.get_journal(0, 10)["journal"]
+    assert entry["mode"] == "spy"
+    assert not entry["response"]["headers"].get("Hoverfly-Cache-Served")
+
+
+def test_unsupported_simulations(engine):
+    assert unsupported_reason(simulation(pair("/a", "x"))) is None
+    stateful = pair("/a", "x")
+    stateful["request"]["requiresState"] = {"sequence:1": "1"}
+    https = pair("/a", "x")
+    https["request"]["scheme"] = [{"matcher": "glob", "value": "*"}]
+    for unsupported in (
+        stateful,
+        https,
+        pair("/a", "x", templated=True),
+        pair("/a", "x", matcher="jsonpath"),
+    ):
+        assert unsupported_reason(simulation(unsupported))
+        response = engine.admin.put_simulation(json.dumps(simulation(unsupported)))
+        assert response.status_code == 422
+
+
+def test_engine_crash_reported(testdir, mocker):
+    mocker.patch("pytest_hoverfly_wrapper.plugin.manage_executables", autospec=True)
+    testdir.mkdir("test_data").mkdir("static").join("sim.json").write(json.dumps(simulation(pair("/a", "a"))))
+    testdir.makeconftest("""
+        import os
+
+        import pytest
+
+        @pytest.fixture
+        def test_data_dir():
+            return os.path.join(os.getcwd(), "test_data")
+        """)
+    testdir.makepyfile("""
+        import pytest
+        from pytest_hoverfly_wrapper import StaticSimulation
+
+        @pytest.mark.simulated(StaticSimulation(files=["sim.json"]))
+        def test_engine_dies(request, setup_hoverfly):
+            request.config.hoverfly_replay_engine.kill()
+        """)
+    result = testdir.runpytest(
+        "-p", "pytest_hoverfly_wrapper.plugin", "--hoverfly-engine=python", "--hoverfly-ports=dynamic"
+    )
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(["*HoverflyCrashedException: The replay engine stopped*"])
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+from helpers import IniConfig
+
+from pytest_hoverfly_wrapper.plugin import release_hoverfly
+from pytest_hoverfly_wrapper.resources import ResourceUsage, process_usage, usage_report
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Measured through /proc")
+
+
+@linux_only
+def test_process_usage():
+    usage = process_usage(os.getpid())
+    assert usage.rss > 0
+    assert usage.cpu_seconds > 0
+
+
+@linux_only
+def test_process_usage_of_finished_process():
+    with subprocess.Popen([sys.executable, "-c", "pass"]) as proc:
+        proc.wait()
+    assert process_usage(proc.pid) is None
+
+
+def test_usage_report():
+    before = ResourceUsage(100 << 20, 1.5)
+    after = ResourceUsage(300 << 20, 2.0)
+    assert usage_report(before, after) == {"rss_mb": 300.0, "cpu_seconds": 0.5}
+    assert usage_report(None, after) == {"rss_mb": 300.0, "cpu_seconds": 2.0}
+    assert usage_report(before, None) is None
+
+
+@pytest.mark.parametrize(
+    "max_rss, rss_mb, kept",
+    [("1024", 200, True), ("1024", 2000, False), ("0", 2000, True)],
+    ids=["below-limit", "above-limit", "no-limit"],
+)
+def test_release_recycles_oversized_instances(mocker, max_rss, rss_mb, kept):
+    config = IniConfig(hoverfly_max_rss=max_rss)
+    request = types.SimpleNamespace(config=config, node=types.SimpleNamespace())
+    hf_proc = mocker.MagicMock()
+    hf_proc.alive.return_value = True
+    release_hoverfly(request, hf_proc, (8500, 8888), True, ResourceUsage(rss_mb << 20, 1.0))
+    assert (config.hoverfly_processes.get((8500, 8888)) is hf_proc) == kept
+    assert hf_proc.kill.called != kept
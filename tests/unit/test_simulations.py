@@ -1,4 +1,8 @@
-from pytest_hoverfly_wrapper.simulations import GeneratedSimulation, StaticSimulation
+import json
+import re
+
+from pytest_hoverfly_wrapper import simulations
+from pytest_hoverfly_wrapper.simulations import GeneratedSimulation, StaticSimulation, block_domain_pairs
 
 
 def test_generated_simulation():
@@ -7,3 +11,67 @@ def test_generated_simulation():
 
 def test_static_simulation():
     StaticSimulation()
+
+
+def pair(i):
+    return {"request": {"id": i}, "response": {}}
+
+
+def test_combine_simulations_cached(tmpdir, monkeypatch, mocker):
+    combine = simulations._combine_simulations  # pylint: disable=W0212
+    monkeypatch.chdir(tmpdir)
+    sims = []
+    for i in range(2):
+        sim = tmpdir.join(f"sim_{i}.json")
+        sim.write(json.dumps({"data": {"pairs": [pair(i)]}, "meta": {}}))
+        sims.append(sim.strpath)
+    spy = mocker.spy(json, "load")
+
+    combined = combine(sims, (), 8888)
+    assert combine(sims, (), 8888) == combined
+    with open(combined) as file:
+        assert json.loads(file.read())["data"]["pairs"] == [pair(0), pair(1)]
+    # each input is only parsed once
+    assert spy.call_count == 2
+
+    # editing an input invalidates the cached combination
+    with open(sims[1], "w") as file:
+        file.write(json.dumps({"data": {"pairs": [pair(2), pair(3)]}, "meta": {}}))
+    combined = combine(sims, (), 8888)
+    with open(combined) as file:
+        assert json.loads(file.read())["data"]["pairs"] == [pair(0), pair(2), pair(3)]
+
+
+def test_block_domain_pairs():
+    domains = [f"tracker{i}.com" for i in range(200)] + ["*.ads.*"]
+    (pair,) = block_domain_pairs(domains)
+    (matcher,) = pair["request"]["destination"]
+    assert matcher["matcher"] == "regex"
+    pattern = re.compile(matcher["value"])
+    for destination in ("tracker7.com", "www.tracker199.com:443", "eu.ads.example"):
+        assert pattern.match(destination)
+    for destination in ("tracker200.com", "tracker7.com.example.org", "ads.example"):
+        assert not pattern.match(destination)
+    assert pair["response"]["status"] == 404
+    assert block_domain_pairs([]) == []
+
+
+def test_static_simulation_blocks_domains(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    sim = StaticSimulation(block_domains=["tracker.com", "ads.net"])
+    combined = sim.full_file_path(tmpdir.strpath, 8888)
+    assert StaticSimulation(block_domains=["ads.net", "tracker.com"]).full_file_path(tmpdir.strpath, 8888) == combined
+    with open(combined) as file:
+        assert json.load(file)["data"]["pairs"] == block_domain_pairs(["tracker.com", "ads.net"])
+
+
+def test_single_static_simulation_blocks_domains(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    sim = StaticSimulation(files=["sim.json"], block_domains=["ads.net"])
+    path = tmpdir.join("static", "sim.json")
+    # It doesn't exist yet, so it's recorded
+    assert sim.full_file_path(tmpdir.strpath, 8888) == path.strpath
+    path.write(json.dumps({"data": {"pairs": [pair(0)]}, "meta": {}}), ensure=True)
+    assert StaticSimulation(files=["sim.json"]).full_file_path(tmpdir.strpath, 8888) == path.strpath
+    with open(sim.full_file_path(tmpdir.strpath, 8888)) as file:
+        assert json.load(file)["data"]["pairs"] == [pair(0)] + block_domain_pairs(["ads.net"])
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+from pytest_hoverfly_wrapper.storage import FORMATS, SimulationStorage, load_simulation, main, read_simulation_bytes
+
+
+def make_simulation(*bodies):
+    pairs = [{"request": {}, "response": {"status": 200, "body": body, "headers": {}}} for body in bodies]
+    return {"data": {"pairs": pairs}, "meta": {"timeExported": "2020-04-05T18:27:15+01:00"}}
+
+
+@pytest.fixture
+def sim_dir(tmpdir):
+    return tmpdir.mkdir("generated")
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_round_trip(sim_dir, fmt):
+    path = sim_dir.join("sim.json").strpath
+    sim = make_simulation("small", "large\r\n" * 100, "large\r\n" * 100)
+    SimulationStorage(fmt, blob_threshold=100).save(path, json.loads(json.dumps(sim)))
+    assert load_simulation(path) == sim
+    assert json.loads(read_simulation_bytes(path)) == sim
+    # the two identical large bodies are stored once, outside the simulation file
+    blobs = [file for _, _, files in os.walk(sim_dir.dirpath("blobs").strpath) for file in files]
+    assert len(blobs) == 1
+
+
+def test_plain_json_sent_as_is(sim_dir):
+    path = sim_dir.join("sim.json").strpath
+    SimulationStorage().save(path, make_simulation("body"))
+    with open(path, "rb") as file:
+        assert read_simulation_bytes(path) == file.read()
+
+
+def test_convert(sim_dir):
+    path = sim_dir.join("sim.json").strpath
+    sim = make_simulation("x" * 1000)
+    SimulationStorage().save(path, json.loads(json.dumps(sim)))
+    main(["--format", "lzma", "--blob-threshold", "10", path])
+    with open(path, "rb") as file:
+        assert file.read(1) != b"{"
+    main([path])
+    with open(path) as file:
+        assert json.load(file) == sim
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        SimulationStorage("yaml")
+
+
+@pytest.mark.parametrize("fmt", ["json", "compact"])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_save_stream(sim_dir, fmt, chunk_size):
+    path = sim_dir.join("sim.json").strpath
+    sim = make_simulation("body ]}", "dropped", "another body")
+    sim["data"]["globalActions"] = {"delays": []}
+    text = json.dumps(sim)
+    chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    storage = SimulationStorage(fmt)
+    saved, skeleton = storage.save_stream(
+        path, chunks, lambda pairs: (pair for pair in pairs if pair["response"]["body"] != "dropped")
+    )
+
+    assert saved == 2
+    assert skeleton["meta"] == sim["meta"]
+    del sim["data"]["pairs"][1]
+    # Identical to saving the whole simulation in one go
+    with open(path) as file:
+        assert file.read() == storage.dumps(sim)
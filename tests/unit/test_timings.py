@@ -0,0 +1,76 @@
+import json
+import types
+
+import pytest
+
+from pytest_hoverfly_wrapper.timings import USER_PROPERTY, PhaseTimer, TimingReport, timed_iter
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [0.0]
+    mocker.patch("time.perf_counter", side_effect=lambda: now[0])
+    return now
+
+
+def test_phases_add_up(clock):
+    timer = PhaseTimer()
+    for _ in range(2):
+        with timer.phase("load_simulation"):
+            clock[0] += 1.5
+    assert timer.phases == {"load_simulation": 3.0}
+
+
+def test_phase_excludes_nested_phases(clock):
+    timer = PhaseTimer()
+
+    def entries():
+        for i in range(3):
+            clock[0] += 2
+            yield i
+
+    with timer.phase("write_logs", excluding=("journal",)):
+        for _ in timed_iter(entries(), timer, "journal"):
+            clock[0] += 1
+    assert timer.phases == {"write_logs": 3, "journal": 6}
+
+
+def report(nodeid, phases, when="teardown"):
+    return types.SimpleNamespace(nodeid=nodeid, when=when, user_properties=[("other", 1), (USER_PROPERTY, phases)])
+
+
+def test_report_collects_teardown_reports():
+    timing_report = TimingReport(count=1)
+    timing_report.pytest_runtest_logreport(report("test_a", {"start_hoverfly": 1.0}, when="call"))
+    timing_report.pytest_runtest_logreport(report("test_b", {"start_hoverfly": 1.0, "journal": 0.5}))
+    timing_report.pytest_runtest_logreport(report("test_c", {"start_hoverfly": 2.0}))
+    assert list(timing_report.tests) == ["test_b", "test_c"]
+    assert timing_report.phase_totals() == {"start_hoverfly": 3.0, "journal": 0.5}
+    assert timing_report.slowest_tests() == [("test_c", {"start_hoverfly": 2.0})]
+
+
+def test_report_summary_and_json(tmpdir, mocker):
+    path = tmpdir.join("timings.json").strpath
+    timing_report = TimingReport(count=5, json_path=path)
+    timing_report.pytest_runtest_logreport(report("test_a", {"load_simulation": 0.25, "stop_hoverfly": 0.75}))
+
+    terminalreporter = mocker.Mock()
+    timing_report.pytest_terminal_summary(terminalreporter)
+    terminalreporter.section.assert_called_once_with("hoverfly timings")
+    lines = [call.args[0] for call in terminalreporter.write_line.call_args_list]
+    assert any("test_a (mostly stop_hoverfly: 0.750s)" in line for line in lines)
+
+    timing_report.pytest_sessionfinish()
+    with open(path) as file:
+        assert json.load(file) == {
+            "phases": {"stop_hoverfly": 0.75, "load_simulation": 0.25},
+            "tests": [{"nodeid": "test_a", "total": 1.0, "phases": {"load_simulation": 0.25, "stop_hoverfly": 0.75}}],
+        }
+
+
+def test_report_without_summary(mocker):
+    timing_report = TimingReport(json_path="timings.json")
+    timing_report.pytest_runtest_logreport(report("test_a", {"journal": 0.1}))
+    terminalreporter = mocker.Mock()
+    timing_report.pytest_terminal_summary(terminalreporter)
+    terminalreporter.section.assert_not_called()